@@ -0,0 +1,120 @@
+"""Synthetic trees
+
+Generators of the tree shapes measured by the benchmarks, every generator returns the root of the tree and the list of
+its input leaves, with the leaves filled with random series of the given length unless `fill` is False.
+
+Examples:
+    >>> from benchmarks.generators import chain, fan_in
+    >>> root, leaves = chain(depth=3, rows=10)
+    >>> root.height, len(leaves)
+    (3, 1)
+    >>> root, leaves = fan_in(width=4, rows=10)
+    >>> root.formula
+    'x0 + x1 + x2 + x3'
+
+The module contains the following functions:
+
+- `series(rows: int, seed: int = 0) -> pd.Series`
+- `fill_leaves(leaves: List[Node], rows: int) -> None`
+- `chain(depth: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]`
+- `fan_in(width: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]`
+- `diamond(width: int, depth: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]`
+- `iuk_flows(copies: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]`
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tree import Node, SymlinkNode, batch
+
+IUK_FLOWS = (
+    'MAX(MIN((0.1 * (nbp_ttf - full_iuk)), 1), 0) * (iuk_technical_capacity - iuk_booked_capacity) + '
+    'MAX(MIN(0.3 * (nbp_ttf - sunk_iuk), 1), 0) * (iuk_booked_capacity - bacton_booked_capacity) + '
+    'MAX(MIN(0.5 * (nbp_ttf - sunk_bacton), 1), 0) * bacton_booked_capacity'
+)
+SUNK_BACTON = ('national_grid_commodity_entry', 'iuk_commodity_be_uk', 'gts_exit', 'fluxys_nl_zee_ocuc', 'fluxys_commodity')
+
+
+def series(rows: int, seed: int = 0) -> pd.Series:
+    """Random series from the first gas day of October 2000, daily up to 50k rows and by the minute beyond."""
+    index = pd.date_range('2000-10-01 06:00', periods=rows, freq='D' if rows <= 50000 else 'T')
+    return pd.Series(np.random.default_rng(seed).random(rows), index=index)
+
+
+def fill_leaves(leaves: List[Node], rows: int) -> None:
+    """Set random series on the leaves in a single batch."""
+    with batch():
+        for i, leaf in enumerate(leaves):
+            leaf.series = series(rows, seed=i)
+
+
+def chain(depth: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]:
+    """Chain of nodes each adding one to its only child."""
+    root = node = Node('n0', formula='n1 + 1')
+    for i in range(1, depth):
+        node = Node(f'n{i}', parent=node, formula=f'n{i + 1} + 1')
+    leaf = Node(f'n{depth}', parent=node)
+    if fill:
+        fill_leaves([leaf], rows)
+    return root, [leaf]
+
+
+def fan_in(width: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]:
+    """Root summing many leaves."""
+    root = Node('root', formula=' + '.join(f'x{i}' for i in range(width)))
+    leaves = [Node(f'x{i}', parent=root) for i in range(width)]
+    if fill:
+        fill_leaves(leaves, rows)
+    return root, leaves
+
+
+def diamond(width: int, depth: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]:
+    """Layers of nodes reading every node of the layer below through symbolic nodes."""
+    leaves = [Node(f'x{i}') for i in range(width)]
+    layer = leaves
+    for d in range(depth):
+        formula = ' + '.join(n.name for n in layer)
+        below, layer = layer, []
+        for i in range(width):
+            node = Node(f'l{d}_{i}', formula=f'({formula}) * {i + 1} / {width}')
+            node.children = [SymlinkNode(n) for n in below]
+            layer.append(node)
+    root = Node('root', formula=' + '.join(n.name for n in layer))
+    root.children = [SymlinkNode(n) for n in layer]
+    if fill:
+        fill_leaves(leaves, rows)
+    return root, leaves
+
+
+def iuk_flows(copies: int, rows: int, fill: bool = True) -> Tuple[Node, List[Node]]:
+    """Copies of the IUK flows model of tree/example.py summed by a root node."""
+    root = Node('total', formula=' + '.join(f'iuk_flows_{i}' for i in range(copies)))
+    leaves = []
+    for i in range(copies):
+        flows = Node(f'iuk_flows_{i}', parent=root, formula=IUK_FLOWS)
+        nbp_ttf = Node('nbp_ttf', parent=flows, formula='nbp - ttf * fx * 100 / 34.121416')
+        leaves += [Node(name, parent=nbp_ttf) for name in ('nbp', 'ttf', 'fx')]
+        leaves.append(Node('iuk_technical_capacity', parent=flows))
+        iuk_booked_capacity = Node('iuk_booked_capacity', parent=flows)
+        leaves.append(iuk_booked_capacity)
+
+        bacton_booked_capacity = Node('bacton_booked_capacity', formula='MIN(bacton_booked_entry, iuk_booked_capacity)')
+        leaves.append(Node('bacton_booked_entry', parent=bacton_booked_capacity))
+        SymlinkNode(iuk_booked_capacity, parent=bacton_booked_capacity)
+
+        sunk_bacton = Node('sunk_bacton', formula=' + '.join(SUNK_BACTON))
+        leaves += [Node(name, parent=sunk_bacton) for name in SUNK_BACTON]
+        sunk_iuk = Node('sunk_iuk', formula='sunk_bacton + bacton_entry')
+        leaves.append(Node('bacton_entry', parent=sunk_iuk))
+        SymlinkNode(sunk_bacton, parent=sunk_iuk)
+        full_iuk = Node('full_iuk', formula='sunk_iuk + iuk_be_uk')
+        leaves.append(Node('iuk_be_uk', parent=full_iuk))
+        SymlinkNode(sunk_iuk, parent=full_iuk)
+
+        for node in (bacton_booked_capacity, full_iuk, sunk_iuk, sunk_bacton):
+            SymlinkNode(node, parent=flows)
+    if fill:
+        fill_leaves(leaves, rows)
+    return root, leaves
@@ -0,0 +1,77 @@
+"""Priority benchmark
+
+Measure `priority` against the chained `combine_first` it replaces for a growing number of sources, every source being
+a random series with gaps starting a few days after the previous one as when stitching curves. The time per source
+stays flat as the number of sources grows when the merge is linear in k.
+
+Examples:
+    $ python -m benchmarks.priority
+    $ python -m benchmarks.priority --sources 2 5 10 20 --rows 1000000 --output priority.json
+
+The module contains the following functions:
+
+- `sources(k: int, rows: int) -> List[pd.Series]`
+- `run(ks: Iterable[int] = KS, rows: int = ROWS, repeat: int = 5) -> List[dict]`
+- `main(argv: List[str] = None) -> int`
+"""
+
+import sys
+import json
+import argparse
+from functools import reduce
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from tree.functions import priority
+from benchmarks import generators
+from benchmarks.run import _time
+
+KS = (2, 5, 10, 20)
+ROWS = 100_000
+
+
+def sources(k: int, rows: int) -> List[pd.Series]:
+    """Random series with a third of the values missing, each one starting seven rows after the previous one."""
+    items = []
+    for i in range(k):
+        s = generators.series(rows, seed=i)
+        s = s.set_axis(s.index + 7 * i * s.index.freq)
+        s[np.random.default_rng(k + i).random(rows) < 1 / 3] = np.nan
+        items.append(s)
+    return items
+
+
+def run(ks: Iterable[int] = KS, rows: int = ROWS, repeat: int = 5) -> List[dict]:
+    """Time both merges for every number of sources."""
+    results = []
+    for k in ks:
+        args = sources(k, rows)
+        single = _time(lambda: priority(*args), repeat)['value']
+        chained = _time(lambda: reduce(lambda l, r: l.combine_first(r), args), repeat)['value']
+        results.append({
+            'k': k, 'rows': rows, 'priority': single, 'combine_first': chained,
+            'priority_per_source': single / k, 'combine_first_per_source': chained / k, 'unit': 's',
+        })
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.priority', description='Benchmark priority().')
+    parser.add_argument('--sources', nargs='+', type=int, default=list(KS))
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args.sources, args.rows, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    print(pd.DataFrame(results).set_index('k').drop(columns='unit').to_string())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Benchmark runner
+
+Measure, for every tree shape and series length, the construction time, the initial load, the propagation latency of a
+single leaf and of all the leaves at once, the peak memory, the export time of `to_json`/`pprint` and the compilation
+time of the formulas. The results are written as JSON and can be compared against a baseline run.
+
+Examples:
+    $ python -m benchmarks.run --output baseline.json
+    $ python -m benchmarks.run --rows 1000 100000 10000000 --output full.json
+    $ python -m benchmarks.run --baseline baseline.json --tolerance 0.25
+
+The compare mode exits with the status 1 when a measurement is slower, or larger, than the baseline by more than the
+tolerance. The shapes are scaled down beyond 100k rows so that the 10M rows runs fit in memory.
+
+The module contains the following functions:
+
+- `run(shapes: Iterable[str] = SHAPES, rows: Iterable[int] = ROWS, repeat: int = 5) -> dict`
+- `compare(results: dict, baseline: dict, tolerance: float = 0.2) -> List[dict]`
+- `main(argv: List[str] = None) -> int`
+"""
+
+import io
+import sys
+import json
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime
+from statistics import median
+from contextlib import redirect_stdout
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from anytree import PreOrderIter
+
+from tree import Node, batch
+from tree.utils import compile_formula
+from benchmarks import generators
+
+ROWS = (1_000, 100_000)
+
+
+def _scale(size: int, rows: int) -> int:
+    return max(2, int(size * min(1.0, 100_000 / rows)))
+
+
+# Tree builders per shape, called with the series length and whether to fill the leaves
+SHAPES: Dict[str, Callable[[int, bool], Tuple[Node, List[Node]]]] = {
+    'chain': lambda rows, fill: generators.chain(_scale(50, rows), rows, fill),
+    'fan_in': lambda rows, fill: generators.fan_in(_scale(100, rows), rows, fill),
+    'diamond': lambda rows, fill: generators.diamond(_scale(8, rows), 4, rows, fill),
+    'iuk_flows': lambda rows, fill: generators.iuk_flows(_scale(20, rows) // 2, rows, fill),
+}
+
+
+def _time(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+    return {'value': min(timings), 'median': median(timings), 'unit': 's'}
+
+
+def _case(shape: str, rows: int, repeat: int) -> Dict[str, dict]:
+    build = SHAPES[shape]
+    metrics = {'construction': _time(lambda: build(rows, False), repeat)}
+
+    tracemalloc.start()
+    root, leaves = build(rows, False)
+    metrics['load'] = _time(lambda: generators.fill_leaves(leaves, rows), 1)
+    metrics['peak_memory'] = {'value': tracemalloc.get_traced_memory()[1], 'unit': 'B'}
+    tracemalloc.stop()
+
+    updates = [generators.series(rows, seed=len(leaves) + i) for i in range(2)]
+    toggle = iter(range(10 ** 9))
+
+    def one():
+        leaves[0].series = updates[next(toggle) % 2]
+
+    def every():
+        update = updates[next(toggle) % 2]
+        with batch():
+            for leaf in leaves:
+                leaf.series = update
+
+    metrics['propagate_one'] = _time(one, repeat)
+    metrics['propagate_all'] = _time(every, repeat)
+    metrics['to_json'] = _time(root.to_json, repeat)
+    with redirect_stdout(io.StringIO()):
+        metrics['pprint'] = _time(root.pprint, repeat)
+
+    formulas = [n.formula for n in PreOrderIter(root) if isinstance(n, Node) and n.formula]
+    metrics['compile'] = _time(lambda: [compile_formula.__wrapped__(f) for f in formulas], repeat)
+
+    nodes = sum(1 for _ in PreOrderIter(root))
+    return {name: {'shape': shape, 'rows': rows, 'nodes': nodes, **value} for name, value in metrics.items()}
+
+
+def run(shapes: Iterable[str] = tuple(SHAPES), rows: Iterable[int] = ROWS, repeat: int = 5) -> dict:
+    """Run the benchmarks, with the logging of the tree disabled, and return the results and the environment."""
+    logger.disable('tree')
+    results = []
+    for shape in shapes:
+        for n in rows:
+            for metric, value in _case(shape, n, repeat).items():
+                results.append({'metric': metric, **value})
+    meta = {
+        'created_at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+        'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(),
+    }
+    logger.enable('tree')
+    return {'meta': meta, 'results': results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> List[dict]:
+    """Return the measurements of both runs with their ratio, flagged when the ratio exceeds 1 + tolerance."""
+    def key(item):
+        return item['shape'], item['rows'], item['metric']
+
+    previous = {key(item): item for item in baseline['results']}
+    rows = []
+    for item in results['results']:
+        other = previous.get(key(item))
+        if other is None:
+            continue
+        ratio = item['value'] / other['value'] if other['value'] else 1.0
+        rows.append({
+            'shape': item['shape'], 'rows': item['rows'], 'metric': item['metric'], 'baseline': other['value'],
+            'value': item['value'], 'ratio': ratio, 'regression': ratio > 1 + tolerance,
+        })
+    return rows
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Benchmark the tree.')
+    parser.add_argument('--shapes', nargs='+', default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument('--rows', nargs='+', type=int, default=list(ROWS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare the results against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.shapes, args.rows, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if not args.baseline:
+        frame = pd.DataFrame(results['results']).set_index(['shape', 'rows', 'metric'])
+        print(frame[['nodes', 'value', 'unit']].to_string())
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    rows = compare(results, baseline, args.tolerance)
+    if rows:
+        print(pd.DataFrame(rows).set_index(['shape', 'rows', 'metric']).to_string())
+    return int(any(row['regression'] for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
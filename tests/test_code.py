@@ -1,7 +1,29 @@
+import os
+import ast
+import json
+import gc
+import asyncio
+import weakref
 import pytest
+import numpy as np
 import pandas as pd
 from tree.node import Node, SymlinkNode
 from tree.exceptions import ReadOnlyError, FormulaError
+from tree.utils import compile_formula, series_equal
+from tree.registry import get_registry
+from tree.scheduler import Scheduler
+from tree.deferred import get_queue
+from tree.ingest import Ingestor
+from tree.optimizer import fold_constants
+from tree.scenario import ScenarioSet
+from tree.shared import Publisher, Reader
+from tree.changes import current_epoch
+from tree.inference import OutputType, analyze
+from tree.gas_calendar import period_starts, resample, resample_tail
+from tree.profiling import Profiler, get_profiler
+from tree.engine import subscribe, unsubscribe
+from benchmarks import generators, run as benchmarks, priority as priority_benchmark
+from tree.functions import priority, MAX, MIN, CLIP, WHERE, ABS, SHIFT, CUMSUM
 
 
 def test_read_only():
@@ -62,5 +84,885 @@ def test_symlink_node():
     pd.testing.assert_series_equal(a.series, v + 2)
 
 
+def test_compiled_formula():
+    a = Node('a', formula='b - c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a)
+    x = Node('x', formula='b - c')
+    assert compile_formula(a.formula) is compile_formula(x.formula)
+
+    b.series = pd.Series([3], dtype='float64')
+    c.series = pd.Series([1], dtype='float64')
+    pd.testing.assert_series_equal(a.series, pd.Series([2], dtype='float64'))
+
+    c.parent = None
+    assert a._evaluator is None
+    with pytest.raises(FormulaError):
+        a.calculate()
+
+
+def test_function_registry(tmp_path):
+    assert Node('a').registry is Node('b').registry
+
+    path = tmp_path / 'funcs.py'
+    path.write_text("__all__ = ['DOUBLE']\n\n\ndef DOUBLE(x):\n    return x * 2\n")
+    assert get_registry(str(path)) is get_registry(str(path))
+
+    a = Node('a', formula='DOUBLE(b)', funcs_path=str(path))
+    b = Node('b', parent=a)
+    b.series = pd.Series([1], dtype='float64')
+    pd.testing.assert_series_equal(a.series, pd.Series([2], dtype='float64'))
+
+    x = Node('x', formula='TRIPLE(y)', functions={'TRIPLE': lambda v: v * 3})
+    y = Node('y', parent=x)
+    y.series = pd.Series([1], dtype='float64')
+    pd.testing.assert_series_equal(x.series, pd.Series([3], dtype='float64'))
+
+    with pytest.raises(FormulaError):
+        x.formula = 'MAX(y, 0)'
+
+    # Swapping the functions recalculates with the new ones although the inputs are unchanged
+    x.registry = {'TRIPLE': lambda v: v * 30}
+    x.calculate()
+    pd.testing.assert_series_equal(x.series, pd.Series([30], dtype='float64'))
+
+
+def test_batch():
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a, formula='s * 2')
+    c = Node('c', parent=a, formula='s + t')
+    s = Node('s', parent=c)
+    t = Node('t', parent=c)
+    SymlinkNode(s, parent=b)
+
+    with a.batch() as batch:
+        s.series = pd.Series([1], dtype='float64')
+        t.series = pd.Series([2], dtype='float64')
+        pd.testing.assert_series_equal(a.series, pd.Series(dtype='float64'))
+
+    assert dict(batch.calculations) == {a: 1, b: 1, c: 1}
+    pd.testing.assert_series_equal(a.series, pd.Series([5], dtype='float64'))
+
+    a.trigger_type = 'all'
+    with a.batch() as batch:
+        t.series = pd.Series([3], dtype='float64')
+    assert dict(batch.calculations) == {a: 1, c: 1}
+    pd.testing.assert_series_equal(a.series, pd.Series([6], dtype='float64'))
+
+
+def test_vectorized_functions():
+    x = pd.Series([1, np.nan, 3, -4], index=[0, 1, 2, 5], dtype='float64')
+    y = pd.Series([2, 2, np.nan], index=[1, 2, 3], dtype='float64')
+    for left, right in [(x, y), (y, x), (x, 1)]:
+        pd.testing.assert_series_equal(MAX(left, right), left.combine(right, max))
+        pd.testing.assert_series_equal(MIN(left, right), left.combine(right, min))
+
+    df = pd.DataFrame({'u': [1, 5], 'v': [3, -1]}, dtype='float64')
+    expected = pd.DataFrame({'u': [2, 5], 'v': [3, 2]}, dtype='float64')
+    pd.testing.assert_frame_equal(MAX(df, pd.Series([2, 2], dtype='float64')), expected)
+
+    pd.testing.assert_series_equal(CLIP(x, 0, 2), x.clip(0, 2))
+    pd.testing.assert_series_equal(WHERE(x > 0, x, 0), x.where(x > 0, 0))
+    pd.testing.assert_series_equal(CUMSUM(SHIFT(ABS(x))), x.abs().shift().cumsum())
+
+
+def test_change_detection():
+    a = Node('a', formula='b * 2')
+    b = Node('b', parent=a)
+
+    b.series = pd.Series([1, np.nan], dtype='float64')
+    assert (b.version, a.version) == (1, 1)
+
+    b.series = pd.Series([1, np.nan], dtype='float64')
+    assert (b.version, a.version) == (1, 1)
+
+    b.series = pd.Series([2, np.nan], dtype='float64')
+    assert (b.version, a.version) == (2, 2)
+
+    a.series = pd.Series([0, 0], dtype='float64')
+    a.calculate()
+    assert a.version == 3
+    a.calculate(force=True)
+    pd.testing.assert_series_equal(a.series, pd.Series([4, np.nan], dtype='float64'))
+
+    assert not series_equal(pd.Series([1], dtype='float64'), pd.Series([1], dtype='int64'))
+    assert not series_equal(pd.Series([1], dtype='float64'), pd.Series([1], index=[1], dtype='float64'))
+
+    # The first value of a leaf is a change, the empty series is only built when read
+    c = Node('c')
+    c.series = pd.Series(dtype='float64')
+    assert c.version == 1 and Node('d').series.empty
+
+
+def test_append():
+    r = Node('r', formula='a * 2 + CUMSUM(a)')
+    a = Node('a', parent=r, formula='MAX(b - c, 0)')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a)
+
+    index = pd.date_range('2022-10-01', periods=10)
+    values = pd.Series(np.arange(10), index=index, dtype='float64')
+    with r.batch():
+        b.series = values.iloc[:6]
+        c.series = values.iloc[:4] / 2
+
+    b.append(values.iloc[6:])
+    c.append(values.iloc[4:7] / 2)
+    assert a._changes and not r._changes
+
+    expected = (values - values.iloc[:7] / 2).clip(lower=0)
+    pd.testing.assert_series_equal(a.series, expected)
+    pd.testing.assert_series_equal(r.series, expected * 2 + expected.cumsum())
+
+    with pytest.raises(ValueError):
+        b.append(values.iloc[:1])
+
+
+def test_columnar():
+    a = Node('a', formula='MAX(b - c, 0)')
+    b = Node('b', parent=a, series=pd.Series([1, 2, 3], dtype='float64'))
+    c = Node('c', parent=a, series=pd.Series([2], index=[1], dtype='float64'))
+    store = a.use_columnar()
+    a.calculate()
+
+    pd.testing.assert_series_equal(a.series, pd.Series([np.nan, 0, np.nan], name='a'))
+    assert a.series.values.base is store.values.base
+    assert a.dataframe.values.base is store.values.base
+
+    c.series = pd.Series([1, 1, 1], dtype='float64')
+    b.append(pd.Series([5], index=[3], dtype='float64'))
+    pd.testing.assert_series_equal(a.series, pd.Series([0, 1, 2, np.nan], name='a'))
+
+    c.parent = None
+    assert c not in store
+    pd.testing.assert_series_equal(c.series, pd.Series([1, 1, 1, np.nan], name='c'))
+
+
+@pytest.mark.parametrize('executor', ['serial', 'thread', 'process'])
+def test_scheduler(executor):
+    a = Node('a', formula='MAX(b, c) + d')
+    b = Node('b', parent=a, formula='x * 2')
+    c = Node('c', parent=a, formula='x + y')
+    d = Node('d', parent=a, formula='ABS(y)')
+    x = Node('x', parent=b)
+    SymlinkNode(x, parent=c)
+    y = Node('y', parent=c)
+    SymlinkNode(y, parent=d)
+
+    with Scheduler(executor, max_workers=2) as scheduler, a.batch(scheduler=scheduler) as batch:
+        x.series = pd.Series([1, 5], dtype='float64')
+        y.series = pd.Series([-2, 3], dtype='float64')
+
+    assert dict(batch.calculations) == {a: 1, b: 1, c: 1, d: 1}
+    pd.testing.assert_series_equal(a.series, pd.Series([4, 13], dtype='float64'))
+
+
+def test_deferred_flush():
+    a = Node('a', formula='b + 1')
+    b = Node('b', parent=a, formula='x * 2', is_deferred=True)
+    x = Node('x', parent=b)
+    queue = get_queue()
+
+    async def main():
+        state = a.next_state()
+        for i in range(5):
+            x.series = pd.Series([i], dtype='float64')
+        assert b in queue and len(b.series) == 0
+        assert await a.flush() == 1
+        return await state
+
+    pd.testing.assert_series_equal(asyncio.run(main()), pd.Series([9], dtype='float64'))
+
+    async def debounced():
+        queue.debounce = 0.01
+        try:
+            state = b.next_state()
+            x.series = pd.Series([10], dtype='float64')
+            return await asyncio.wait_for(state, 1)
+        finally:
+            queue.debounce = None
+
+    pd.testing.assert_series_equal(asyncio.run(debounced()), pd.Series([20], dtype='float64'))
+
+    # A tree dropped while queued is neither kept alive nor recalculated
+    d = Node('d', formula='y * 2', is_deferred=True)
+    Node('y', parent=d).series = pd.Series([1.0])
+    ref = weakref.ref(d)
+    assert d in queue
+    del d
+    gc.collect()
+    assert ref() is None and len(queue) == 0 and queue.flush() == 0
+
+
+def test_ingestor(tmp_path):
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a, formula='x * 2')
+    x = Node('x', parent=c)
+
+    index = pd.date_range('2022-10-01', periods=48, freq='H', name='date')
+    df = pd.DataFrame({'b': np.arange(48.0), 'x': np.ones(48), 'other': 0.0}, index=index)
+    df.to_csv(tmp_path / 'inputs.csv')
+
+    calculations = []
+
+    def on_flushed(batch):
+        calculations.append(batch.calculations[a])
+
+    subscribe('flushed', on_flushed)
+    try:
+        ingestor = Ingestor(a, chunksize=24)
+        assert ingestor.read_csv(tmp_path / 'inputs.csv', chunksize=12) == 4
+    finally:
+        unsubscribe('flushed', on_flushed)
+
+    assert calculations == [1, 1, 1, 1] and ingestor.rows == 48
+    pd.testing.assert_series_equal(a.series, df['b'] + 2, check_names=False, check_freq=False)
+
+    with pytest.raises(KeyError):
+        Ingestor(a, strict=True).ingest(df)
+
+
+def test_snapshot(tmp_path):
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a, formula='s * 2')
+    s = Node('s', parent=c)
+    x = Node('x', formula='y - c', is_deferred=True)
+    y = Node('y', parent=x)
+    SymlinkNode(c, parent=x)
+
+    index = pd.date_range('2022-10-01', periods=3, tz='Europe/London')
+    with a.batch():
+        for node in (b, s, y):
+            node.series = pd.Series([1, 2, 3], index=index, dtype='float64')
+    x.save(tmp_path)
+
+    root = Node.load(tmp_path)
+    assert root.name == 'x' and root.is_deferred
+    assert isinstance(root.children[0].series.values.base, np.memmap)
+    linked = root.children[1].target
+    pd.testing.assert_series_equal(linked.root.series, a.series)
+    assert linked.root.version == a.version and linked._input_versions == c._input_versions
+
+    # The trigger counters and the inferred outputs are restored in bulk
+    assert [n._blocking for n in (root, linked, linked.root)] == [x._blocking, c._blocking, a._blocking]
+    assert linked.root.output.dtype == np.float64 and linked.root.output.length == 3
+
+    linked.children[0].series = pd.Series([0, 0, 0], index=index, dtype='float64')
+    pd.testing.assert_series_equal(linked.root.series, b.series)
+
+
+def test_memory_budget():
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a, formula='x * 2', retention='evict')
+    c = Node('c', parent=a, formula='y * 3', retention='evict')
+    d = Node('d', parent=a, formula='x + 1', retention='none')
+    x = Node('x', parent=b)
+    y = Node('y', parent=c)
+    SymlinkNode(x, parent=d)
+    a.formula = 'b + c + d'
+
+    budget = a.set_memory_budget(8000)
+    with a.batch():
+        x.series = pd.Series(range(1000), dtype='float64')
+        y.series = pd.Series(range(1000), dtype='float64')
+
+    assert budget.resident == 8000 and budget.evictions == 2
+    assert d._series is None and b._evicted
+    expected = x.series * 3 + y.series * 3 + 1
+    pd.testing.assert_series_equal(a.series, expected, check_names=False)
+    pd.testing.assert_series_equal(d.series, x.series + 1, check_names=False)
+    assert d._series is None and budget.resident <= 8000
+
+    report = a.memory_report()
+    assert report['/a'] == 8000 and report['/a/d'] == 0
+
+    version = a.version
+    x.series = pd.Series(range(1000), dtype='float64')
+    assert a.version == version
+
+    # A recomputed value equal to the evicted one is no change
+    e = Node('e', formula='z * 0')
+    z = Node('z', parent=e)
+    z.series = pd.Series([1.0, 2.0])
+    assert e.evict() and e.version == 1
+    z.series = pd.Series([3.0, 4.0])
+    assert e.version == 1 and e._evicted
+    z.series = pd.Series([3.0, np.nan])
+    assert e.version == 2 and e.series.tolist()[0] == 0.0
+
+
+def test_profiler(tmp_path):
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a, formula='s * 2')
+    s = Node('s', parent=c)
+    x = Node('x', formula='c + 1')
+    SymlinkNode(c, parent=x)
+
+    b.series = pd.Series([1.0, 2.0])
+    s.series = pd.Series([0.0, 0.0])
+    assert get_profiler() is None
+    with Profiler() as profiler:
+        with a.batch():
+            b.series = pd.Series([2.0, 3.0])
+            s.series = pd.Series([1.0, 1.0])
+        b.series = pd.Series([2.0, 3.0])
+    assert get_profiler() is None
+
+    assert profiler.stats(a).calculations == 1 and profiler.stats(c).calculations == 1
+    assert profiler.stats(x).triggers == {'/x/c': 1}
+    assert profiler.stats(b).comparisons == 2
+    report = profiler.report()
+    assert set(report.index) == {'/a', '/a/b', '/a/c', '/a/c/s', '/x'}
+
+    assert len(profiler.updates) == 1
+    trace = profiler.trace_tree(0)
+    names = {item['name']: item for item in trace['children']}
+    assert set(names) == {'/a', '/x'}
+    assert names['/x']['children'][0] == {
+        'name': '/a/c', 'duration': profiler.stats(c).last_time, 'via': '/x/c',
+        'children': [{'name': '/a/c/s', 'duration': 0.0, 'changed': True}],
+    }
+
+    chrome = profiler.to_chrome_trace(tmp_path / 'trace.json')
+    events = [e['name'] for e in chrome['traceEvents'] if e['cat'] == 'calculate']
+    assert events[0] == '/a/c' and set(events) == {'/a/c', '/a', '/x'} and (tmp_path / 'trace.json').exists()
+
+
+def test_benchmarks(tmp_path):
+    root, leaves = generators.diamond(width=3, depth=2, rows=10)
+    assert len(leaves) == 3 and root.formula == 'l1_0 + l1_1 + l1_2'
+    layer = [sum(leaf.series for leaf in leaves) * (i + 1) / 3 for i in range(3)]
+    layer = [sum(layer) * (i + 1) / 3 for i in range(3)]
+    pd.testing.assert_series_equal(root.series, sum(layer), check_names=False)
+
+    root, leaves = generators.iuk_flows(copies=2, rows=10)
+    assert len(leaves) == 26 and len(root.series) == 10
+
+    path = tmp_path / 'baseline.json'
+    assert benchmarks.main(['--shapes', 'chain', 'fan_in', '--rows', '100', '--repeat', '1', '--output', str(path)]) == 0
+    results = json.loads(path.read_text())
+    metrics = {item['metric'] for item in results['results']}
+    assert metrics == {'construction', 'load', 'peak_memory', 'propagate_one', 'propagate_all', 'to_json', 'pprint',
+                       'compile'}
+    rows = benchmarks.compare(results, results)
+    assert len(rows) == 16 and not any(row['regression'] for row in rows)
+
+
+def test_gas_calendar(monkeypatch):
+    hours = pd.date_range('2022-09-30 03:00', periods=4, freq='H', tz='Europe/London')
+    assert list(period_starts(hours, 'gas_day').astype(str)) == ['2022-09-29', '2022-09-29', '2022-09-30', '2022-09-30']
+
+    days = pd.date_range('2022-03-30', periods=600, freq='D')
+    weeks = pd.Series(period_starts(days, 'gas_week')).value_counts().sort_index()
+    assert weeks['2022-09-30'] == 1 and weeks['2022-10-01'] == 7 and weeks['2022-10-08'] == 7
+    seasons = resample(pd.Series(1.0, index=days), 'season', 'sum')
+    assert seasons.to_dict() == {
+        pd.Timestamp('2021-10-01'): 2.0, pd.Timestamp('2022-04-01'): 183.0, pd.Timestamp('2022-10-01'): 182.0,
+        pd.Timestamp('2023-04-01'): 183.0, pd.Timestamp('2023-10-01'): 50.0,
+    }
+    with pytest.raises(ValueError):
+        period_starts(days, 'fortnight')
+
+    a = Node('a', formula='b * 2')
+    b = Node('b', parent=a)
+    index = pd.date_range('2022-01-01', periods=24 * 400, freq='H', tz='Europe/London')
+    values = pd.Series(np.random.default_rng(0).random(len(index)), index=index)
+    b.series = values.iloc[:5000]
+    weekly = a.resample('gas_week', 'sum')
+    assert a.resample('gas_week', 'sum') is weekly
+
+    tails = []
+    monkeypatch.setattr('tree.node.resample_tail', lambda *args: tails.append(args[2]) or resample_tail(*args))
+    b.append(values.iloc[5000:7000])
+    b.append(values.iloc[7000:])
+    pd.testing.assert_series_equal(a.resample('gas_week', 'sum'), resample(a.series, 'gas_week', 'sum'))
+    pd.testing.assert_series_equal(a.resample('gas_year', 'max'), a.series.groupby(
+        [pd.Timestamp(f'{t.year - (t.month < 10)}-10-01') for t in (a.series.index - pd.Timedelta(hours=5))]
+    ).max(), check_names=False, check_index_type=False)
+    assert tails == [values.index[5000]]
+
+    b.series = values * 2
+    pd.testing.assert_series_equal(a.resample('gas_week', 'sum'), resample(a.series, 'gas_week', 'sum'))
+    assert len(tails) == 1
+
+    # A tail starting before 05:00 belongs to the previous gas day, even at midnight
+    hourly = pd.Series(1.0, index=pd.date_range('2022-10-01 06:00', periods=24 * 10, freq='H'))
+    c = Node('c')
+    c.series = hourly[:'2022-10-07 23:00']
+    c.resample('gas_day', 'sum')
+    c.append(hourly['2022-10-08 00:00':])
+    daily = c.resample('gas_day', 'sum')
+    assert daily.index.is_unique and len(tails) == 2
+    pd.testing.assert_series_equal(daily, resample(hourly, 'gas_day', 'sum'))
+
+
+def test_overrides(tmp_path):
+    a = Node('a', formula='b * 2')
+    b = Node('b', parent=a, curve='nbp')
+    index = pd.date_range('2022-10-01', periods=48, freq='H', tz='Europe/London')
+    b.series = pd.Series(1.0, index=index)
+
+    with pytest.raises(ValueError):
+        b.override(5.0, '2022-10-01', reason='')
+    with pytest.raises(ValueError):
+        b.override(5.0, '2022-10-01', reason='Wrong curve', curve='ttf')
+
+    first = b.override(
+        5.0, '2022-10-02', reason='Outage', user='analyst', start_effective_date='2022-09-01',
+        end_effective_date='2022-09-30', created_at='2022-09-01 12:00',
+    )
+    assert first.version == 1 and first.end_point_date == pd.Timestamp('2022-10-02')
+    assert (a.series.iloc[24:] == 10.0).all() and (a.series.iloc[:24] == 2.0).all()
+    assert a._tail_start(a.version - 1) == index[24]
+
+    second = b.override(
+        7.0, '2022-10-02 06:00', '2022-10-02 07:00', frequency='H', reason='Correction',
+        start_effective_date='2022-09-15', created_at='2022-09-15 12:00',
+    )
+    assert b.series.iloc[24:32].tolist() == [5.0] * 6 + [7.0] * 2
+
+    assert (b.as_of(version=0) == 1.0).all()
+    assert b.as_of(time='2022-09-10').iloc[24:32].tolist() == [5.0] * 8
+    assert b.as_of(effective='2022-09-20').iloc[30:32].tolist() == [5.0] * 2
+    window = b.as_of(version=0, start=index[2], end=index[3])
+    assert len(window) == 2 and window.values.base is not None
+
+    b.retract(first.version, reason='Outage cancelled')
+    assert b.series.iloc[24:32].tolist() == [1.0] * 6 + [7.0] * 2
+    assert b.as_of(version=second.version).iloc[24:32].tolist() == [5.0] * 6 + [7.0] * 2
+    pd.testing.assert_series_equal(a.series, b.series * 2)
+
+    b.append(pd.Series(3.0, index=pd.date_range(index[-1] + pd.Timedelta(hours=1), periods=2, freq='H')))
+    b.series = pd.Series(0.0, index=index)
+    assert b.series.iloc[30:32].tolist() == [7.0, 7.0] and b.series.sum() == 14.0
+
+    history = b.overrides.history()
+    assert list(history.index) == [1, 2] and history.loc[1, 'retracted_version'] == 3
+    assert history.loc[1, 'retraction_reason'] == 'Outage cancelled' and history.loc[2, 'curve'] == 'nbp'
+    with pytest.raises(KeyError):
+        b.retract(first.version)
+
+    # The curve, the history and the base series survive a snapshot
+    a.save(tmp_path)
+    loaded = Node.load(tmp_path).children[0]
+    assert loaded.curve == 'nbp' and loaded.overrides.version == b.overrides.version
+    pd.testing.assert_frame_equal(loaded.overrides.history(), history)
+    pd.testing.assert_series_equal(loaded.overrides.base, b.overrides.base, check_freq=False)
+    pd.testing.assert_series_equal(loaded.as_of(version=1), b.as_of(version=1), check_freq=False)
+    loaded.retract(2, reason='Restored')
+    assert loaded.series.sum() == 0.0
+
+
+def test_optimizer():
+    calls = []
+
+    def spread(x, y):
+        calls.append(1)
+        return x - y
+
+    functions = {'SPREAD': spread, 'MAX': MAX}
+    a = Node('a', formula='b + c', functions=functions)
+    b = Node('b', parent=a, formula='MAX(SPREAD(x, y), 0) * 100 / 4', functions=functions)
+    c = Node('c', parent=a, formula='SPREAD(x, y) - 1 + 3', functions=functions)
+    x = Node('x', parent=b)
+    y = Node('y', parent=b)
+    SymlinkNode(x, parent=c)
+    SymlinkNode(y, parent=c)
+
+    x.series = pd.Series([1.0, 5.0])
+    calls.clear()
+    y.series = pd.Series([2.0, 1.0])
+    assert len(calls) == 2
+
+    optimizer = a.optimize()
+    assert optimizer.report().to_dict('records') == [{'name': '_cse_0', 'expression': 'SPREAD(x, y)', 'count': 2}]
+    assert optimizer.formula(b) == 'MAX(_cse_0, 0) * 25.0' and optimizer.formula(c) == '_cse_0 + 2'
+    assert optimizer.formula(a) == 'b + c'
+    assert b._evaluator.compiled is compile_formula(b.formula) and b._evaluator.code is not b._evaluator.compiled.code
+
+    calls.clear()
+    y.series = pd.Series([0.0, 2.0])
+    assert len(calls) == 1
+    pd.testing.assert_series_equal(b.series, pd.Series([25.0, 75.0]), check_names=False)
+    pd.testing.assert_series_equal(a.series, pd.Series([28.0, 80.0]), check_names=False)
+
+    # The shared values belong to the optimizer and are reused until an input changes
+    calls.clear()
+    c.calculate(force=True)
+    b.calculate(force=True)
+    assert len(calls) == 1 and list(optimizer._cache.values())[0][0] == (x.version, y.version)
+    assert not Node('d').optimize()._cache
+
+    b.formula = 'SPREAD(x, y) * 2'
+    calls.clear()
+    x.series = pd.Series([2.0, 5.0])
+    assert len(calls) == 2
+    pd.testing.assert_series_equal(a.series, pd.Series([8.0, 11.0]), check_names=False)
+
+    tree = fold_constants(compile_formula('nbp - ttf * fx * 100 / 34.121416 + -(2 ** 3)').tree)
+    assert ast.unparse(tree) == f'nbp - ttf * fx * {100 / 34.121416} + -8'
+
+
+def test_scenarios():
+    a = Node('a', formula='MAX(b, 0) + CUMSUM(c)')
+    b = Node('b', parent=a, formula='nbp - ttf')
+    c = Node('c', parent=a)
+    nbp = Node('nbp', parent=b)
+    ttf = Node('ttf', parent=b)
+    x = Node('x', formula='b * 2')
+    SymlinkNode(b, parent=x)
+
+    index = pd.date_range('2022-10-01', periods=3)
+    nbp.series = pd.Series([1.0, 2.0, 3.0], index=index)
+    ttf.series = pd.Series([2.0, 2.0, 2.0], index=index)
+    c.series = pd.Series([1.0, 1.0, 1.0], index=index)
+    live = {node.name: (node.series, node.version) for node in (a, b, c, x, nbp, ttf)}
+
+    shocks = pd.DataFrame([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0], [2.0, 2.0, 2.0]], index=['base', 'up', 'up2'], columns=index)
+    scenarios = ScenarioSet(a, {'/a/b/nbp': shocks, ttf: np.array([0.5, 1.0, 1.5])}, how='add').run()
+    assert set(n.name for n in scenarios.nodes) == {'nbp', 'ttf', 'b', 'a', 'x'}
+    assert list(scenarios['b'].index) == ['base', 'up', 'up2'] and list(scenarios['b'].columns) == list(index)
+
+    for i, label in enumerate(shocks.index):
+        nbp_s = nbp.series + shocks.loc[label].to_numpy()
+        ttf_s = ttf.series + [0.5, 1.0, 1.5][i]
+        b_s = nbp_s - ttf_s
+        np.testing.assert_allclose(scenarios[b].loc[label], b_s)
+        np.testing.assert_allclose(scenarios[a].loc[label], MAX(b_s, 0) + c.series.cumsum())
+        np.testing.assert_allclose(scenarios[x].loc[label], b_s * 2)
+    np.testing.assert_allclose(scenarios[c].to_numpy(), [[1.0, 1.0, 1.0]] * 3)
+
+    for node in (a, b, c, x, nbp, ttf):
+        assert node.series is live[node.name][0] and node.version == live[node.name][1]
+
+    replaced = ScenarioSet(a, {nbp: [[5.0, 5.0, 5.0], [0.0, 0.0, 0.0]]}).run()
+    np.testing.assert_allclose(replaced[b].to_numpy(), [[3.0, 3.0, 3.0], [-2.0, -2.0, -2.0]])
+    with pytest.raises(ValueError):
+        ScenarioSet(a, {nbp: [[1.0]], ttf: [[1.0], [2.0]]}).run()
+
+    # The shared sub-expressions of an optimized tree are computed on the live series only
+    y = Node('y', formula='(nbp - ttf) * 3')
+    SymlinkNode(nbp, parent=y)
+    SymlinkNode(ttf, parent=y)
+    a.optimize()
+    optimized = ScenarioSet(a, {nbp: [[5.0, 5.0, 5.0], [0.0, 0.0, 0.0]]}).run()
+    np.testing.assert_allclose(optimized[b].to_numpy(), [[3.0, 3.0, 3.0], [-2.0, -2.0, -2.0]])
+    np.testing.assert_allclose(optimized[y].to_numpy(), [[9.0, 9.0, 9.0], [-6.0, -6.0, -6.0]])
+
+
+def test_changes_since(tmp_path):
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a)
+    x = Node('x', formula='c * 2')
+    SymlinkNode(c, parent=x)
+    b.series = pd.Series([1.0, 2.0])
+    c.series = pd.Series([1.0, np.nan])
+
+    epoch = current_epoch()
+    assert not a.changes_since(epoch)
+    b.append(pd.Series([3.0], index=[2]))
+    changes = a.changes_since(epoch)
+    assert [(change.path, change.start) for change in changes] == [('/a', 2), ('/a/b', 2)]
+    assert changes.epoch == current_epoch() and a in changes and c not in changes
+    assert [change.start for change in a.changes_since(epoch, ranges=False)] == [None, None]
+
+    epoch = current_epoch()
+    c.series = pd.Series([5.0, np.nan, 6.0])
+    changes = x.changes_since(epoch)
+    assert {change.path for change in changes} == {'/x', '/a/c'}
+    delta = json.loads(changes.to_json())
+    assert delta['since'] == epoch
+    assert {item['path']: item['values'] for item in delta['changes']}['/a/c'] == [5.0, None, 6.0]
+    assert 'values' not in a.changes_since(epoch).to_dict(values=False)['changes'][0]
+
+    for i in range(3):
+        b.append(pd.Series([4.0 + i], index=[3 + i]))
+    assert {change.path: change.start for change in a.changes_since(epoch)}['/a/b'] == 3
+
+    # Past the capped history of partial changes the whole series is reported
+    epoch = current_epoch()
+    for i in range(79):
+        b.append(pd.Series([7.0 + i], index=[6 + i]))
+    assert {change.path: change.start for change in a.changes_since(epoch)}['/a/b'] is None
+    item = {item['path']: item for item in a.changes_since(epoch).to_dict()['changes']}['/a/b']
+    assert len(item['values']) == len(b.series)
+
+    a.save(str(tmp_path / 'snapshot'))
+    epoch = current_epoch()
+    root = Node.load(str(tmp_path / 'snapshot'))
+    assert len(root.changes_since(epoch)) == 3
+
+
+def test_lazy_evaluation(tmp_path):
+    a = Node('a', formula='b + c', evaluation='lazy')
+    b = Node('b', parent=a, formula='x * 2')
+    c = Node('c', parent=a, formula='y * 3 + z', trigger_type='all')
+    x = Node('x', parent=b)
+    y = Node('y', parent=c)
+    z = Node('z', parent=c)
+    one = pd.Series([1.0, 2.0])
+
+    # The parent with trigger_type='all' is only invalidated once every trigger child changed
+    y.series = one
+    assert not c._stale and not a._stale
+    z.series = one
+    assert c._stale and a._stale
+
+    with Profiler() as profiler:
+        for i in range(5):
+            x.series = one + i
+        assert b._stale and profiler.report()['calculations'].sum() == 0
+        assert a.series.tolist() == [14.0, 20.0]
+        assert not a._stale and not b._stale and not c._stale
+        assert [profiler.stats(n).calculations for n in (a, b, c)] == [1, 1, 1]
+        assert a.series.tolist() == [14.0, 20.0]
+        assert profiler.stats(a).calculations == 1
+
+    z.series = one * 2
+    assert c.dataframe.columns.tolist() == ['y', 'z'] and c._stale
+    assert b.dataframe['x'].tolist() == [5.0, 6.0]
+    assert a.dataframe['c'].tolist() == [5.0, 10.0] and not c._stale
+
+    # Locked parents and non trigger children are filtered out of the invalidation
+    assert a.series.tolist() == [15.0, 22.0]
+    b.is_locked = True
+    x.series = one * 10
+    assert not b._stale and not a._stale
+    b.is_locked = False
+    x.is_trigger_event = False
+    x.series = one * 2
+    assert not b._stale
+    x.is_trigger_event = True
+
+    # Eager consumers in other trees pull the invalidated nodes they read
+    e = Node('e', formula='b + 1')
+    SymlinkNode(b, parent=e)
+    x.series = one * 3
+    assert e.series.tolist() == [7.0, 13.0] and not b._stale and a._stale
+
+    a.save(str(tmp_path / 'snapshot'))
+    assert Node.load(str(tmp_path / 'snapshot')).evaluation == 'lazy'
+    a.evaluation = 'eager'
+    assert not a._stale and x.evaluation == 'eager'
+    assert a.series.tolist() == [11.0, 22.0]
+    with pytest.raises(ValueError):
+        a.evaluation = 'pull'
+
+
+def test_trigger_bookkeeping():
+    a = Node('a', formula=' + '.join(f'x{i}' for i in range(50)), trigger_type='all')
+    leaves = [Node(f'x{i}', parent=a) for i in range(50)]
+    other = Node('other', parent=a)
+    assert a._blocking == 50
+
+    with Profiler() as profiler:
+        for i, leaf in enumerate(leaves):
+            leaf.series = pd.Series([float(i)])
+    assert profiler.stats(a).calculations == 1 and a.series.tolist() == [1225.0]
+    assert a._blocking == 0
+
+    # Children the formula never reads neither trigger nor block it
+    other.series = pd.Series([1.0])
+    assert a.version == 1
+    other.is_locked = True
+    assert a._blocking == 0
+
+    leaves[0].is_locked = True
+    assert a._blocking == 1
+    leaves[1].series = pd.Series([100.0])
+    assert a.version == 1
+    leaves[0].is_locked = False
+    leaves[1].series = pd.Series([2.0])
+    assert a.version == 2 and a.series.tolist() == [1226.0]
+
+    # Symbolic nodes count with the state of their target, detached children are discounted
+    y = Node('y')
+    link = SymlinkNode(y, parent=a)
+    a.formula = a.formula + ' + y'
+    assert a._blocking == 1
+    y.series = pd.Series([1.0])
+    assert a._blocking == 0 and a.version == 3
+    link.parent = None
+    y.is_dirty = False
+    assert a._blocking == 0
+    leaves[-1].is_trigger_event = False
+    leaves[-1].is_dirty = False
+    assert a._blocking == 0
+    leaves[-1].is_trigger_event = True
+    assert a._blocking == 1
+
+
+def test_shared_graph(tmp_path):
+    path = str(tmp_path / 'shared')
+    a = Node('a', formula='b + c', evaluation='lazy')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a)
+    x = Node('x', formula='c * 2')
+    SymlinkNode(c, parent=x)
+    b.series = pd.Series([1.0, 2.0, 3.0])
+    c.series = pd.Series([1.0, 1.0, 1.0])
+
+    with Publisher(a, path, keep=2) as publisher:
+        reader = Reader(path)
+        assert reader.version == 1 and set(reader.paths) == {'/a', '/a/b', '/a/c', '/x', '/x/c'}
+        assert reader.series('/a').tolist() == [2.0, 3.0, 4.0]
+        assert reader.series('/x/c').tolist() == [1.0, 1.0, 1.0]
+        frame = reader.dataframe('/a')
+        assert frame.columns.tolist() == ['b', 'c'] and np.shares_memory(frame.to_numpy(), reader.values('/a/b'))
+        assert not reader.values('/a').flags.writeable
+        assert reader.dataframe('/x')['c'].tolist() == [1.0, 1.0, 1.0]
+
+        # Every propagation publishes a new version, the views already taken are left untouched
+        view = reader.series('/a/b')
+        b.series = pd.Series([5.0, 5.0, 5.0])
+        assert publisher.version == 2 and reader.refresh()
+        assert reader.series('/a').tolist() == [6.0, 6.0, 6.0] and view.tolist() == [1.0, 2.0, 3.0]
+        assert not reader.refresh() and publisher.publish() == 2
+
+        for i in range(3):
+            b.series = pd.Series([float(i)] * 3)
+        assert publisher.version == 5 and sorted(os.listdir(path)) == ['manifest.json', 'v4', 'v5']
+        assert reader.refresh() and reader.version == 5
+
+    b.series = pd.Series([9.0])
+    assert publisher.version == 5
+    assert Publisher(a, path).publish() == 6
+
+    a.series = pd.Series(['x'])
+    with pytest.raises(TypeError):
+        Publisher(a, path).publish()
+    with pytest.raises(FileNotFoundError):
+        Reader(str(tmp_path / 'empty'))
+
+    # Column names don't depend on the separator of the paths
+    class PipeNode(Node):
+        separator = '|'
+
+    p = PipeNode('p', formula='1')
+    PipeNode('q/1', parent=p).series = pd.Series([1.0])
+    PipeNode('r', parent=p).series = pd.Series([2.0])
+    Publisher(p, str(tmp_path / 'pipe')).publish()
+    assert list(Reader(str(tmp_path / 'pipe')).dataframe('|p').columns) == ['q/1', 'r']
+
+
+def test_priority(tmp_path):
+    def chained(*args):
+        result = args[0]
+        for other in args[1:]:
+            result = result.combine_first(other)
+        return result
+
+    rng = np.random.default_rng(0)
+    for tz in (None, 'Europe/London'):
+        args = []
+        for i in range(6):
+            s = pd.Series(rng.random(50), index=pd.date_range('2022-03-01', periods=50, tz=tz) + pd.Timedelta(days=5 * i))
+            s[rng.random(50) < 0.4] = np.nan
+            args.append(s)
+        pd.testing.assert_series_equal(priority(*args), chained(*args))
+        pd.testing.assert_series_equal(priority(*args[::-1]), chained(*args[::-1]))
+
+    ints = [pd.Series([1, 2], name='a'), pd.Series([3, 4, 5])]
+    pd.testing.assert_series_equal(priority(*ints), chained(*ints))
+    assert priority(ints[0], ints[0]).dtype == 'int64'
+    text = [pd.Series(['a', None]), pd.Series(['b', 'c', 'd'], index=[1, 2, 3])]
+    pd.testing.assert_series_equal(priority(*text), chained(*text))
+    nullable = [pd.Series([1, None], dtype='Int64'), pd.Series([3, 4, 5], dtype='Int64')]
+    pd.testing.assert_series_equal(priority(*nullable), chained(*nullable))
+    assert priority(*nullable).dtype == 'Int64'
+
+    frames = [
+        pd.DataFrame({'a': [1.0, np.nan], 's': ['x', None]}),
+        pd.DataFrame({'a': [3.0, 4.0], 's': ['y', 'z'], 'b': [5.0, 6.0]}, index=[1, 2]),
+    ]
+    pd.testing.assert_frame_equal(priority(*frames), chained(*frames))
+    assert priority(pd.Series([np.nan, 1.0]), 0.0).tolist() == [0.0, 1.0]
+    assert priority(ints[0]) is ints[0]
+    with pytest.raises(TypeError):
+        priority()
+
+    path = tmp_path / 'priority.json'
+    assert priority_benchmark.main(['--sources', '2', '4', '--rows', '100', '--repeat', '1', '--output', str(path)]) == 0
+    assert [item['k'] for item in json.loads(path.read_text())] == [2, 4]
+
+
+def test_type_inference(tmp_path):
+    index = pd.date_range('2022-10-01', periods=3, tz='UTC')
+    a = Node('a', formula='b + c')
+    b = Node('b', parent=a)
+    c = Node('c', parent=a)
+    d = Node('d', parent=a)
+    b.series = pd.Series([1, 2, 3], index=index)
+    c.series = pd.Series([1.0, 2.0, 3.0], index=index)
+    d.series = pd.Series(['x', 'y', 'z'], index=index)
+
+    # Shared indexes are kept so that the result can be allocated up front
+    result = a.check()
+    assert (result.kind, str(result.dtype), result.index, result.length) == ('series', 'float64', str(index.dtype), 3)
+    assert result.labels is b.series.index
+    a.formula = 'b / b'
+    assert a.output.dtype == np.float64 and a.check() is a.output
+
+    # The inferred output is kept until the inputs or the children change
+    output = a.output
+    b.series = pd.Series([1, 2, 4], index=index)
+    assert a.check() is not output and a.output.dtype == np.float64
+    a.invalidate_evaluator()
+    assert a.output is None
+    a.formula = 'b > 1'
+    assert a.check().dtype == np.bool_
+    a.formula = 'd + d'
+    assert a.check().dtype.kind == 'U'
+    a.formula = 'CLIP(b, 0, 2)'
+    assert a.check().dtype == np.float64
+    a.formula = 'WHERE(b > 1, b, 0)'
+    assert a.check().dtype == np.int64
+
+    # Misaligned integers are filled with NaN
+    c.series = pd.Series([1, 2], index=index[1:])
+    a.formula = 'b + c'
+    assert a.check().dtype == np.float64 and a.check().labels is None
+
+    for formula in ('b - d', 'd > 1', 'b and c', 'not b', 'b if c else 1', 'SHIFT(b, 1, 2, 3)', 'ABS()'):
+        with pytest.raises(FormulaError):
+            a.formula = formula
+    assert a.formula == 'b + c'
+
+    c.series = pd.Series([1.0, 2.0])
+    with pytest.raises(FormulaError, match='Incompatible indexes'):
+        a.formula = 'b * c'
+
+    # Errors of the descendants are reported without blocking their ancestors
+    root = Node('root', formula='a * 2')
+    a.parent = root
+    a._formula = 'b - d'
+    a.invalidate_evaluator()
+    report = analyze(root)
+    assert pd.isna(report.loc['/root', 'kind']) and pd.isna(report.loc['/root', 'error'])
+    assert report.loc['/root', 'elementwise'] and 'Unsupported operand' in report.loc['/root/a', 'error']
+    assert list(root.analyze().index) == ['/root', '/root/a']
+    with pytest.raises(FormulaError):
+        analyze(root, raise_errors=True)
+
+    # Loading a snapshot rejects the formulas which don't match the restored children
+    root.save(str(tmp_path / 'bad'))
+    with pytest.raises(FormulaError):
+        Node.load(str(tmp_path / 'bad'))
+    a._formula = 'b + 1'
+    a.invalidate_evaluator()
+    root.save(str(tmp_path / 'good'))
+    for mmap in (True, False):
+        loaded = Node.load(str(tmp_path / 'good'), mmap=mmap)
+        assert loaded.check() == OutputType('series', np.dtype('int64'), str(index.dtype), index)
+
+        # The leaves are typed without building their series
+        leaf = loaded.children[0].children[0]
+        assert leaf.name == 'b' and leaf._loader is not None and leaf._series is None
+
+
 if __name__ == '__main__':
     pytest.main()
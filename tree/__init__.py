@@ -16,4 +16,18 @@ from the child above.
 from tree.node import Node, SymlinkNode
 from tree.exceptions import FormulaError, MissingFormula, ReadOnlyError
 from tree.functions import *
-from tree.utils import FormulaTransformer
+from tree.utils import FormulaTransformer, CompiledFormula, compile_formula, series_equal
+from tree.registry import FunctionRegistry, get_registry
+from tree.engine import Batch, batch, current_batch, set_scheduler
+from tree.storage import ColumnStore
+from tree.scheduler import Scheduler
+from tree.deferred import DeferredQueue, get_queue
+from tree.ingest import Ingestor
+from tree.memory import MemoryBudget
+from tree.profiling import Profiler, NodeStats, get_profiler
+from tree.overrides import Override, OverrideStore
+from tree.optimizer import Optimizer, fold_constants
+from tree.scenario import ScenarioSet
+from tree.changes import Change, ChangeSet, current_epoch
+from tree.shared import Publisher, Reader
+from tree.inference import OutputType, analyze
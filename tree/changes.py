@@ -0,0 +1,128 @@
+"""Change sets
+
+Every change to a series is stamped with an epoch drawn from a process-wide counter, each node keeping the epoch of
+its last change. A consumer remembers the epoch it last synced at and asks for the changes made since: only the nodes
+changed since then are returned, with the first row that changed when only the tail of the series was rewritten, so
+the cost of a sync follows what changed instead of the size of the tree.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, current_epoch
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> b.series = pd.Series([1.0, 2.0])
+    >>> c.series = pd.Series([1.0, 2.0])
+    >>> epoch = current_epoch()
+    >>> b.append(pd.Series([3.0], index=[2]))
+    >>> changes = a.changes_since(epoch)
+    >>> [(change.path, change.start) for change in changes]
+    [('/a', 2), ('/a/b', 2)]
+    >>> changes.to_dict()['changes'][1]['values']
+    [3.0]
+
+The module contains the following classes/functions:
+
+- `Change`
+- `ChangeSet`
+- `current_epoch() -> int`
+- `next_epoch() -> int`
+- `changes_since(node: Node, epoch: int, ranges: bool = True) -> ChangeSet`
+"""
+
+import threading
+from json import dumps
+from typing import Any, Iterator, List, NamedTuple, Type
+
+import pandas as pd
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+_lock = threading.Lock()
+_epoch = 0
+
+
+def current_epoch() -> int:
+    """Epoch of the latest change made in the process."""
+    return _epoch
+
+
+def next_epoch() -> int:
+    """Draw the epoch of a new change."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        return _epoch
+
+
+class Change(NamedTuple):
+    """Change of the series of a node since an epoch."""
+    node: Any
+    path: str
+    epoch: int
+    version: int
+
+    # First label changed, None when the whole series may have changed
+    start: Any = None
+
+
+def _path(node: Type[NodeMixin]) -> str:
+    return node.separator.join([''] + [str(n.name) for n in node.path])
+
+
+def _label(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, pd.Timestamp) else value.item() if hasattr(value, 'item') else value
+
+
+class ChangeSet:
+    """Nodes changed between two epochs."""
+    def __init__(self, since: int, epoch: int, changes: List[Change]):
+        self.since = since
+        self.epoch = epoch
+        self.changes = changes
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def __iter__(self) -> Iterator[Change]:
+        return iter(self.changes)
+
+    def __contains__(self, node: Type[NodeMixin]) -> bool:
+        node = getattr(node, 'target', node)
+        return any(change.node is node for change in self.changes)
+
+    @property
+    def nodes(self) -> List[Any]:
+        return [change.node for change in self.changes]
+
+    def to_dict(self, values: bool = True) -> dict:
+        """Compact delta of the changes, with the changed rows of every series unless values is False."""
+        items = []
+        for change in self.changes:
+            item = {'path': change.path, 'version': change.version, 'start': _label(change.start)}
+            if values:
+                series = change.node.series
+                if change.start is not None:
+                    series = series.iloc[series.index.searchsorted(change.start):]
+                item['index'] = [_label(label) for label in series.index]
+                item['values'] = series.astype(object).where(series.notna(), None).tolist()
+            items.append(item)
+        return {'since': self.since, 'epoch': self.epoch, 'changes': items}
+
+    def to_json(self, values: bool = True) -> str:
+        return dumps(self.to_dict(values), default=str)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(since={self.since}, epoch={self.epoch}, changes={len(self.changes)})'
+
+
+def changes_since(node: Type[NodeMixin], epoch: int, ranges: bool = True) -> ChangeSet:
+    """Nodes of the subtree, and the targets of its symbolic nodes, changed after the epoch."""
+    until, seen, changes = current_epoch(), set(), []
+    for n in PreOrderIter(node):
+        n = getattr(n, 'target', n)
+        if id(n) in seen or n.modified_epoch <= epoch:
+            continue
+        seen.add(id(n))
+        changes.append(Change(n, _path(n), n.modified_epoch, n.version, n._start_since(epoch) if ranges else None))
+    return ChangeSet(epoch, until, changes)
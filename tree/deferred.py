@@ -0,0 +1,153 @@
+"""Deferred recalculation
+
+Deferred nodes are not recalculated when their children change, they are queued instead. Repeated triggers of the same
+node are coalesced and the queue is flushed either explicitly or, once a debounce interval is set, by the running
+asyncio loop at most once per interval.
+
+Examples:
+    >>> import asyncio
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b + 1', is_deferred=True)
+    >>> b = Node('b', parent=a)
+    >>> async def main():
+    ...     b.series = pd.Series([1.0])
+    ...     b.series = pd.Series([2.0])
+    ...     await a.flush()
+    ...     return a.series
+    >>> asyncio.run(main())
+    0    3.0
+    dtype: float64
+
+The module contains the following classes/functions:
+
+- `DeferredQueue`
+- `get_queue() -> DeferredQueue`
+"""
+
+import asyncio
+import weakref
+from typing import Any, Dict, List, Tuple, Type
+
+from anytree.node import NodeMixin
+
+from tree.engine import Batch, subscribe, topological_order
+
+
+class DeferredQueue:
+    """Queue of the deferred nodes waiting to be recalculated."""
+    def __init__(self, debounce: float = None):
+        # Seconds between two automatic flushes, None to only flush on demand
+        self.debounce = debounce
+
+        # Weak references to the queued nodes, a tree dropped while queued is not kept alive nor recalculated
+        self._pending: Dict[int, weakref.ref] = {}
+        self._waiters: Dict[int, Tuple[Type[NodeMixin], List[asyncio.Future]]] = {}
+        self._handle = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __contains__(self, node: Type[NodeMixin]) -> bool:
+        ref = self._pending.get(id(node))
+        return ref is not None and ref() is node
+
+    @property
+    def pending(self) -> List[Type[NodeMixin]]:
+        """Queued nodes still alive, the dead entries are dropped."""
+        nodes = []
+        for key, ref in list(self._pending.items()):
+            node = ref()
+            if node is None:
+                del self._pending[key]
+            else:
+                nodes.append(node)
+        return nodes
+
+    def schedule(self, node: Type[NodeMixin]) -> None:
+        """Queue the node, the flush is armed on the running loop when a debounce interval is set."""
+        self._pending[id(node)] = weakref.ref(node)
+        if self.debounce is not None and self._handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._handle = loop.call_later(self.debounce, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._handle = None
+        self.flush()
+
+    def flush(self, root: Type[NodeMixin] = None) -> int:
+        """Recalculate the queued nodes, only those of the tree if a root is given, and return how many ran."""
+        count, flushed = 0, {}
+        while True:
+            nodes = [n for n in self.pending if (root is None or n.root is root) and not n.is_locked]
+            if not nodes:
+                break
+
+            keys = {id(n) for n in nodes}
+            for node in nodes:
+                del self._pending[id(node)]
+                flushed[id(node)] = node
+
+            with Batch():
+                for node in topological_order(nodes):
+                    if id(node) in keys:
+                        node.calculate()
+                        count += 1
+
+        if not self.pending and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._notify(flushed)
+        return count
+
+    async def flush_async(self, root: Type[NodeMixin] = None) -> int:
+        count = self.flush(root)
+        await asyncio.sleep(0)
+        return count
+
+    def next_state(self, node: Type[NodeMixin]) -> asyncio.Future:
+        """Future resolved with the series of the node once it changed and nothing is pending for it."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(id(node), (node, []))[1].append(future)
+        return future
+
+    def _on_flushed(self, batch: Batch) -> None:
+        self._notify(batch.changed)
+
+    def _notify(self, nodes: Dict[int, Type[NodeMixin]]) -> None:
+        for key in [k for k in self._waiters if k in nodes and k not in self._pending]:
+            node, futures = self._waiters.pop(key)
+            for future in futures:
+                _resolve(future, node.series)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(pending={len(self)}, debounce={self.debounce})'
+
+
+def _resolve(future: asyncio.Future, value: Any) -> None:
+    def resolve():
+        if not future.done():
+            future.set_result(value)
+
+    loop = future.get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        resolve()
+    else:
+        loop.call_soon_threadsafe(resolve)
+
+
+_queue = DeferredQueue()
+subscribe('deferred', _queue.schedule)
+subscribe('flushed', _queue._on_flushed)
+
+
+def get_queue() -> DeferredQueue:
+    """Return the process-wide queue of the deferred nodes."""
+    return _queue
@@ -0,0 +1,235 @@
+"""Propagation engine
+
+Changes to node series are collected by a batch and pushed up the dependency graph once the batch is flushed.
+Every affected ancestor, including the parents of symbolic nodes, is recalculated at most once and in topological
+order, so shared ancestors and diamonds built through symbolic nodes are never evaluated twice.
+
+In a tree whose root is in the 'lazy' evaluation mode the affected ancestors are only invalidated, passing the same
+trigger conditions as a recalculation, and reading their series recalculates exactly the invalidated nodes it depends on.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> with a.batch() as batch:
+    ...     b.series = pd.Series([1], dtype='float64')
+    ...     c.series = pd.Series([2], dtype='float64')
+    >>> batch.calculations[a]
+    1
+    >>> a.series
+    0    3.0
+    dtype: float64
+
+The module contains the following classes/functions:
+
+- `Batch`
+- `batch(scheduler: Scheduler = None) -> Batch`
+- `current_batch() -> Optional[Batch]`
+- `set_scheduler(scheduler: Scheduler = None) -> None`
+- `propagate(node: NodeMixin) -> None`
+- `subscribe(event: str, callback: Callable) -> None`
+- `unsubscribe(event: str, callback: Callable) -> None`
+- `consumers(node: NodeMixin) -> List[Tuple[NodeMixin, NodeMixin]]`
+- `topological_order(nodes: Iterable[NodeMixin]) -> List[NodeMixin]`
+- `topological_levels(nodes: Iterable[NodeMixin]) -> List[List[NodeMixin]]`
+- `connected_roots(node: NodeMixin) -> List[NodeMixin]`
+"""
+
+import threading
+from collections import Counter
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Type
+
+from loguru import logger
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+from tree import profiling
+
+_state = threading.local()
+
+# Scheduler used by the batches created without one, None to calculate serially
+_scheduler = None
+
+# Callbacks notified of the propagation events
+# 1. 'deferred' - called with a deferred parent which would have been recalculated otherwise
+# 2. 'flushed' - called with the batch once all of its changes have been propagated
+_listeners = {'deferred': [], 'flushed': []}
+
+
+def subscribe(event: str, callback: Callable) -> None:
+    """Register a callback for the 'deferred' or 'flushed' propagation event."""
+    _listeners[event].append(callback)
+
+
+def unsubscribe(event: str, callback: Callable) -> None:
+    _listeners[event].remove(callback)
+
+
+def set_scheduler(scheduler: Any = None) -> None:
+    """Set the scheduler used by default to calculate the nodes of a level, None for a serial run."""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def consumers(node: Type[NodeMixin]) -> List[Tuple[Type[NodeMixin], Type[NodeMixin]]]:
+    """Return the (edge, parent) pairs fed by the node, the edge being the node itself or one of its symbolic nodes."""
+    edges = [] if node.parent is None else [(node, node.parent)]
+    for symlink in node.book.values():
+        if symlink.parent is not None:
+            edges.append((symlink, symlink.parent))
+    return edges
+
+
+def connected_roots(node: Type[NodeMixin]) -> List[Type[NodeMixin]]:
+    """Root of the node followed by the roots of every tree connected to it through symbolic nodes."""
+    roots, seen, i = [node.root], {id(node.root)}, 0
+    while i < len(roots):
+        for n in PreOrderIter(roots[i]):
+            linked = [n.target] if hasattr(n, 'target') else [s for s in n.book.values()]
+            for other in linked:
+                if id(other.root) not in seen:
+                    seen.add(id(other.root))
+                    roots.append(other.root)
+        i += 1
+    return roots
+
+
+def topological_order(nodes: Iterable[Type[NodeMixin]]) -> List[Type[NodeMixin]]:
+    """Return the nodes and all of their ancestors ordered so that every node comes before its consumers."""
+    order, visited, on_stack = [], set(), set()
+    for start in nodes:
+        if id(start) in visited:
+            continue
+        stack = [(start, iter(consumers(start)))]
+        visited.add(id(start))
+        on_stack.add(id(start))
+        while stack:
+            node, edges = stack[-1]
+            for _, parent in edges:
+                if id(parent) in on_stack:
+                    raise RecursionError(f"Circular dependency detected at the node '{parent.name}'")
+                if id(parent) not in visited:
+                    visited.add(id(parent))
+                    on_stack.add(id(parent))
+                    stack.append((parent, iter(consumers(parent))))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(id(node))
+                order.append(node)
+    order.reverse()
+    return order
+
+
+def topological_levels(nodes: Iterable[Type[NodeMixin]]) -> List[List[Type[NodeMixin]]]:
+    """Group the nodes and their ancestors into levels, a node only depends on nodes of the previous levels."""
+    levels, depth = [], {}
+    for node in topological_order(nodes):
+        d = depth.pop(id(node), 0)
+        if d == len(levels):
+            levels.append([])
+        levels[d].append(node)
+        for _, parent in consumers(node):
+            depth[id(parent)] = max(depth.get(id(parent), 0), d + 1)
+    return levels
+
+
+class Batch:
+    """Collect changed nodes and recalculate each affected ancestor exactly once when the batch exits."""
+    def __init__(self, scheduler: Any = None):
+        self.scheduler = scheduler if scheduler is not None else _scheduler
+        self.changed = {}
+
+        # Ancestors of lazy trees marked to be recalculated on read instead of being recalculated
+        self.invalidated = {}
+        self.calculations = Counter()
+        self._depth = 0
+        self._flushing = False
+
+    def add(self, node: Type[NodeMixin]) -> None:
+        self.changed[id(node)] = node
+
+    def flush(self) -> None:
+        self._flushing = True
+        profiler = profiling._active
+        if profiler is not None:
+            profiler.begin_update(self)
+        try:
+            processed = set()
+            while True:
+                pending = [n for k, n in self.changed.items() if k not in processed]
+                if not pending:
+                    break
+                triggered = set()
+                for level in topological_levels(pending):
+                    nodes = [n for n in level if id(n) in triggered and id(n) not in processed]
+                    if any(n.is_lazy for n in nodes):
+                        for node in nodes:
+                            if node.is_lazy:
+                                node.invalidate()
+                                self.invalidated[id(node)] = node
+                        nodes = [n for n in nodes if not n.is_lazy]
+                    if self.scheduler is None or len(nodes) < 2:
+                        for node in nodes:
+                            node.calculate()
+                    elif nodes:
+                        self.scheduler.calculate(nodes)
+                    self.calculations.update(nodes)
+
+                    for node in level:
+                        if (id(node) in self.changed or id(node) in self.invalidated) and id(node) not in processed:
+                            processed.add(id(node))
+                            for edge, parent in consumers(node):
+                                if edge.can_recalculate_parent(edge):
+                                    logger.debug("'{}' is triggered by the node '{}'", parent.name, edge.name)
+                                    if profiler is not None:
+                                        profiler.triggered(parent, edge)
+                                    triggered.add(id(parent))
+                                elif parent.is_deferred and edge.can_trigger_parent(edge):
+                                    for callback in _listeners['deferred']:
+                                        callback(parent)
+        finally:
+            self._flushing = False
+            if profiler is not None:
+                profiler.end_update(self)
+
+        for callback in _listeners['flushed']:
+            callback(self)
+
+    def __enter__(self) -> 'Batch':
+        if self._depth == 0:
+            self._previous = getattr(_state, 'batch', None)
+            _state.batch = self
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> Any:
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if exc_type is None:
+                    self.flush()
+            finally:
+                _state.batch = self._previous
+
+
+def current_batch() -> Optional[Batch]:
+    """Return the batch collecting changes in the current thread, if any."""
+    return getattr(_state, 'batch', None)
+
+
+def batch(scheduler: Any = None) -> Batch:
+    """Return the active batch so that nested blocks join it, or start a new one."""
+    return current_batch() or Batch(scheduler)
+
+
+def propagate(node: Type[NodeMixin]) -> None:
+    """Record a changed node, propagating immediately unless a batch is collecting changes."""
+    active = current_batch()
+    if active is not None:
+        active.add(node)
+    else:
+        with Batch() as active:
+            active.add(node)
@@ -9,27 +9,266 @@ Examples:
     1    1.0
     2    2.0
     dtype: float64
+    >>> from tree import MAX, MIN
+    >>> MAX(MIN(pd.Series([-1.0, 0.5, 2.0]), 1), 0)
+    0    0.0
+    1    0.5
+    2    1.0
+    dtype: float64
+
+The element-wise functions accept scalars, NumPy arrays, Series and DataFrames. Pandas arguments are aligned on the
+union of their indexes (and columns) before the computation runs on the underlying NumPy arrays, a Series is
+broadcast along the columns of a DataFrame.
 
 The module contains the following classes/functions:
 
 - `priority(*args: List[Union[pd.DataFrame, pd.Series]]) -> Union[pd.DataFrame, pd.Series]`
+- `MAX(*args: Operand) -> Operand`
+- `MIN(*args: Operand) -> Operand`
+- `CLIP(x: Operand, lower: Operand = None, upper: Operand = None) -> Operand`
+- `WHERE(condition: Operand, x: Operand, y: Operand) -> Operand`
+- `ABS(x: Operand) -> Operand`
+- `ROLLING_MEAN(x: Operand, window: int, min_periods: int = None) -> Operand`
+- `SHIFT(x: Operand, periods: int = 1) -> Operand`
+- `CUMSUM(x: Operand) -> Operand`
+
+Functions decorated with `elementwise` compute each row from the same row of their arguments only, formulas built from
+them can be evaluated on the appended rows alone. Functions decorated with `output` declare how their result is shaped
+from their arguments, see tree.inference.
 """
 
 
+import numpy as np
 import pandas as pd
-from typing import List, Union
+from typing import List, Union, Tuple, Callable
 from functools import reduce
 
-__all__ = ['priority', 'MAX', 'MIN']
+__all__ = ['priority', 'MAX', 'MIN', 'CLIP', 'WHERE', 'ABS', 'ROLLING_MEAN', 'SHIFT', 'CUMSUM']
+
+Operand = Union[float, np.ndarray, pd.Series, pd.DataFrame]
+
+
+def elementwise(func: Callable) -> Callable:
+    """Mark a function whose result at a row only depends on the arguments at the same row."""
+    func.elementwise = True
+    return func
 
 
+def output(rule: str, dtype: str = None, start: int = 0) -> Callable:
+    """Declare the output of a function for the static inference of the formulas.
+
+    1. 'broadcast' - the arguments aligned on the union of their indexes, the default of the element-wise functions
+    2. 'first' - the index and the kind of the first argument
+    3. 'union' - the union of the indexes of the arguments, like 'broadcast'
+
+    The dtype is the one given, or the common dtype of the arguments from the start one onwards."""
+    def decorate(func: Callable) -> Callable:
+        func.output = (rule, None if dtype is None else np.dtype(dtype), start)
+        return func
+    return decorate
+
+
+@output('union')
 def priority(*args: List[Union[pd.DataFrame, pd.Series]]) -> Union[pd.DataFrame, pd.Series]:
-    """Pandas combine_first for multiple DataFrame/Series."""
-    return reduce(lambda l, r: l.combine_first(r), args)
+    """Pandas combine_first for multiple DataFrame/Series, the first value not missing in the order of the arguments
+    is taken at every label of the union of their indexes, in a single pass over the stacked values."""
+    if not args:
+        raise TypeError('priority() expected at least one argument')
+    if len(args) == 1:
+        return args[0]
+
+    if all(isinstance(a, (pd.Series, pd.DataFrame)) for a in args) and any(_extension(a) for a in args):
+        # Nullable and timezone-aware dtypes have no NumPy counterpart, keep them as combine_first does
+        return reduce(lambda left, right: left.combine_first(right), args)
+    if all(isinstance(a, pd.Series) and isinstance(a.dtype, np.dtype) for a in args):
+        template, stacked = _stack(args)
+    else:
+        template, values = _align(*args)
+        stacked = np.stack(np.broadcast_arrays(*values))
+    first = np.argmax(~pd.isna(stacked), axis=0)
+    result = np.take_along_axis(stacked, first[None], axis=0)[0]
+    if template is None:
+        return result
+    if isinstance(template, pd.DataFrame):
+        frame = pd.DataFrame(result, index=template.index, columns=template.columns)
+        return frame.infer_objects() if result.dtype == object else frame
+    return pd.Series(result, index=template.index, name=template.name)
+
+
+def _extension(a: Union[pd.Series, pd.DataFrame]) -> bool:
+    dtypes = a.dtypes if isinstance(a, pd.DataFrame) else [a.dtype]
+    return any(not isinstance(dtype, np.dtype) for dtype in dtypes)
+
+
+def _stack(args: Tuple[pd.Series, ...]) -> Tuple[pd.Series, np.ndarray]:
+    """Stack the values of the series on the union of their indexes, the missing labels being NaN or NaT."""
+    index = args[0].index
+    for a in args[1:]:
+        if not index.equals(a.index):
+            index = index.union(a.index)
+
+    dtype = np.result_type(*[a.dtype for a in args])
+    aligned = [a.index.equals(index) for a in args]
+    if not all(aligned) and dtype.kind in 'biu':
+        dtype = np.dtype('float64') if dtype.kind != 'b' else np.dtype(object)
+    fill = np.datetime64('NaT') if dtype.kind == 'M' else np.timedelta64('NaT') if dtype.kind == 'm' else np.nan
+
+    shape = (len(args), len(index))
+    stacked = np.empty(shape, dtype=dtype) if all(aligned) else np.full(shape, fill, dtype=dtype)
+    for row, a, same in zip(stacked, args, aligned):
+        if same:
+            row[:] = a.to_numpy()
+            continue
+        positions, values = _positions(index, a.index), a.to_numpy()
+        if len(positions) and positions.min() < 0:
+            # Labels the union failed to keep are dropped, as reindex does
+            found = positions >= 0
+            positions, values = positions[found], values[found]
+        row[positions] = values
+    return pd.Series(index=index, dtype='float64', name=args[0].name), stacked
+
+
+def _positions(index: pd.Index, labels: pd.Index) -> np.ndarray:
+    """Positions of the labels in the index containing them, merging sorted indexes in linear time."""
+    if index.is_monotonic_increasing and labels.is_monotonic_increasing and labels.is_unique and index.is_unique:
+        positions = index.join(labels, how='right', return_indexers=True)[1]
+        if positions is not None:
+            return positions
+    return index.get_indexer(labels)
+
+
+def _align(*args: Operand) -> Tuple[Union[pd.Series, pd.DataFrame, None], List[Union[float, np.ndarray]]]:
+    """Align the pandas arguments on a common index and return the template of the result with the raw values."""
+    frames = [a for a in args if isinstance(a, (pd.Series, pd.DataFrame))]
+    if not frames:
+        return None, list(args)
+
+    index = frames[0].index
+    for f in frames[1:]:
+        if not index.equals(f.index):
+            index = index.union(f.index)
+
+    columns = None
+    for f in frames:
+        if isinstance(f, pd.DataFrame):
+            columns = f.columns if columns is None or columns.equals(f.columns) else columns.union(f.columns)
+
+    values = []
+    for a in args:
+        if isinstance(a, pd.Series):
+            v = (a if a.index.equals(index) else a.reindex(index)).to_numpy()
+            values.append(v[:, None] if columns is not None else v)
+        elif isinstance(a, pd.DataFrame):
+            if not (a.index.equals(index) and a.columns.equals(columns)):
+                a = a.reindex(index=index, columns=columns)
+            values.append(a.to_numpy())
+        else:
+            values.append(a)
+
+    if columns is not None:
+        template = pd.DataFrame(index=index, columns=columns)
+    else:
+        template = pd.Series(index=index, dtype='float64', name=frames[0].name)
+    return template, values
+
+
+def _wrap(template: Union[pd.Series, pd.DataFrame, None], values: np.ndarray) -> Operand:
+    if template is None:
+        return values
+    values = np.asarray(values)
+    if values.shape != template.shape:
+        values = np.broadcast_to(values, template.shape).copy()
+    if isinstance(template, pd.DataFrame):
+        return pd.DataFrame(values, index=template.index, columns=template.columns)
+    return pd.Series(values, index=template.index, name=template.name)
+
+
+def _elementwise(func: Callable, *args: Operand) -> Operand:
+    template, values = _align(*args)
+    return _wrap(template, func(*values))
+
+
+def _maximum(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    # Same as the builtin max applied to each pair, the left value is kept unless the right one is greater
+    return np.where(np.greater(right, left), right, left)
+
+
+def _minimum(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    return np.where(np.less(right, left), right, left)
+
+
+@elementwise
+def MAX(*args: Operand) -> Operand:
+    """Element-wise maximum of the arguments, a NaN on the left is kept and a NaN on the right is ignored."""
+    return _elementwise(lambda *values: reduce(_maximum, values), *args)
+
+
+@elementwise
+def MIN(*args: Operand) -> Operand:
+    """Element-wise minimum of the arguments, a NaN on the left is kept and a NaN on the right is ignored."""
+    return _elementwise(lambda *values: reduce(_minimum, values), *args)
+
+
+@elementwise
+@output('broadcast', dtype='float64')
+def CLIP(x: Operand, lower: Operand = None, upper: Operand = None) -> Operand:
+    """Limit the values to the interval [lower, upper], NaN values and NaN bounds are left untouched."""
+    def clip(v, lo, hi):
+        v = np.asarray(v, dtype='float64')
+        if lo is not None:
+            v = np.where(np.less(v, lo), lo, v)
+        if hi is not None:
+            v = np.where(np.greater(v, hi), hi, v)
+        return v
+    args = [a for a in (lower, upper) if a is not None]
+    template, values = _align(x, *args)
+    lo = values[1] if lower is not None else None
+    hi = values[-1] if upper is not None else None
+    return _wrap(template, clip(values[0], lo, hi))
+
+
+@elementwise
+@output('broadcast', start=1)
+def WHERE(condition: Operand, x: Operand, y: Operand) -> Operand:
+    """Element-wise x where the condition holds, y otherwise, a missing condition selects y."""
+    def where(c, a, b):
+        c = np.asarray(c)
+        if c.dtype == object or c.dtype.kind == 'f':
+            c = np.where(pd.isna(c), False, c).astype(bool)
+        return np.where(c, a, b)
+    return _elementwise(where, condition, x, y)
+
+
+@elementwise
+def ABS(x: Operand) -> Operand:
+    """Element-wise absolute value."""
+    return np.abs(x)
+
+
+def _pandas(x: Operand) -> Union[pd.Series, pd.DataFrame]:
+    if isinstance(x, (pd.Series, pd.DataFrame)):
+        return x
+    x = np.asarray(x, dtype='float64')
+    return pd.DataFrame(x) if x.ndim == 2 else pd.Series(x)
+
+
+def _unwrap(x: Operand, result: Union[pd.Series, pd.DataFrame]) -> Operand:
+    return result if isinstance(x, (pd.Series, pd.DataFrame)) else result.to_numpy()
+
+
+@output('first', dtype='float64')
+def ROLLING_MEAN(x: Operand, window: int, min_periods: int = None) -> Operand:
+    """Mean over a rolling window of rows."""
+    return _unwrap(x, _pandas(x).rolling(window, min_periods=min_periods).mean())
+
 
+@output('first', dtype='float64')
+def SHIFT(x: Operand, periods: int = 1) -> Operand:
+    """Shift the values by a number of rows, the index is left unchanged."""
+    return _unwrap(x, _pandas(x).shift(periods))
 
-def MAX(series: pd.Series, x: int):
-    return series.combine(x, max)
 
-def MIN(series: pd.Series, x: int):
-    return series.combine(x, min)
\ No newline at end of file
+@output('first')
+def CUMSUM(x: Operand) -> Operand:
+    """Cumulative sum over the rows, NaN values are skipped."""
+    return _unwrap(x, _pandas(x).cumsum())
@@ -0,0 +1,127 @@
+"""Gas calendar
+
+Resampling rules of the gas market. A gas day starts at 05:00 UK time, intraday timestamps before that belong to the
+previous gas day while daily series are taken as already labelled by gas day. The periods are built from gas days:
+
+1. 'gas_day' - the gas day
+2. 'gas_week' - seven gas days counted from the start of the gas year, not ISO weeks, the last week is shorter
+3. 'gas_month' - the calendar month
+4. 'gas_quarter' - October to December, January to March, April to June and July to September
+5. 'season' - winter from October to March and summer from April to September
+6. 'gas_year' - from 1 October to 30 September
+7. 'year' - the calendar year
+
+Every period is labelled by its first gas day. Other frequencies are passed through to `pd.Series.resample`.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree.gas_calendar import resample
+    >>> s = pd.Series(1.0, index=pd.date_range('2022-09-29', periods=5, freq='D'))
+    >>> resample(s, 'gas_year', 'sum')
+    gas_year
+    2021-10-01    2.0
+    2022-10-01    3.0
+    dtype: float64
+    >>> resample(s, 'season', 'count')
+    season
+    2022-04-01    2
+    2022-10-01    3
+    dtype: int64
+
+The module contains the following functions:
+
+- `is_intraday(index: pd.DatetimeIndex) -> bool`
+- `gas_days(index: pd.DatetimeIndex, intraday: bool = None) -> np.ndarray`
+- `period_starts(index: pd.DatetimeIndex, freq: str, intraday: bool = None) -> np.ndarray`
+- `resample(series: pd.Series, freq: str, how: Union[str, Callable] = 'mean', intraday: bool = None) -> pd.Series`
+- `resample_tail(previous: pd.Series, series: pd.Series, start: Any, freq: str, how: Union[str, Callable] = 'mean') -> pd.Series`
+"""
+
+from typing import Any, Callable, Union
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = ('gas_day', 'gas_week', 'gas_month', 'gas_quarter', 'season', 'gas_year', 'year')
+GAS_DAY_START = np.timedelta64(5, 'h')
+TIMEZONE = 'Europe/London'
+
+_DAY = 86400 * 10 ** 9
+
+# First month of the period of every month counted from January 1970, where month % 12 is the month of the year
+_PERIOD_MONTHS = {
+    'gas_month': lambda months: months,
+    'gas_quarter': lambda months: months - months % 3,
+    'season': lambda months: months - (months - 3) % 6,
+    'gas_year': lambda months: months - (months - 9) % 12,
+    'year': lambda months: months - months % 12,
+}
+
+
+def _local(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    return index.tz_convert(TIMEZONE).tz_localize(None) if index.tz is not None else index
+
+
+def is_intraday(index: pd.DatetimeIndex) -> bool:
+    """Check if any timestamp falls after midnight UK time, a daily series is labelled by gas day already."""
+    return bool(len(index)) and bool((_local(index).asi8 % _DAY).any())
+
+
+def gas_days(index: pd.DatetimeIndex, intraday: bool = None) -> np.ndarray:
+    """Gas day of every timestamp, as datetime64[D]. Whether the timestamps are intraday is read from the index
+    unless given, pass it when the index is a slice of a longer series."""
+    index = _local(index)
+    values = index.values
+    if intraday if intraday is not None else is_intraday(index):
+        values = values - GAS_DAY_START
+    return values.astype('M8[D]')
+
+
+def period_starts(index: pd.DatetimeIndex, freq: str, intraday: bool = None) -> np.ndarray:
+    """First gas day of the period of every timestamp, as datetime64[D]."""
+    days = gas_days(index, intraday)
+    if freq == 'gas_day':
+        return days
+
+    months = days.astype('M8[M]').astype('int64')
+    if freq == 'gas_week':
+        years = _PERIOD_MONTHS['gas_year'](months).astype('M8[M]').astype('M8[D]')
+        offsets = (days - years).astype('int64')
+        return years + (offsets - offsets % 7).astype('m8[D]')
+    try:
+        return _PERIOD_MONTHS[freq](months).astype('M8[M]').astype('M8[D]')
+    except KeyError:
+        raise ValueError(f'Unknown gas calendar frequency {freq!r}, expected one of {FREQUENCIES}')
+
+
+def resample(series: pd.Series, freq: str, how: Union[str, Callable] = 'mean', intraday: bool = None) -> pd.Series:
+    """Aggregate the series per period of the gas calendar, or of a pandas frequency."""
+    if not isinstance(series.index, pd.DatetimeIndex):
+        raise TypeError('Expected a series with a DatetimeIndex')
+    if freq not in FREQUENCIES:
+        return series.resample(freq).agg(how)
+
+    result = series.groupby(period_starts(series.index, freq, intraday)).agg(how)
+    result.index = pd.DatetimeIndex(result.index, name=freq)
+    return result
+
+
+def resample_tail(
+    previous: pd.Series, series: pd.Series, start: Any, freq: str, how: Union[str, Callable] = 'mean'
+) -> pd.Series:
+    """Update a previous resample of the series after the rows from start changed, only the periods from the one
+    containing start are aggregated again. The index of the series must be monotonic increasing."""
+    index = series.index
+    position = index.searchsorted(start)
+    if position == len(index):
+        return previous
+
+    # A tail starting at midnight looks daily on its own
+    intraday = is_intraday(index)
+    first = period_starts(index[position:position + 1], freq, intraday)[0]
+    bound = pd.Timestamp(first - np.timedelta64(1, 'D'))
+    lower = index.searchsorted(bound.tz_localize(index.tz) if index.tz is not None else bound)
+    offset = lower + int(np.argmax(period_starts(index[lower:position + 1], freq, intraday) >= first))
+
+    head = previous.iloc[:previous.index.searchsorted(first)]
+    return pd.concat([head, resample(series.iloc[offset:], freq, how, intraday)])
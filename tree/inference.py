@@ -0,0 +1,408 @@
+"""Formula type inference
+
+A static pass infers the output of a formula from the children of the node and the functions it calls, before anything
+is evaluated: whether it is a scalar, a series or a dataframe, the dtype of its values, the dtype of its index and, when
+every input shares the same index, the index itself so that the storage of the result can be allocated up front. It runs
+when a formula is set and when a snapshot is loaded, expressions which would fail or silently misalign during a
+propagation are rejected with a FormulaError:
+
+1. arithmetic or ordering between text or datetime values and numbers
+2. inputs indexed by datetimes and by numbers, or by tz-aware and tz-naive datetimes
+3. `and`, `or`, `not` and conditional expressions on series, whose truth value is ambiguous
+4. calls with arguments which don't match the signature of the function
+
+The leaves are typed from their series, an empty series only tells the kind. The series not built yet, such as the
+leaves of a loaded snapshot, are typed from the values they will be built from and are left unread. Unknown parts of a
+type are None and are never rejected.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b * 2')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> b.series = pd.Series([1, 2], index=pd.date_range('2022-10-01', periods=2))
+    >>> a.check()
+    OutputType(kind='series', dtype='int64', index='datetime64[ns]', length=2)
+    >>> c.series = pd.Series(['x', 'y'], index=b.series.index)
+    >>> a.formula = 'b - c'
+    Traceback (most recent call last):
+     ...
+    tree.exceptions.FormulaError: Unsupported operand types for '-': int64 and text in 'b - c'
+
+The module contains the following classes/functions:
+
+- `OutputType`
+- `series_type(series: Union[pd.Series, pd.DataFrame]) -> OutputType`
+- `infer(compiled: CompiledFormula, inputs: Mapping[str, OutputType], functions: Mapping[str, Callable]) -> OutputType`
+- `node_type(node: Node, memo: dict = None) -> OutputType`
+- `output_type(evaluator: Evaluator, memo: dict = None) -> OutputType`
+- `input_types(evaluator: Evaluator, memo: dict = None) -> Dict[str, OutputType]`
+- `analyze(root: Node, raise_errors: bool = False) -> pd.DataFrame`
+"""
+
+import ast
+import inspect
+from functools import partial
+from typing import Any, Callable, Dict, List, Mapping, Optional, Type, Union
+
+import numpy as np
+import pandas as pd
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+from tree.utils import CompiledFormula
+from tree.exceptions import FormulaError
+
+TEXT = np.dtype('U')
+FLOAT = np.dtype('float64')
+BOOL = np.dtype('bool')
+
+_SYMBOLS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**',
+    ast.BitAnd: '&', ast.BitOr: '|', ast.BitXor: '^', ast.LShift: '<<', ast.RShift: '>>', ast.MatMult: '@',
+}
+_ORDERING = (ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+_INFERRED = {'floating': FLOAT, 'integer': np.dtype('int64'), 'boolean': BOOL, 'string': TEXT}
+
+
+class OutputType:
+    """Kind, dtype and index of the output of a node, None where unknown."""
+    __slots__ = ('kind', 'dtype', 'index', 'labels')
+
+    def __init__(self, kind: str = None, dtype: np.dtype = None, index: str = None, labels: pd.Index = None):
+        # 'scalar', 'series' or 'frame'
+        self.kind = kind
+        self.dtype = dtype
+
+        # dtype of the index and the index itself when it is known
+        self.index = index
+        self.labels = labels
+
+    @property
+    def length(self) -> Optional[int]:
+        return None if self.labels is None else len(self.labels)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, OutputType) and (self.kind, self.dtype, self.index, self.length) == \
+            (other.kind, other.dtype, other.index, other.length)
+
+    def __repr__(self) -> str:
+        dtype = None if self.dtype is None else _name(self.dtype)
+        return f'{self.__class__.__name__}(kind={self.kind!r}, dtype={dtype!r}, index={self.index!r}, ' \
+               f'length={self.length!r})'
+
+
+def _name(dtype: np.dtype) -> str:
+    return 'text' if dtype.kind in 'US' else str(dtype)
+
+
+def _values_dtype(values: Any) -> Optional[np.dtype]:
+    dtype = values.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return np.dtype('M8[ns]')
+    if not isinstance(dtype, np.dtype):
+        return None
+    if dtype == object:
+        return _INFERRED.get(pd.api.types.infer_dtype(values, skipna=True), dtype)
+    return dtype
+
+
+def series_type(series: Union[pd.Series, pd.DataFrame]) -> OutputType:
+    """Type of the value of a node."""
+    if isinstance(series, pd.DataFrame):
+        dtypes = {_values_dtype(series[c]) for c in series.columns}
+        dtype = dtypes.pop() if len(dtypes) == 1 else None
+        kind = 'frame'
+    elif isinstance(series, pd.Series):
+        dtype, kind = _values_dtype(series), 'series'
+    else:
+        return OutputType('scalar', np.asarray(series).dtype)
+    if series.empty:
+        return OutputType(kind)
+    return OutputType(kind, dtype, str(series.index.dtype), series.index)
+
+
+def _merge_index(left: Optional[str], right: Optional[str], formula: str) -> Optional[str]:
+    if left is None or right is None or left == right:
+        return left if right is None else right
+    if 'object' in (left, right):
+        return 'object'
+    dates = [i.startswith(('datetime64', 'timedelta64')) for i in (left, right)]
+    if all(dates):
+        if left.startswith('timedelta64') or right.startswith('timedelta64') or (',' in left) != (',' in right):
+            raise FormulaError(f"Incompatible indexes {left} and {right} in '{formula}'")
+        return 'datetime64[ns, UTC]'
+    if any(dates):
+        raise FormulaError(f"Incompatible indexes {left} and {right} in '{formula}'")
+    return str(np.result_type(left, right))
+
+
+def _same(left: Optional[pd.Index], right: Optional[pd.Index]) -> Optional[bool]:
+    """True if both indexes are the same, False if they differ and None if either is unknown."""
+    if left is None or right is None:
+        return None
+    return left is right or (len(left) == len(right) and left.equals(right))
+
+
+def _align(types: List[OutputType], formula: str) -> OutputType:
+    """Kind and index of the inputs aligned on the union of their indexes, the dtype is left to the caller."""
+    kinds = {t.kind for t in types}
+    kind = 'frame' if 'frame' in kinds else None if None in kinds else 'series' if 'series' in kinds else 'scalar'
+    pandas = [t for t in types if t.kind != 'scalar']
+    index, labels = None, pandas[0].labels if pandas else None
+    for t in pandas:
+        index = _merge_index(index, t.index, formula)
+        if labels is not None and not _same(labels, t.labels):
+            labels = None
+    return OutputType(kind, None, index, labels)
+
+
+def _gaps(types: List[OutputType], dtype: Optional[np.dtype]) -> Optional[np.dtype]:
+    """dtype once the values missing from the misaligned inputs are filled with NaN."""
+    pandas = [t for t in types if t.kind != 'scalar']
+    if dtype is None or dtype.kind not in 'biu' or len(pandas) < 2:
+        return dtype
+    same = [_same(pandas[0].labels, t.labels) for t in pandas[1:]]
+    if all(same):
+        return dtype
+    return FLOAT if False in same and dtype.kind != 'b' else None
+
+
+def _common(dtypes: List[Optional[np.dtype]]) -> Optional[np.dtype]:
+    if not dtypes or any(d is None or d == object for d in dtypes):
+        return None
+    if any(d.kind in 'USMm' for d in dtypes):
+        return dtypes[0] if all(d == dtypes[0] for d in dtypes) else None
+    return np.result_type(*dtypes)
+
+
+def _arithmetic(op: ast.operator, left: np.dtype, right: np.dtype, formula: str) -> Optional[np.dtype]:
+    if left is None or right is None or object in (left, right):
+        return None
+    symbol = _SYMBOLS.get(type(op), '?')
+    kinds = left.kind + right.kind
+
+    if 'U' in kinds or 'S' in kinds:
+        if isinstance(op, ast.Add) and left.kind in 'US' and right.kind in 'US':
+            return TEXT
+        if isinstance(op, ast.Mult) and sorted(kinds.replace('S', 'U')) in (['U', 'i'], ['U', 'u']):
+            return TEXT
+    elif 'M' in kinds or 'm' in kinds:
+        numbers = left.kind in 'biuf' or right.kind in 'biuf'
+        if isinstance(op, ast.Sub) and kinds == 'MM':
+            return np.dtype('m8[ns]')
+        if isinstance(op, (ast.Add, ast.Sub)) and kinds in ('Mm', 'mm') or isinstance(op, ast.Add) and kinds == 'mM':
+            return left if left.kind == 'M' or right.kind == 'm' else right
+        if isinstance(op, (ast.Mult, ast.Div, ast.FloorDiv)) and 'm' in kinds and numbers and 'M' not in kinds:
+            return np.dtype('m8[ns]')
+        if isinstance(op, ast.Div) and kinds == 'mm':
+            return FLOAT
+    else:
+        dtype = np.result_type(left, right)
+        if isinstance(op, ast.Div) and dtype.kind in 'biu':
+            return FLOAT
+        return dtype
+    raise FormulaError(f"Unsupported operand types for '{symbol}': {_name(left)} and {_name(right)} in '{formula}'")
+
+
+class _Inference(ast.NodeVisitor):
+    def __init__(self, formula: str, inputs: Mapping[str, OutputType], functions: Mapping[str, Callable]):
+        self.formula = formula
+        self.inputs = inputs
+        self.functions = functions
+
+    def generic_visit(self, node: ast.AST) -> OutputType:
+        return OutputType()
+
+    def visit_Name(self, node: ast.Name) -> OutputType:
+        return self.inputs.get(node.id, OutputType())
+
+    def visit_Constant(self, node: ast.Constant) -> OutputType:
+        return OutputType('scalar', np.asarray(node.value).dtype if node.value is not None else FLOAT)
+
+    def visit_BinOp(self, node: ast.BinOp) -> OutputType:
+        types = [self.visit(node.left), self.visit(node.right)]
+        result = _align(types, self.formula)
+        dtype = _arithmetic(node.op, types[0].dtype, types[1].dtype, self.formula)
+        result.dtype = _gaps(types, dtype)
+        return result
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> OutputType:
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            self._truth(operand)
+            return OutputType('scalar', BOOL)
+        if operand.dtype is not None and operand.dtype.kind in 'USM' and not isinstance(node.op, ast.Invert):
+            raise FormulaError(f"Unsupported operand type for unary operator: {_name(operand.dtype)} in '{self.formula}'")
+        return OutputType(operand.kind, operand.dtype, operand.index, operand.labels)
+
+    def visit_Compare(self, node: ast.Compare) -> OutputType:
+        types = [self.visit(node.left)] + [self.visit(c) for c in node.comparators]
+        for op, left, right in zip(node.ops, types, types[1:]):
+            if isinstance(op, _ORDERING) and left.dtype is not None and right.dtype is not None:
+                kinds = {left.dtype.kind in 'biuf', right.dtype.kind in 'biuf'}
+                if len(kinds) == 2 and object not in (left.dtype, right.dtype):
+                    raise FormulaError(
+                        f"Unsupported comparison between {_name(left.dtype)} and {_name(right.dtype)} "
+                        f"in '{self.formula}'"
+                    )
+        result = _align(types, self.formula)
+        result.dtype = BOOL if result.kind == 'scalar' or _gaps(types, BOOL) is not None else None
+        return result
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> OutputType:
+        types = [self.visit(v) for v in node.values]
+        for t in types:
+            self._truth(t)
+        return OutputType('scalar', _common([t.dtype for t in types]))
+
+    def visit_IfExp(self, node: ast.IfExp) -> OutputType:
+        self._truth(self.visit(node.test))
+        body, orelse = self.visit(node.body), self.visit(node.orelse)
+        return body if body == orelse else OutputType(body.kind if body.kind == orelse.kind else None)
+
+    def _truth(self, value: OutputType) -> None:
+        if value.kind in ('series', 'frame'):
+            raise FormulaError(
+                f"The truth value of a series is ambiguous, use '&', '|', '~' or WHERE instead in '{self.formula}'"
+            )
+
+    def visit_Call(self, node: ast.Call) -> OutputType:
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        func = self.functions.get(name)
+        args = [self.visit(a) for a in node.args]
+        for keyword in node.keywords:
+            self.visit(keyword.value)
+        if func is None:
+            return OutputType()
+        self._bind(name, func, node)
+
+        rule = getattr(func, 'output', None)
+        if rule is None and getattr(func, 'elementwise', False):
+            rule = ('broadcast', None, 0)
+        if rule is None or not args:
+            return self._annotation(func)
+
+        kind, dtype, start = rule
+        if kind == 'first':
+            first = args[0]
+            return OutputType(first.kind, dtype or first.dtype, first.index, first.labels)
+        result = _align(args, self.formula)
+        result.dtype = _gaps(args, dtype or _common([a.dtype for a in args[start:]]))
+        return result
+
+    def _bind(self, name: str, func: Callable, node: ast.Call) -> None:
+        if any(isinstance(a, ast.Starred) for a in node.args) or any(k.arg is None for k in node.keywords):
+            return
+        try:
+            signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            return
+        try:
+            signature.bind(*node.args, **{k.arg: k.value for k in node.keywords})
+        except TypeError as error:
+            raise FormulaError(f"Invalid call to {name}(): {error} in '{self.formula}'")
+
+    @staticmethod
+    def _annotation(func: Callable) -> OutputType:
+        try:
+            annotation = inspect.signature(func).return_annotation
+        except (TypeError, ValueError):
+            return OutputType()
+        if annotation is pd.Series:
+            return OutputType('series')
+        if annotation is pd.DataFrame:
+            return OutputType('frame')
+        if annotation in (float, int, bool):
+            return OutputType('scalar', np.dtype(annotation))
+        return OutputType()
+
+
+def infer(compiled: CompiledFormula, inputs: Mapping[str, OutputType], functions: Mapping[str, Callable]) -> OutputType:
+    """Infer the output of the formula from the types of its inputs, raise FormulaError if they are incompatible."""
+    return _Inference(compiled.formula, inputs, functions).visit(compiled.tree.body)
+
+
+def _pending_type(node: Type[NodeMixin], memo: Dict[Any, Any]) -> OutputType:
+    """Type of a series not built yet, read from the values of a snapshot without loading the series."""
+    loader = node._loader
+    if not (isinstance(loader, partial) and loader.func is pd.Series and loader.args):
+        return OutputType('series')
+    values, index = loader.args[0], loader.keywords.get('index')
+    if index is None or not len(index):
+        return OutputType('series')
+    name = memo.get(('index', id(index)))
+    if name is None:
+        # The leaves of a snapshot share their indexes
+        name = memo[('index', id(index))] = str(index.dtype)
+    return OutputType('series', _values_dtype(values), name, index)
+
+
+def node_type(node: Type[NodeMixin], memo: Dict[Any, Any] = None) -> OutputType:
+    """Output of the node, inferred from its formula and its children if any or from its series otherwise."""
+    node = getattr(node, 'target', node)
+    memo = {} if memo is None else memo
+    result = memo.get(id(node))
+    if result is not None:
+        return result
+    if not node.formula or not node.children:
+        result = series_type(node.series) if node._loader is None or node._store is not None else _pending_type(node, memo)
+    else:
+        if node._evaluator is None:
+            node._evaluator = node.bind_formula(node.formula)
+        result = output_type(node._evaluator, memo)
+    memo[id(node)] = result
+    return result
+
+
+def output_type(evaluator: Any, memo: Dict[Any, Any] = None) -> OutputType:
+    """Output of the formula bound to the evaluator, kept on it until the versions of its inputs change."""
+    versions = tuple(child.version for child in evaluator.inputs)
+    if evaluator.output is None or evaluator.output_versions != versions:
+        memo = {} if memo is None else memo
+        types = input_types(evaluator, memo)
+
+        # Formulas repeated across the tree are inferred once per combination of input types
+        key = ('formula', id(evaluator.compiled), id(evaluator.registry)) + tuple(
+            (name, t.kind, t.dtype, t.index, id(t.labels)) for name, t in types.items()
+        )
+        result = memo.get(key)
+        if result is None:
+            result = memo[key] = infer(evaluator.compiled, types, evaluator.registry.functions)
+        evaluator.output, evaluator.output_versions = result, versions
+    return evaluator.output
+
+
+def input_types(evaluator: Any, memo: Dict[Any, Any] = None) -> Dict[str, OutputType]:
+    """Types of the inputs bound to an evaluator, an input whose own formula is rejected is unknown."""
+    memo = {} if memo is None else memo
+    types = {}
+    for name, child in evaluator.bindings:
+        try:
+            types[name] = node_type(child, memo)
+        except FormulaError:
+            types[name] = OutputType()
+    return types
+
+
+def analyze(root: Type[NodeMixin], raise_errors: bool = False) -> pd.DataFrame:
+    """Inferred output of every formula of the tree, whether it is element-wise and why it is rejected if it is."""
+    memo, rows = {}, []
+    for node in PreOrderIter(root, filter_=lambda n: not hasattr(n, 'target') and n.formula and n.children):
+        row = {'path': node.separator.join([''] + [str(n.name) for n in node.path]), 'formula': node.formula}
+        try:
+            result = node_type(node, memo)
+            error = None
+        except FormulaError as e:
+            if raise_errors:
+                raise
+            result, error = OutputType(), str(e)
+        evaluator = node._evaluator
+        row.update(
+            kind=result.kind, dtype=None if result.dtype is None else _name(result.dtype), index=result.index,
+            length=result.length, elementwise=evaluator.elementwise, error=error,
+        )
+        rows.append(row)
+    columns = ['path', 'formula', 'kind', 'dtype', 'index', 'length', 'elementwise', 'error']
+    return pd.DataFrame(rows, columns=columns).set_index('path')
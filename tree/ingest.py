@@ -0,0 +1,180 @@
+"""Ingestion pipeline
+
+An ingestor routes the columns of tabular data to the leaves of a tree by name or path. Every micro-batch is applied as
+a single coalesced update, so each affected ancestor is recalculated once per batch whatever the number of columns,
+and large inputs are consumed chunk by chunk.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, Ingestor
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> ingestor = Ingestor(a)
+    >>> df = pd.DataFrame({'b': [1.0, 2.0], 'c': [3.0, 4.0]})
+    >>> ingestor.ingest(df)
+    2
+    >>> ingestor.ingest(pd.DataFrame({'b': [5.0], 'c': [6.0]}, index=[2]))
+    2
+    >>> a.series
+    0     4.0
+    1     6.0
+    2    11.0
+    dtype: float64
+
+The module contains the following classes:
+
+- `Ingestor`
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Mapping, Type, Union
+
+import pandas as pd
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+from tree.engine import batch
+
+
+class Ingestor:
+    """Route the columns of tabular data to the nodes of a tree, one coalesced update per micro-batch."""
+    def __init__(
+        self,
+        root: Type[NodeMixin],
+        mapping: Mapping[str, Union[str, Type[NodeMixin]]] = None,
+        mode: Literal['append', 'replace'] = 'append',
+        strict: bool = False,
+        chunksize: int = None,
+    ):
+        if mode not in ('append', 'replace'):
+            raise ValueError("Expected 'append' or 'replace'!")
+
+        self.root = root
+
+        # 1. 'append' - rows past the end of a series are appended, earlier rows are updated in place
+        # 2. 'replace' - the series of the node is replaced by the column
+        self.mode = mode
+
+        # Raise a KeyError for the columns which can't be routed to a node instead of ignoring them
+        self.strict = strict
+
+        # Split the DataFrames into micro-batches of at most this number of rows
+        self.chunksize = chunksize
+
+        self.index = self.build_index(root)
+        self.mapping = {k: self.resolve(v) for k, v in (mapping or {}).items()}
+
+        self.batches = 0
+        self.rows = 0
+
+    @staticmethod
+    def build_index(root: Type[NodeMixin]) -> Dict[str, Type[NodeMixin]]:
+        """Index the nodes of the tree by path, and by name when the name is unique."""
+        index, names = {}, {}
+        for node in PreOrderIter(root):
+            if hasattr(node, 'target'):
+                continue
+            index[node.separator.join([''] + [str(n.name) for n in node.path])] = node
+            names.setdefault(node.name, []).append(node)
+        for name, nodes in names.items():
+            if len(nodes) == 1 and name not in index:
+                index[name] = nodes[0]
+        return index
+
+    def resolve(self, key: Union[str, Type[NodeMixin]]) -> Type[NodeMixin]:
+        if isinstance(key, NodeMixin):
+            return key
+        try:
+            return self.index[key]
+        except KeyError:
+            raise KeyError(f'No node found for {key!r}, the name is either missing or ambiguous')
+
+    def route(self, columns: Iterable[str]) -> Dict[str, Type[NodeMixin]]:
+        """Map the columns to their nodes."""
+        routes = {}
+        for column in columns:
+            node = self.mapping.get(column) or self.index.get(column)
+            if node is not None:
+                routes[column] = node
+            elif self.strict:
+                raise KeyError(f'No node found for the column {column!r}')
+        return routes
+
+    def ingest(self, data: Union[pd.DataFrame, Mapping[str, Any], List[Mapping[str, Any]]], index: str = None) -> int:
+        """Apply a DataFrame, a dict of columns or a list of records, and return the number of columns routed."""
+        frame = self._to_frame(data, index)
+        if self.chunksize is None or len(frame) <= self.chunksize:
+            return self._apply(frame)
+
+        count = 0
+        for i in range(0, len(frame), self.chunksize):
+            count = self._apply(frame.iloc[i:i + self.chunksize])
+        return count
+
+    def ingest_batches(self, batches: Iterable[Any], index: str = None) -> int:
+        """Apply an iterator of micro-batches one at a time and return the number of batches."""
+        count = 0
+        for data in batches:
+            self.ingest(data, index)
+            count += 1
+        return count
+
+    def ingest_ticks(self, data: pd.DataFrame, name: str = 'name', value: str = 'value', time: str = 'time') -> int:
+        """Apply tick data in long format, one row per (time, name, value)."""
+        frame = data.pivot_table(index=time, columns=name, values=value, aggfunc='last')
+        frame.columns.name = None
+        return self.ingest(frame)
+
+    def read_csv(self, path: str, chunksize: int = 10000, index_col: Any = 0, **kwargs: Any) -> int:
+        """Stream a CSV file through the tree, chunk by chunk."""
+        kwargs.setdefault('parse_dates', [index_col] if index_col is not None else False)
+        reader = pd.read_csv(path, chunksize=chunksize, index_col=index_col, **kwargs)
+        with reader:
+            return self.ingest_batches(reader)
+
+    def read_parquet(self, path: str, batch_size: int = 65536, index: str = None, columns: List[str] = None) -> int:
+        """Stream a Parquet file through the tree, record batch by record batch, requires pyarrow."""
+        try:
+            from pyarrow.parquet import ParquetFile
+        except ImportError:
+            raise ImportError('Reading Parquet files requires pyarrow to be installed')
+
+        file = ParquetFile(path)
+        return self.ingest_batches((b.to_pandas() for b in file.iter_batches(batch_size, columns=columns)), index)
+
+    @staticmethod
+    def _to_frame(data: Any, index: str = None) -> pd.DataFrame:
+        frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        return frame.set_index(index) if index is not None else frame
+
+    def _apply(self, frame: pd.DataFrame) -> int:
+        routes = self.route(frame.columns)
+        with batch():
+            for column, node in routes.items():
+                values = frame[column]
+                if self.mode == 'replace':
+                    node.series = values
+                else:
+                    self._upsert(node, values)
+        self.batches += 1
+        self.rows += len(frame)
+        return len(routes)
+
+    @staticmethod
+    def _upsert(node: Type[NodeMixin], values: pd.Series) -> None:
+        series = node.series
+        if series.empty:
+            node.series = values
+            return
+
+        index = series.index
+        if values.index.is_monotonic_increasing and index.is_monotonic_increasing and values.index[0] > index[-1]:
+            node.append(values)
+        else:
+            node.series = values.combine_first(series)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.root!r}, nodes={len(self.index)}, mode={self.mode!r})'
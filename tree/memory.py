@@ -0,0 +1,113 @@
+"""Memory-bounded evaluation
+
+Every node with a formula has a retention policy for its computed series:
+
+1. 'keep' - the series is kept until it changes, the default
+2. 'evict' - the series is kept while the memory budget of the tree allows it, least recently used first out
+3. 'none' - the series is dropped at the end of every propagation
+
+A dropped series is recomputed from the inputs of the node when it is read again through `series` or `dataframe`.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a, formula='x * 2', retention='evict')
+    >>> c = Node('c', parent=a, formula='y * 3', retention='evict')
+    >>> x = Node('x', parent=b)
+    >>> y = Node('y', parent=c)
+    >>> budget = a.set_memory_budget(8000)
+    >>> with a.batch():
+    ...     x.series = pd.Series(range(1000), dtype='float64')
+    ...     y.series = pd.Series(range(1000), dtype='float64')
+    >>> budget.resident, budget.evictions
+    (8000, 2)
+    >>> float(a.series.sum())
+    2497500.0
+
+The module contains the following classes/functions:
+
+- `MemoryBudget`
+- `resident_bytes(node: Node) -> int`
+"""
+
+from collections import OrderedDict
+from typing import Dict, Type
+
+from anytree.node import NodeMixin
+
+from tree.engine import subscribe
+
+# Nodes with the 'none' retention policy holding a series until the end of the propagation
+_transient: Dict[int, Type[NodeMixin]] = {}
+
+
+def _path(node: Type[NodeMixin]) -> str:
+    return node.separator.join([''] + [str(n.name) for n in node.path])
+
+
+def resident_bytes(node: Type[NodeMixin]) -> int:
+    """Bytes held by the values of the series of the node, the index is shared and not counted."""
+    series = node._series
+    return 0 if series is None or node._store is not None else int(series.nbytes)
+
+
+class MemoryBudget:
+    """Byte budget shared by the evictable nodes of a tree, evicting the least recently used series first."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.resident = 0
+        self.evictions = 0
+        self._nodes: 'OrderedDict[int, list]' = OrderedDict()
+
+    def __contains__(self, node: Type[NodeMixin]) -> bool:
+        return id(node) in self._nodes
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def touch(self, node: Type[NodeMixin]) -> None:
+        """Mark the node as the most recently used."""
+        if id(node) in self._nodes:
+            self._nodes.move_to_end(id(node))
+
+    def admit(self, node: Type[NodeMixin]) -> None:
+        """Account for the series of the node and evict other series until the budget is met."""
+        nbytes = resident_bytes(node)
+        entry = self._nodes.pop(id(node), None)
+        if entry is not None:
+            self.resident -= entry[1]
+        self._nodes[id(node)] = [node, nbytes]
+        self.resident += nbytes
+        self.shrink(keep=node)
+
+    def discard(self, node: Type[NodeMixin]) -> None:
+        entry = self._nodes.pop(id(node), None)
+        if entry is not None:
+            self.resident -= entry[1]
+
+    def shrink(self, keep: Type[NodeMixin] = None) -> None:
+        """Evict the least recently used series, except the one of the node to keep, until the budget is met."""
+        for key in list(self._nodes):
+            if self.resident <= self.max_bytes:
+                break
+            node = self._nodes[key][0]
+            if node is not keep and node.evict():
+                self.evictions += 1
+
+    def report(self) -> Dict[str, int]:
+        """Resident bytes per node path, the largest first."""
+        items = [(_path(node), nbytes) for node, nbytes in self._nodes.values()]
+        return dict(sorted(items, key=lambda item: -item[1]))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(resident={self.resident}, max_bytes={self.max_bytes})'
+
+
+def _drop_transient(batch) -> None:
+    for node in list(_transient.values()):
+        node.evict()
+    _transient.clear()
+
+
+subscribe('flushed', _drop_transient)
@@ -47,29 +47,116 @@ The module contains the following classes:
 
 - `Node`
 - `SymlinkNode`
+- `Evaluator`
 
 """
 
-import os
 from json import dumps
+from hashlib import blake2b
+from time import perf_counter
 from warnings import warn
-from typing import Literal, List, Any, Callable, Type
-from ast import parse, Assign, unparse
+from types import CodeType, ModuleType
+from typing import Literal, List, Any, Callable, Type, Mapping, Union, Optional, Tuple, Awaitable
 
+import numpy as np
 import pandas as pd
-from loguru import logger
-from tree.utils import FormulaTransformer
+from tree.utils import CompiledFormula, compile_formula, series_equal
+from tree.registry import FunctionRegistry, get_registry
+from tree.engine import Batch, batch, consumers, propagate
+from tree.storage import ColumnStore
+from tree.scheduler import Scheduler
+from tree.deferred import get_queue
+from tree import snapshot, profiling
+from tree.gas_calendar import FREQUENCIES, resample, resample_tail
+from tree.overrides import Override, OverrideStore
+from tree.optimizer import Optimizer
+from tree.memory import MemoryBudget, resident_bytes, _transient
+from tree.changes import ChangeSet, changes_since, next_epoch
+from tree.inference import OutputType, analyze, node_type, output_type
 from tree.exceptions import ReadOnlyError, FormulaError, MissingFormula
 
 from anytree.node import NodeMixin, SymlinkNodeMixin
 from anytree.node.util import _repr
 from anytree.exporter import DictExporter
 from anytree.util import leftsibling, rightsibling
-from anytree import RenderTree, AbstractStyle, ContStyle
+from anytree import RenderTree, AbstractStyle, ContStyle, PreOrderIter
+
+
+class Evaluator:
+    """Compiled formula bound to the children of a node."""
+    def __init__(self, node: 'Node', compiled: CompiledFormula, temporaries: tuple = (), code: CodeType = None):
+        self.node = node
+        self.compiled = compiled
+
+        # Shared sub-expressions evaluated before the formula and the formula rewritten to read them, see
+        # tree.optimizer, the compiled formula is left untouched for the callers evaluating it on their own
+        self.temporaries = temporaries
+        self.code = code if code is not None else compiled.code
+        self.registry = node.registry
+        self.bindings = tuple((c.name, c) for c in node.children if c.name in compiled.names)
+        self.inputs = tuple(child for _, child in self.bindings)
+        self.elementwise = self.registry.is_elementwise(compiled)
+
+        # Output inferred from the types of the inputs at these versions, see tree.inference
+        self.output = None
+        self.output_versions = None
+
+    def namespace(self, start: Any = None) -> dict:
+        """Values of the inputs referenced by the formula, from the start label onwards if any."""
+        store = self.node._store
+        if store is not None:
+            return {name: store.column(child, start) for name, child in self.bindings}
+        if start is None:
+            return {name: child.series for name, child in self.bindings}
+        return {name: _tail(child.series, start) for name, child in self.bindings}
+
+    def __call__(self, start: Any = None) -> Any:
+        namespace = self.namespace(start)
+        if self.temporaries:
+            store = self.node._store
+            scope = None if start is not None else 'series' if store is None else id(store)
+            for temporary in self.temporaries:
+                namespace[temporary.name] = temporary.evaluate(self.registry.namespace, namespace, scope)
+        return eval(self.code, self.registry.namespace, namespace)
+
+
+class _TriggerFlag:
+    """Flag read by the trigger conditions, the parents count the children blocking them whenever it changes."""
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, node: 'Node', owner: type = None) -> Any:
+        return self if node is None else node.__dict__[self.name]
+
+    def __set__(self, node: 'Node', value: bool) -> None:
+        node._set_trigger_flag(self.name, value)
+
+
+# Number of partial changes kept per node to work out the rows to re-evaluate
+_MAX_CHANGES = 64
+
+
+def _empty_series() -> pd.Series:
+    return pd.Series(dtype='float64')
+
+
+def _fingerprint(series: pd.Series) -> tuple:
+    """Cheap summary of a series, equal for equal series whatever the memory they are held in."""
+    rows = pd.util.hash_pandas_object(series).to_numpy()
+    return series.dtype, series.name, len(series), blake2b(rows.tobytes(), digest_size=16).digest()
+
+
+def _tail(series: pd.Series, start: Any) -> pd.Series:
+    return series.iloc[series.index.searchsorted(start):]
 
 
 class Node(NodeMixin):
     """Reactive Node"""
+    is_dirty = _TriggerFlag()
+    is_locked = _TriggerFlag()
+    is_trigger_event = _TriggerFlag()
+    _stale = _TriggerFlag()
+
     def __init__(
         self,
         name: str,
@@ -79,17 +166,52 @@ class Node(NodeMixin):
         assert_series_equal: bool = True,
         formula: str = '',
         funcs_path: str = None,
+        functions: Union[ModuleType, Mapping[str, Callable], FunctionRegistry] = None,
         trigger_type: Literal['any', 'all'] = 'any',
         is_trigger_event: bool = True,
         is_deferred: bool = False,
+        retention: Literal['keep', 'evict', 'none'] = 'keep',
+        evaluation: Literal['eager', 'lazy'] = 'eager',
         read_only: bool = False,
         parent: Type[NodeMixin] = None,
         children: Type[NodeMixin] = None,
     ):
         self.name = name
+        self.curve = curve
         self.desc = desc
         self._series = series
 
+        # Keep track of the symbolic nodes
+        self.book = {}
+
+        # Number of the trigger children read by the formula that are locked or unchanged, the parent with
+        # trigger_type='all' waits for none
+        self._blocking = 0
+
+        # Builds the series on first read, an empty series by default or a view on a snapshot
+        self._loader = None if series is not None else _empty_series
+
+        # Define how long the computed series is kept, see tree.memory
+        # 1. 'keep' - until it changes
+        # 2. 'evict' - while the memory budget of the tree allows it
+        # 3. 'none' - until the end of the propagation
+        self.retention = retention
+
+        # Flag if the computed series has been dropped and is recomputed on read, with the fingerprint of the dropped
+        # series to tell whether a recomputed value changed
+        self._evicted = False
+        self._fingerprint = None
+        self._budget = None
+
+        # Resampled series per (freq, how) with the version of the series they were computed from
+        self._resampled = {}
+
+        # Manual overrides applied on top of the series, see tree.overrides
+        self._overrides = None
+
+        # Column store owning the values when the tree is in columnar mode
+        self._store = None
+
         # Only reassign the series if the new value is different from the existing one
         self.assert_series_equal = assert_series_equal
 
@@ -101,11 +223,32 @@ class Node(NodeMixin):
 
         # Flag if the series is being updated by the remote
         self.is_locked = False
+
+        # Incremented every time the series is changed
+        self.version = 0
+
+        # Epoch of the last change, drawn from the process-wide counter, see tree.changes
+        self.modified_epoch = 0
+
+        # Version and epoch of the last change to the whole series and the (version, start, epoch) of the partial
+        # changes since then, a partial change leaves the rows before its start untouched
+        self._full_version = 0
+        self._full_epoch = 0
+        self._changes = []
+
+        # Epoch of the last partial change dropped from the capped history, older epochs see a full change
+        self._trimmed_epoch = 0
+
+        # Versions of the inputs and of the node itself when the formula was last evaluated
+        self._input_versions = None
+        self._calculated_version = None
         self._formula = formula
-        self._funcs_path = funcs_path if funcs_path else os.path.join(os.path.dirname(__file__), 'functions.py')
-        self._registered_functions = self.get_registered_functions()
-        self._statement = None
-        self._statement_ast = None
+
+        # Shared registry of the functions available to the formula
+        self._registry = get_registry(functions if functions is not None else funcs_path)
+
+        # Evaluator bound to the current children, reset whenever the children are changed
+        self._evaluator = None
 
         # Define when the node can be updated
         # 1. 'all' - update the node when children are changed
@@ -118,8 +261,13 @@ class Node(NodeMixin):
         # Flag if the node should be updated immediately if all the conditions are passed
         self.is_deferred = is_deferred
 
-        # Keep track of the symbolic nodes
-        self.book = {}
+        # Define how the ancestors of a changed node are updated, the mode of the root applies to the whole tree
+        # 1. 'eager' - recalculate them when the change is propagated
+        # 2. 'lazy' - invalidate them and recalculate them when they are read
+        self._evaluation = evaluation
+
+        # Flag if the node has been invalidated in lazy mode and is recalculated on the next read
+        self._stale = False
 
         self.parent = parent
         if children:
@@ -133,6 +281,47 @@ class Node(NodeMixin):
         if self.root.read_only:
             raise ReadOnlyError()
 
+    def _post_attach(self, parent: Type[NodeMixin]) -> Any:
+        parent.invalidate_evaluator()
+        if parent.references(self.name):
+            parent._blocking += self._blocks_trigger
+        budget = getattr(parent, '_budget', None)
+        if budget is not None:
+            for node in PreOrderIter(self, filter_=lambda n: isinstance(n, Node)):
+                node._budget = budget
+        store = getattr(parent, '_store', None)
+        if store is not None and self._store is not store:
+            for node in PreOrderIter(self, filter_=lambda n: isinstance(n, Node) and n._store is None):
+                store.add(node, node.series)
+                node._store, node._series = store, None
+
+    def _post_detach(self, parent: Type[NodeMixin]) -> Any:
+        parent.invalidate_evaluator()
+        if parent.references(self.name):
+            parent._blocking -= self._blocks_trigger
+        store = self._store
+        if store is not None:
+            for node in PreOrderIter(self, filter_=lambda n: isinstance(n, Node) and n._store is store):
+                node._series, node._store = store.remove(node), None
+
+    def use_columnar(self, index: pd.Index = None) -> ColumnStore:
+        """Move the series of the whole tree into a column store sharing the index, by default the union of them."""
+        nodes = [n for n in PreOrderIter(self.root) if isinstance(n, Node)]
+        if index is None:
+            index = pd.Index([])
+            for node in nodes:
+                series = node.series
+                if node._store is None and not series.empty and not series.index.equals(index):
+                    index = series.index if index.empty else index.union(series.index)
+
+        store = ColumnStore(index, capacity=max(len(nodes), 1))
+        for node in nodes:
+            series = node.series
+            store.add(node, series)
+            node._store, node._series = store, None
+            node.invalidate_evaluator()
+        return store
+
     @property
     def left_sibling(self):
         return leftsibling(self)
@@ -143,45 +332,105 @@ class Node(NodeMixin):
 
     @property
     def funcs_path(self):
-        return self._funcs_path
+        source = self._registry.source
+        return source if isinstance(source, str) else getattr(source, '__file__', None)
 
     @funcs_path.setter
     def funcs_path(self, value: str):
         if not isinstance(value, str):
             raise TypeError('Expected a string!')
-        self._funcs_path = value
-        self._registered_functions = self.get_registered_functions()
+        self.registry = get_registry(value)
+
+    @property
+    def registry(self) -> FunctionRegistry:
+        return self._registry
+
+    @registry.setter
+    def registry(self, value: Union[str, ModuleType, Mapping[str, Callable], FunctionRegistry]):
+        self._registry = get_registry(value)
+        self.invalidate_evaluator()
 
     def get_registered_functions(self) -> List[str]:
-        with open(self.funcs_path) as file:
-            tree = parse(file.read())
-            for node in tree.body:
-                if isinstance(node, Assign):
-                    return [e.value for e in node.value.elts]
+        return list(self._registry.names)
 
     @property
     def registered_functions(self) -> List[str]:
-        return self._registered_functions
+        return self._registry.names
 
     def can_recalculate_parent(self, node: Type[NodeMixin]) -> bool:
+        return not node.is_root and not node.parent.is_deferred and self.can_trigger_parent(node)
+
+    def can_trigger_parent(self, node: Type[NodeMixin]) -> bool:
+        """Check the trigger conditions of the parent, whether it is deferred or not."""
         flag = False
-        if not node.is_root:
-            if not node.parent.is_deferred and not node.parent.is_locked:
+        if not node.is_root and node.parent.references(node.name):
+            if not node.parent.is_locked:
                 if node.parent.trigger_type == 'any':
-                    if all((node.is_dirty, node.is_trigger_event, not node.is_locked)):
+                    if all((node.is_dirty or node._stale, node.is_trigger_event, not node.is_locked)):
                         flag = True
                 else:
-                    flag = True
-
-                    for s in node.siblings:
-                        if not s.is_trigger_event:
-                            pass
-                        else:
-                            if not s.is_dirty or s.is_locked:
-                                flag = False
-                                break
+                    # No sibling is blocking
+                    flag = node.parent._blocking == node._blocks_trigger
         return flag
 
+    @property
+    def _blocks_trigger(self) -> int:
+        """1 if the node prevents its parents with trigger_type='all' from being triggered, 0 otherwise."""
+        return int(self.is_trigger_event and (self.is_locked or not (self.is_dirty or self._stale)))
+
+    def _set_trigger_flag(self, name: str, value: bool) -> None:
+        state = self.__dict__
+        if name not in state:
+            # Set by the constructor, the node isn't attached to any parent yet
+            state[name] = value
+            return
+        if state[name] == value:
+            return
+        edges = consumers(self)
+        if not edges:
+            state[name] = value
+            return
+        before = self._blocks_trigger
+        state[name] = value
+        delta = self._blocks_trigger - before
+        if delta:
+            for edge, parent in edges:
+                if parent.references(edge.name):
+                    parent._blocking += delta
+
+    def references(self, name: str) -> bool:
+        """Check if the formula reads the child of that name, a node without formula is triggered by every child."""
+        if not self.formula:
+            return True
+        compiled = self._evaluator.compiled if self._evaluator is not None else compile_formula(self.formula)
+        return name in compiled.names
+
+    @property
+    def evaluation(self) -> str:
+        return self.root._evaluation
+
+    @evaluation.setter
+    def evaluation(self, value: Literal['eager', 'lazy']) -> None:
+        if value not in ('eager', 'lazy'):
+            raise ValueError("Expected 'eager' or 'lazy'!")
+        self.root._evaluation = value
+        if value == 'eager':
+            for node in PreOrderIter(self.root, filter_=lambda n: isinstance(n, Node) and n._stale):
+                node._refresh()
+
+    @property
+    def is_lazy(self) -> bool:
+        return self.root._evaluation == 'lazy'
+
+    def invalidate(self) -> None:
+        """Mark the node to be recalculated on the next read."""
+        self._stale = True
+
+    def _refresh(self) -> None:
+        self._stale = False
+        if self.formula:
+            self.calculate()
+
     @property
     def formula(self):
         return self._formula
@@ -191,28 +440,51 @@ class Node(NodeMixin):
         if not isinstance(value, str):
             raise TypeError('Expected a string!')
 
-        v = self.registered_functions + ['self']
-        e = ['from tree.functions import *']
-        for i, c in enumerate(self.children):
-            v.append(c.name)
-            e.append(f'{c.name} = self.children[{i}].series')
-        e.append(f'self.series = {value}')
-        self._statement = '\n'.join(e)
-        try:
-            self._statement_ast = parse(self._statement)
-        except SyntaxError:
-            raise SyntaxError(f'Invalid formula: "{value}"')
-
-        try:
-            FormulaTransformer(v).visit(self._statement_ast)
-        except FormulaError:
-            self._statement, self._statement_ast = None, None
-            raise
-        else:
-            self._formula = value
+        evaluator = self.bind_formula(value)
+        output_type(evaluator)
+        self._evaluator = evaluator
+        self._input_versions = None
+        self._formula = value
+        self._blocking = sum(c._blocks_trigger for c in self.children if self.references(c.name))
+
+    def bind_formula(self, formula: str) -> 'Evaluator':
+        """Validate the formula against the current children and return an evaluator bound to them."""
+        compiled = compile_formula(formula)
+        compiled.validate(self.registered_functions + [c.name for c in self.children])
+        return Evaluator(self, compiled)
+
+    @property
+    def output(self) -> Optional[OutputType]:
+        """Output inferred for the formula, kind, dtype and index to allocate the result, None until checked."""
+        return self._evaluator.output if self._evaluator is not None else None
+
+    def check(self) -> OutputType:
+        """Infer the output of the node from its formula and its children, raise FormulaError if they don't match."""
+        return node_type(self)
+
+    def analyze(self) -> pd.DataFrame:
+        """Inferred output of every formula of the tree, see tree.inference."""
+        return analyze(self.root)
+
+    def invalidate_evaluator(self) -> None:
+        """Drop the bound evaluator, it will be rebuilt on the next calculation."""
+        self._evaluator = None
+        self._input_versions = None
 
     @property
     def series(self) -> pd.Series:
+        if self._stale:
+            self._refresh()
+        if self._store is not None:
+            return self._store.series(self)
+        if self._loader is not None:
+            if self._evicted and self.retention == 'none':
+                return self._loader()
+            self._series, self._loader, self._evicted = self._loader(), None, False
+            if self._budget is not None and self.retention == 'evict':
+                self._budget.admit(self)
+        elif self._budget is not None:
+            self._budget.touch(self)
         return self._series
 
     @series.setter
@@ -220,44 +492,326 @@ class Node(NodeMixin):
         if not isinstance(value, pd.Series):
             raise TypeError('Expected a pd.Series')
 
-        flag = True
-        if self.assert_series_equal:
-            try:
-                pd.testing.assert_series_equal(self._series, value)
-            except AssertionError:
-                pass
-            else:
-                flag = False
+        self._assign(value)
+
+    def _assign(self, value: Any) -> None:
+        value = self._overlay(value)
+        if self._store is not None:
+            value = self._store.align(value)
+            if not self.assert_series_equal or not self._equals(value):
+                self._update(value)
+        elif not self.assert_series_equal or self._unset or not self._equals(value):
+            self._update(value)
+
+    @property
+    def _unset(self) -> bool:
+        """Check if the series has never been set, the first value is a change without building the empty one."""
+        return self._series is None and self._loader is _empty_series
+
+    def _equals(self, value: Any) -> bool:
+        """Return True if the value equals the current series, timed while a profiler is active."""
+        profiler = profiling._active
+        start = perf_counter() if profiler is not None else None
+        if self._store is not None:
+            result = self._store.equal(self, value)
+        elif self._evicted:
+            result = self._fingerprint == _fingerprint(value)
+        else:
+            result = series_equal(self.series, value)
+        if profiler is not None:
+            profiler.comparison(self, perf_counter() - start)
+        return result
+
+    def append(self, tail: pd.Series) -> Any:
+        """Append rows after the end of the series, only the new rows are pushed to the element-wise ancestors."""
+        if not isinstance(tail, pd.Series):
+            raise TypeError('Expected a pd.Series')
+
+        if tail.empty:
+            return
+        if self._store is not None:
+            self._update(*reversed(self._store.align_tail(self._overlay(tail, tail.index[0]))))
+            return
+        series = self.series
+        if series.empty:
+            self.series = tail
+            return
+        if not tail.index.is_monotonic_increasing or not series.index.is_monotonic_increasing \
+                or not tail.index[0] > series.index[-1]:
+            raise ValueError('Expected the tail to start after the end of the series!')
+
+        self._update(pd.concat([series, self._overlay(tail, tail.index[0])]), start=tail.index[0])
+
+    def _update(self, value: pd.Series, start: Any = None) -> None:
+        if self._store is not None:
+            self._store.write(self, value, start)
+        else:
+            self._series, self._loader, self._evicted, self._fingerprint = value, None, False, None
+            if self.retention == 'none' and self.formula:
+                _transient[id(self)] = self
+            elif self._budget is not None and self.retention == 'evict':
+                self._budget.admit(self)
+        self.is_dirty = True
+        self.version += 1
+        self.modified_epoch = next_epoch()
+        if start is None:
+            self._full_version, self._full_epoch, self._changes = self.version, self.modified_epoch, []
+        else:
+            self._changes.append((self.version, start, self.modified_epoch))
+            if len(self._changes) > _MAX_CHANGES:
+                self._trimmed_epoch = self._changes.pop(0)[2]
+        propagate(self)
 
-        if flag:
-            self._series = value
-            self.is_dirty = True
+    async def flush(self) -> int:
+        """Recalculate the deferred nodes queued in the tree and return how many ran."""
+        return await get_queue().flush_async(self.root)
 
-            if self.can_recalculate_parent(self):
-                logger.debug(f"'{self.parent.name}' is triggered by the node '{self.name}'")
-                self.parent.calculate()
+    def next_state(self) -> Awaitable[pd.Series]:
+        """Awaitable resolved with the series once the node changed and has no pending recalculation."""
+        return get_queue().next_state(self)
 
-            for key, value in self.book.items():
-                if value.can_recalculate_parent(value):
-                    logger.debug(f"'{value.parent.name}' is triggered by the symbolic node '{value.name}'")
-                    value.parent.calculate()
+    def batch(self, scheduler: Scheduler = None) -> Batch:
+        """Collect the series changes made within the block and propagate them once when it exits."""
+        return batch(scheduler)
 
     @property
     def dataframe(self) -> pd.DataFrame:
         if self.is_leaf:
             return self.series.to_frame()
+        for child in self.children:
+            if child._stale:
+                child._refresh()
+        if self._store is not None and all(child in self._store for child in self.children):
+            return self._store.frame(self.children)
         else:
             data, name = [], []
             [(data.append(child.series), name.append(child.name)) for child in self.children]
             return pd.concat(data, axis=1, keys=name)
 
-    def calculate(self) -> Any:
-        if self.formula and self.children:
-            if self._statement_ast is None:
-                self.formula = self.formula
-            exec(unparse(self._statement_ast))
-        else:
+    def calculate(self, force: bool = False) -> Any:
+        """Evaluate the formula, skipped unless forced when none of the inputs changed since the last evaluation."""
+        plan = self.prepare(force)
+        if plan is not None:
+            versions, start = plan
+            self.commit(versions, start, self.evaluate(start))
+
+    def evaluate(self, start: Any = None) -> Any:
+        """Evaluate the bound formula from the row, timed while a profiler is active."""
+        profiler = profiling._active
+        if profiler is None:
+            return self._evaluator(start)
+        begin = perf_counter()
+        value = self._evaluator(start)
+        profiler.calculation(self, begin, perf_counter() - begin)
+        return value
+
+    def prepare(self, force: bool = False) -> Optional[Tuple[tuple, Any]]:
+        """Return the versions of the inputs and the first row to evaluate, None if the formula doesn't need to run."""
+        if not self.formula:
+            if not self.children:
+                raise FormulaError('No formula to evaluate!')
             warn('No formula to evaluate!', MissingFormula)
+            return None
+
+        if self._evaluator is None:
+            self._evaluator = self.bind_formula(self.formula)
+
+        # Pulling the invalidated inputs propagates their changes, which invalidates the node again
+        for child in self._evaluator.inputs:
+            if child._stale:
+                child._refresh()
+        self._stale = False
+        versions = tuple(child.version for child in self._evaluator.inputs)
+        if not force and versions == self._input_versions:
+            return None
+        return versions, None if force else self._incremental_start(versions)
+
+    def commit(self, versions: tuple, start: Any, value: Any) -> None:
+        """Store the value computed for the plan returned by prepare()."""
+        if start is not None:
+            self._extend(value, start)
+        elif self._store is None:
+            self.series = value
+        else:
+            self._assign(value)
+        self._input_versions = versions
+        self._calculated_version = self.version
+
+    def _incremental_start(self, versions: tuple) -> Any:
+        """Return the first row to re-evaluate if only the tails of the inputs changed, None for a full evaluation."""
+        if self._evicted:
+            return None
+        series = self.series
+        if self._input_versions is None or self.version != self._calculated_version or series.empty:
+            return None
+        if not self._evaluator.elementwise or not series.index.is_monotonic_increasing:
+            return None
+
+        start = None
+        for child, before, now in zip(self._evaluator.inputs, self._input_versions, versions):
+            if not child.series.index.is_monotonic_increasing:
+                return None
+            if before == now:
+                continue
+
+            first = child._tail_start(before)
+            if first is None:
+                return None
+            start = first if start is None else min(start, first)
+        return start
+
+    def _tail_start(self, version: int) -> Any:
+        """Return the first row changed since the version if only tails were appended since, None otherwise."""
+        changes = self._changes
+        if self._full_version > version or not changes or changes[0][0] > version + 1:
+            return None
+        return min(label for v, label, _ in changes if v > version)
+
+    def _start_since(self, epoch: int) -> Any:
+        """Return the first row changed after the epoch if only tails were appended since, None otherwise."""
+        if self._full_epoch > epoch or self._trimmed_epoch > epoch:
+            return None
+        versions = [v for v, _, e in self._changes if e > epoch]
+        return self._tail_start(versions[0] - 1) if versions else None
+
+    def changes_since(self, epoch: int, ranges: bool = True) -> ChangeSet:
+        """Nodes of the subtree changed after the epoch, with the first row changed if ranges is True."""
+        return changes_since(self, epoch, ranges)
+
+    def _extend(self, tail: pd.Series, start: Any) -> None:
+        tail = self._overlay(tail, start)
+        if self._store is not None:
+            if not self.assert_series_equal or not self._store.equal(self, tail, start):
+                self._update(tail, start=start)
+            return
+
+        series = self.series
+        head = series.iloc[:series.index.searchsorted(start)]
+        if self.assert_series_equal and series_equal(series.iloc[len(head):], tail):
+            return
+        self._update(pd.concat([head, tail]) if len(head) else tail, start=start)
+
+    @property
+    def overrides(self) -> OverrideStore:
+        if self._overrides is None:
+            # The series of a columnar node is a view on the shared block which the overrides are written into
+            base = self.series.copy() if self._store is not None else self.series
+            self._overrides = OverrideStore(self.curve or self.name, base)
+        return self._overrides
+
+    def override(self, value: float, start_point_date: Any, end_point_date: Any = None, **kwargs: Any) -> Override:
+        """Override the points from the start to the end date, both included, and propagate the change."""
+        index = self.series.index
+        if not isinstance(index, pd.DatetimeIndex) or not index.is_monotonic_increasing:
+            raise ValueError('Expected a series with a monotonic increasing DatetimeIndex!')
+        store = self.overrides
+        override = store.add(value, start_point_date, end_point_date, **kwargs)
+        self._reapply_overrides(np.array([len(store) - 1]))
+        return override
+
+    def retract(self, version: int, reason: str = '') -> None:
+        """Retract the override recorded at the version and propagate the change."""
+        store = self.overrides
+        store.retract(version, reason)
+        self._reapply_overrides(np.flatnonzero(store.records['version'] == version))
+
+    def _reapply_overrides(self, positions: np.ndarray) -> None:
+        store = self._overrides
+        rows = store.rows(store.base.index, positions)
+        if rows is not None:
+            self._update(store.apply(store.base), start=store.base.index[rows[0]])
+
+    def _overlay(self, value: Any, start: Any = None) -> Any:
+        """Record the new base rows from the start onwards and return them with the overrides applied."""
+        store = self._overrides
+        if store is None:
+            return value
+        if not isinstance(value, pd.Series):
+            index = self._store.index
+            value = pd.Series(value, index=index if start is None else index[index.searchsorted(start):])
+        if start is None:
+            store.base = value
+        else:
+            base = store.base
+            store.base = pd.concat([base.iloc[:base.index.searchsorted(start)], value])
+        return store.apply(value)
+
+    def as_of(
+        self, version: int = None, time: Any = None, effective: Any = None, start: Any = None, end: Any = None,
+    ) -> pd.Series:
+        """Series from the start to the end label with the overrides known as of the version or the time of the
+        overrides, and effective at the date if any."""
+        store = self._overrides
+        series = self.series if store is None else store.base
+        index = series.index
+        lower = 0 if start is None else index.searchsorted(start)
+        upper = len(index) if end is None else index.searchsorted(end, side='right')
+        if store is None:
+            return series.iloc[lower:upper]
+        return store.apply(series, store.select(version, time, effective), lower, upper)
+
+    def resample(self, freq: str, how: Union[str, Callable] = 'mean') -> pd.Series:
+        """Resample the series on the gas calendar, cached until the series changes, see tree.gas_calendar."""
+        key = (freq, how)
+        cached = self._resampled.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        series = self.series
+        start = None if cached is None or freq not in FREQUENCIES else self._tail_start(cached[0])
+        if start is None or not series.index.is_monotonic_increasing:
+            value = resample(series, freq, how)
+        else:
+            value = resample_tail(cached[1], series, start, freq, how)
+        self._resampled[key] = (self.version, value)
+        return value
+
+    def evict(self) -> bool:
+        """Drop the computed series, it is recomputed from the inputs on the next read."""
+        if not self.formula or not self.children or self._store is not None or self._series is None:
+            return False
+        if self._budget is not None:
+            self._budget.discard(self)
+        self._fingerprint = _fingerprint(self._series)
+        self._series, self._loader, self._evicted = None, self._recompute, True
+        return True
+
+    def _recompute(self) -> pd.Series:
+        if self._evaluator is None:
+            self._evaluator = self.bind_formula(self.formula)
+        return self._evaluator()
+
+    def set_memory_budget(self, max_bytes: int) -> MemoryBudget:
+        """Share a byte budget between the evictable nodes of the tree."""
+        budget = MemoryBudget(max_bytes)
+        for node in PreOrderIter(self.root, filter_=lambda n: isinstance(n, Node)):
+            node._budget = budget
+            if node.retention == 'evict' and node._series is not None:
+                budget.admit(node)
+        return budget
+
+    @property
+    def resident_bytes(self) -> int:
+        return resident_bytes(self)
+
+    def memory_report(self) -> pd.Series:
+        """Resident bytes per node of the subtree."""
+        nodes = [n for n in PreOrderIter(self) if isinstance(n, Node)]
+        paths = [n.separator.join([''] + [str(p.name) for p in n.path]) for n in nodes]
+        return pd.Series([n.resident_bytes for n in nodes], index=paths, dtype='int64').sort_values(ascending=False)
+
+    def optimize(self, fold: bool = True) -> Optimizer:
+        """Share the common sub-expressions of the formulas of the tree and fold their constants."""
+        return Optimizer(self, fold).optimize()
+
+    def save(self, path: str) -> None:
+        """Snapshot the tree, and the trees linked to it by symbolic nodes, into a directory."""
+        snapshot.save(self, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, functions: Any = None) -> 'Node':
+        """Restore a snapshot, the series are memory-mapped unless mmap is False."""
+        return snapshot.load(path, mmap=mmap, functions=functions)
 
     def to_dict(
         self,
@@ -313,7 +867,8 @@ class SymlinkNode(SymlinkNodeMixin):
     """Symbolic Node"""
     def __init__(self, target, parent=None, children=None, **kwargs):
         self.target = target
-        self.target.__dict__.update(kwargs)
+        for key, value in kwargs.items():
+            setattr(self.target, key, value)
         self.parent = parent
         if children:
             self.children = children
@@ -327,9 +882,15 @@ class SymlinkNode(SymlinkNodeMixin):
 
     def _post_attach(self, parent) -> Any:
         self.target.book[self.abs_path] = self
+        parent.invalidate_evaluator()
+        if parent.references(self.name):
+            parent._blocking += self.target._blocks_trigger
 
     def _post_detach(self, parent) -> Any:
         del self.target.book[self.abs_path]
+        parent.invalidate_evaluator()
+        if parent.references(self.name):
+            parent._blocking -= self.target._blocks_trigger
 
     def __repr__(self):
         return _repr(self, [repr(self.target)], nameblacklist=('target', ))
@@ -0,0 +1,255 @@
+"""Formula optimizer
+
+The formulas of a tree, and of the trees connected to it through symbolic nodes, are parsed together. Arithmetic on
+constants is folded, reassociating the constant factors of products and quotients, so `ttf * fx * 100 / 34.121416`
+multiplies by a single constant. Every sub-expression is hashed with its names resolved to the nodes they are bound to,
+the ones found more than once are evaluated once per propagation pass and shared by every formula using them.
+
+Folding reassociates floating point operations, the results may differ from the plain evaluation in the last digits.
+Changing the formula or the children of a node drops its optimized plan, run `optimize()` again afterwards.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, SymlinkNode
+    >>> a = Node('a', formula='(x - y) * 2')
+    >>> b = Node('b', formula='MAX(x - y, 0) * 100 / 4')
+    >>> x = Node('x', parent=a)
+    >>> y = Node('y', parent=a)
+    >>> _ = SymlinkNode(x, parent=b), SymlinkNode(y, parent=b)
+    >>> optimizer = a.optimize()
+    >>> optimizer.report()['expression'].tolist()
+    ['x - y']
+    >>> b.formula, optimizer.formula(b)
+    ('MAX(x - y, 0) * 100 / 4', 'MAX(_cse_0, 0) * 25.0')
+
+The module contains the following classes/functions:
+
+- `ConstantFolder`
+- `Optimizer`
+- `fold_constants(tree: ast.Expression) -> ast.Expression`
+"""
+
+import ast
+import operator
+from copy import deepcopy
+from collections import Counter
+from typing import Any, Dict, List, Tuple, Type
+from weakref import WeakSet
+
+import pandas as pd
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+from tree.engine import connected_roots, subscribe
+
+_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+_UNARY_OPERATORS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+# Expressions worth sharing, names and constants are already free to read
+_SHAREABLE = (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare, ast.BoolOp, ast.IfExp)
+
+# Optimizers whose cached values are dropped at the end of every propagation pass
+_optimizers: 'WeakSet[Optimizer]' = WeakSet()
+
+
+def _number(node: ast.AST) -> bool:
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float)
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """Fold the arithmetic on constants, reassociating the constants of chained products, quotients and sums."""
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        self.generic_visit(node)
+        op = _UNARY_OPERATORS.get(type(node.op))
+        if op is not None and _number(node.operand):
+            return ast.copy_location(ast.Constant(op(node.operand.value)), node)
+        return node
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        left, right, op = node.left, node.right, type(node.op)
+        try:
+            if _number(left) and _number(right) and op in _OPERATORS and not (op is ast.Pow and abs(right.value) > 64):
+                return ast.copy_location(ast.Constant(_OPERATORS[op](left.value, right.value)), node)
+            if _number(right) and isinstance(left, ast.BinOp) and _number(left.right):
+                folded = self._reassociate(type(left.op), left.right.value, op, right.value)
+                if folded is not None:
+                    new_op, value = folded
+                    return ast.copy_location(ast.BinOp(left.left, new_op(), ast.Constant(value)), node)
+        except (ArithmeticError, ValueError):
+            pass
+        return node
+
+    @staticmethod
+    def _reassociate(inner: type, c1: float, outer: type, c2: float):
+        """Return the operator and the constant of (x inner c1) outer c2 as x op c, None if it can't be folded."""
+        if inner in (ast.Mult, ast.Div) and outer in (ast.Mult, ast.Div):
+            if inner is ast.Mult:
+                return ast.Mult, c1 * c2 if outer is ast.Mult else c1 / c2
+            return (ast.Div, c1 * c2) if outer is ast.Div else (ast.Mult, c2 / c1)
+        if inner in (ast.Add, ast.Sub) and outer in (ast.Add, ast.Sub):
+            sign = 1 if inner is ast.Add else -1
+            value = sign * c1 + (c2 if outer is ast.Add else -c2)
+            return (ast.Add, value) if value >= 0 else (ast.Sub, -value)
+        return None
+
+
+def fold_constants(tree: ast.Expression) -> ast.Expression:
+    """Return a copy of the parsed formula with its constants folded."""
+    return ast.fix_missing_locations(ConstantFolder().visit(deepcopy(tree)))
+
+
+class _Temporary:
+    """Shared sub-expression evaluated by a node."""
+    __slots__ = ('name', 'key', 'code', 'inputs', 'cache')
+
+    def __init__(self, name: str, key: Any, code: Any, inputs: tuple, cache: dict):
+        self.name = name
+        self.key = key
+        self.code = code
+        self.inputs = inputs
+        self.cache = cache
+
+    def evaluate(self, functions: dict, namespace: dict, scope: Any = None) -> Any:
+        """Evaluate the sub-expression, or reuse its value computed in the same scope from the same inputs."""
+        if scope is None:
+            return eval(self.code, functions, namespace)
+        key, versions = (self.key, scope), tuple(child.version for child in self.inputs)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        value = eval(self.code, functions, namespace)
+        self.cache[key] = (versions, value)
+        return value
+
+
+class Optimizer:
+    """Plan the evaluation of the formulas of a tree, sharing the common sub-expressions and folding the constants."""
+    def __init__(self, root: Type[NodeMixin], fold: bool = True):
+        self.root = root
+
+        # Fold the arithmetic on constants
+        self.fold = fold
+
+        # Number of occurrences of every sub-expression found more than once, with its text
+        self.shared: Dict[Any, int] = {}
+        self.expressions: Dict[Any, str] = {}
+        self._names: Dict[Any, str] = {}
+        self._plans: Dict[int, Tuple[Type[NodeMixin], ast.Expression, List[_Temporary]]] = {}
+
+        # Values of the shared sub-expressions with the versions of their inputs, the plans keep the nodes alive so
+        # the ids in the keys can't be reused by other nodes
+        self._cache: Dict[Any, Tuple[tuple, Any]] = {}
+        _optimizers.add(self)
+
+    def nodes(self) -> List[Type[NodeMixin]]:
+        """Nodes with a formula in the tree and in the trees connected to it."""
+        return [
+            n for root in connected_roots(self.root) for n in PreOrderIter(root)
+            if not hasattr(n, 'target') and getattr(n, 'formula', None)
+        ]
+
+    def optimize(self) -> 'Optimizer':
+        """Bind an optimized evaluator to every node with a formula."""
+        trees = []
+        for node in self.nodes():
+            evaluator = node._evaluator or node.bind_formula(node.formula)
+            tree = evaluator.compiled.tree
+            trees.append((node, evaluator, fold_constants(tree) if self.fold else tree))
+
+        counts = Counter()
+        for node, evaluator, tree in trees:
+            bindings = dict(evaluator.bindings)
+            for expression in ast.walk(tree.body):
+                if isinstance(expression, _SHAREABLE) and self._inputs(expression, bindings):
+                    key = self._key(expression, bindings, evaluator.registry.functions)
+                    counts[key] += 1
+                    self.expressions.setdefault(key, ast.unparse(expression))
+        self.shared = {key: count for key, count in counts.items() if count > 1}
+
+        for node, evaluator, tree in trees:
+            self._bind(node, evaluator, tree)
+        return self
+
+    def _bind(self, node: Type[NodeMixin], evaluator: Any, tree: ast.Expression) -> None:
+        from tree.node import Evaluator
+
+        bindings, functions = dict(evaluator.bindings), evaluator.registry.functions
+        temporaries: List[_Temporary] = []
+        optimizer = self
+
+        class Rewriter(ast.NodeTransformer):
+            def generic_visit(self, expression: ast.AST) -> ast.AST:
+                shared = isinstance(expression, _SHAREABLE) and optimizer._inputs(expression, bindings)
+                key = optimizer._key(expression, bindings, functions) if shared else None
+                expression = super().generic_visit(expression)
+                if key not in optimizer.shared:
+                    return expression
+
+                name = optimizer._names.setdefault(key, f'_cse_{len(optimizer._names)}')
+                if all(t.name != name for t in temporaries):
+                    code = compile(ast.fix_missing_locations(ast.Expression(expression)), f'<shared: {name}>', 'eval')
+                    inputs = tuple(bindings[n] for n in optimizer._inputs(expression, bindings, temporaries))
+                    temporaries.append(_Temporary(name, key, code, inputs, optimizer._cache))
+                return ast.Name(id=name, ctx=ast.Load())
+
+        rewritten = ast.fix_missing_locations(Rewriter().visit(deepcopy(tree)))
+        code = compile(rewritten, f'<formula: {node.formula}>', 'eval')
+        node._evaluator = Evaluator(node, evaluator.compiled, tuple(temporaries), code)
+        node._evaluator.output, node._evaluator.output_versions = evaluator.output, evaluator.output_versions
+        self._plans[id(node)] = (node, rewritten, temporaries)
+
+    @staticmethod
+    def _inputs(expression: ast.AST, bindings: dict, temporaries: List[_Temporary] = ()) -> List[str]:
+        """Names of the inputs read by the expression, through the shared sub-expressions it uses too."""
+        names = [n.id for n in ast.walk(expression) if isinstance(n, ast.Name)]
+        inputs = {name for name in names if name in bindings}
+        for temporary in temporaries:
+            if temporary.name in names:
+                inputs.update(name for name, child in bindings.items() if child in temporary.inputs)
+        return sorted(inputs)
+
+    def _key(self, expression: Any, bindings: dict, functions: dict) -> Any:
+        """Hashable form of the expression with the names replaced by the nodes or the functions they refer to."""
+        if isinstance(expression, ast.Name):
+            child = bindings.get(expression.id)
+            if child is not None:
+                return 'input', id(getattr(child, 'target', child))
+            return 'name', expression.id, id(functions.get(expression.id))
+        if isinstance(expression, ast.Constant):
+            return 'constant', type(expression.value).__name__, expression.value
+        if isinstance(expression, ast.expr_context):
+            return None
+        if isinstance(expression, ast.AST):
+            return (type(expression).__name__, ) + tuple(
+                self._key(value, bindings, functions) for _, value in ast.iter_fields(expression)
+            )
+        if isinstance(expression, list):
+            return tuple(self._key(value, bindings, functions) for value in expression)
+        return expression
+
+    def formula(self, node: Type[NodeMixin]) -> str:
+        """Optimized formula of the node, with the shared sub-expressions replaced by their names."""
+        return ast.unparse(self._plans[id(node)][1])
+
+    def report(self) -> pd.DataFrame:
+        """Shared sub-expressions with the number of times they are used and their names."""
+        rows = [
+            {'name': self._names.get(key), 'expression': self.expressions[key], 'count': count}
+            for key, count in self.shared.items()
+        ]
+        return pd.DataFrame(rows, columns=['name', 'expression', 'count'])
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.root!r}, shared={len(self.shared)})'
+
+
+def _clear_cache(batch: Any) -> None:
+    for optimizer in list(_optimizers):
+        optimizer._cache.clear()
+
+
+subscribe('flushed', _clear_cache)
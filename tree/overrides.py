@@ -0,0 +1,245 @@
+"""Manual overrides
+
+Manual point overrides are recorded per node in an append-only, bitemporal store: every override carries the version
+and the time it was recorded at, the range of dates it is effective for, the range of points it sets, the value, the
+frequency of the points, the user and the reason. Retracting an override records the version it was retracted at, so
+the history is never lost.
+
+The series of the node is its base series with the overrides which are not retracted applied on top, the ones with the
+latest effective date and then the latest version winning. Reads as of a past version or time, and/or as of an
+effective date, only copy the rows they return, and only when an override touches them.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b * 2')
+    >>> b = Node('b', parent=a)
+    >>> b.series = pd.Series(1.0, index=pd.date_range('2022-10-01', periods=4))
+    >>> o = b.override(5.0, '2022-10-02', reason='Outage', start_effective_date='2022-09-30')
+    >>> a.series.tolist()
+    [2.0, 10.0, 2.0, 2.0]
+    >>> b.as_of(version=0).tolist()
+    [1.0, 1.0, 1.0, 1.0]
+    >>> b.retract(o.version, reason='Outage cancelled')
+    >>> a.series.tolist()
+    [2.0, 2.0, 2.0, 2.0]
+
+The module contains the following classes:
+
+- `Override`
+- `OverrideStore`
+"""
+
+import getpass
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+_NEVER = np.iinfo('int64').max
+
+# Numerical fields of the overrides, the times being nanoseconds since the epoch in UTC for the records and naive
+# for the dates, the end of the point range is exclusive
+_DTYPE = np.dtype([
+    ('version', 'i8'), ('created_at', 'i8'), ('start_effective', 'i8'), ('end_effective', 'i8'),
+    ('start_point', 'i8'), ('end_point', 'i8'), ('value', 'f8'), ('retracted_version', 'i8'), ('retracted_at', 'i8'),
+])
+
+
+class Override(NamedTuple):
+    """Manual override of a range of points of a curve."""
+    version: int
+    user: str
+    created_at: pd.Timestamp
+    start_effective_date: pd.Timestamp
+    end_effective_date: pd.Timestamp
+    start_point_date: pd.Timestamp
+    end_point_date: pd.Timestamp
+    value: float
+    frequency: str
+    reason: str
+    curve: str
+    retracted_version: Optional[int] = None
+    retraction_reason: Optional[str] = None
+
+
+def _ns(value: Any) -> int:
+    timestamp = pd.Timestamp(value)
+    return (timestamp.tz_convert(None) if timestamp.tz is not None else timestamp).value
+
+
+def _utc_ns(value: Any) -> int:
+    timestamp = pd.Timestamp(value)
+    return (timestamp.tz_localize('UTC') if timestamp.tz is None else timestamp).value
+
+
+class OverrideStore:
+    """Bitemporal store of the overrides of a node, with the base series they are applied to."""
+    def __init__(self, curve: str, base: pd.Series = None, capacity: int = 16):
+        self.curve = curve
+        self.base = base
+        self.version = 0
+        self._data = np.zeros(capacity, dtype=_DTYPE)
+        self._text: List[Tuple[str, str, str]] = []
+        self._retraction_reasons = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Override]:
+        return (self[i] for i in range(self._size))
+
+    def __getitem__(self, i: int) -> Override:
+        if not -self._size <= i < self._size:
+            raise IndexError('Override index out of range')
+        i = i % self._size
+        row, (user, frequency, reason) = self._data[i], self._text[i]
+        offset = to_offset(frequency)
+        retracted = None if row['retracted_version'] == _NEVER else int(row['retracted_version'])
+        return Override(
+            int(row['version']), user, pd.Timestamp(int(row['created_at']), tz='UTC'),
+            pd.Timestamp(int(row['start_effective'])), pd.Timestamp(int(row['end_effective'])),
+            pd.Timestamp(int(row['start_point'])), pd.Timestamp(int(row['end_point'])) - offset,
+            float(row['value']), frequency, reason, self.curve, retracted, self._retraction_reasons.get(retracted),
+        )
+
+    @property
+    def records(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def add(
+        self,
+        value: float,
+        start_point_date: Any,
+        end_point_date: Any = None,
+        start_effective_date: Any = None,
+        end_effective_date: Any = None,
+        frequency: str = 'D',
+        reason: str = '',
+        user: str = None,
+        curve: str = None,
+        created_at: Any = None,
+    ) -> Override:
+        """Record an override of the points from the start to the end date, both included, and return it."""
+        if not reason:
+            raise ValueError('A reason is required to override a curve!')
+        if curve is not None and curve != self.curve:
+            raise ValueError(f'The override is for the curve {curve!r} instead of {self.curve!r}!')
+
+        created_at = pd.Timestamp.now(tz='UTC') if created_at is None else created_at
+        start_effective_date = pd.Timestamp(created_at).tz_localize(None).normalize() \
+            if start_effective_date is None else start_effective_date
+        end_effective_date = start_effective_date if end_effective_date is None else end_effective_date
+        end_point_date = start_point_date if end_point_date is None else end_point_date
+        end_point = pd.Timestamp(end_point_date) + to_offset(frequency)
+
+        if self._size == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros(len(self._data), dtype=_DTYPE)])
+        self.version += 1
+        self._data[self._size] = (
+            self.version, _utc_ns(created_at), _ns(start_effective_date), _ns(end_effective_date),
+            _ns(start_point_date), _ns(end_point), value, _NEVER, _NEVER,
+        )
+        self._text.append((user or getpass.getuser(), frequency, reason))
+        self._size += 1
+        return self[-1]
+
+    def retract(self, version: int, reason: str = '', retracted_at: Any = None) -> Override:
+        """Retract the override recorded at the version and return it as it was."""
+        positions = np.flatnonzero(self.records['version'] == version)
+        if not len(positions) or self.records['retracted_version'][positions[0]] != _NEVER:
+            raise KeyError(f'No active override with the version {version}')
+
+        override = self[int(positions[0])]
+        self.version += 1
+        self._data['retracted_version'][positions[0]] = self.version
+        self._data['retracted_at'][positions[0]] = _utc_ns(
+            pd.Timestamp.now(tz='UTC') if retracted_at is None else retracted_at
+        )
+        self._retraction_reasons[self.version] = reason
+        return override
+
+    def select(self, version: int = None, time: Any = None, effective: Any = None) -> np.ndarray:
+        """Positions of the overrides known as of the version and the time, and effective at the date if any, in the
+        order they are applied."""
+        records = self.records
+        if version is None and time is None:
+            mask = records['retracted_version'] == _NEVER
+        else:
+            version = self.version if version is None else version
+            mask = (records['version'] <= version) & (records['retracted_version'] > version)
+            if time is not None:
+                time = _utc_ns(time)
+                mask &= (records['created_at'] <= time) & (records['retracted_at'] > time)
+        if effective is not None:
+            effective = _ns(effective)
+            mask &= (records['start_effective'] <= effective) & (records['end_effective'] >= effective)
+
+        positions = np.flatnonzero(mask)
+        return positions[np.lexsort((records['version'][positions], records['start_effective'][positions]))]
+
+    def bounds(self, index: pd.Index, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the index covered by every override, as [start, end) positions, the point dates being in the local
+        time of the index."""
+        records = self.records[positions]
+        values = index.tz_localize(None) if getattr(index, 'tz', None) is not None else index
+        if not isinstance(values, pd.DatetimeIndex):
+            values = pd.DatetimeIndex(values)
+        values = values.asi8
+        return np.searchsorted(values, records['start_point']), np.searchsorted(values, records['end_point'])
+
+    def apply(
+        self, series: pd.Series, positions: np.ndarray = None, start: int = 0, end: int = None
+    ) -> pd.Series:
+        """Return the rows from start to end of the series with the overrides applied, a copy only if one applies."""
+        end = len(series) if end is None else end
+        window = series.iloc[start:end]
+        positions = self.select() if positions is None else positions
+        if not len(positions) or window.empty:
+            return window
+
+        lower, upper = self.bounds(series.index, positions)
+        lower, upper = np.clip(lower, start, end) - start, np.clip(upper, start, end) - start
+        touched = upper > lower
+        if not touched.any():
+            return window
+
+        values = window.to_numpy(dtype='float64', copy=True)
+        for position, lo, hi in zip(positions[touched], lower[touched], upper[touched]):
+            values[lo:hi] = self._data['value'][position]
+        return pd.Series(values, index=window.index, name=window.name)
+
+    def rows(self, index: pd.Index, positions: np.ndarray) -> Optional[Tuple[int, int]]:
+        """First and last + 1 rows of the index covered by the overrides, None if they don't cover any."""
+        if not len(positions):
+            return None
+        lower, upper = self.bounds(index, positions)
+        touched = upper > lower
+        return (int(lower[touched].min()), int(upper[touched].max())) if touched.any() else None
+
+    def state(self) -> dict:
+        """Text fields and counters of the store, the records and the base series being kept apart."""
+        return {
+            'curve': self.curve, 'version': self.version, 'text': [list(t) for t in self._text],
+            'retraction_reasons': [[version, reason] for version, reason in self._retraction_reasons.items()],
+        }
+
+    @classmethod
+    def restore(cls, state: dict, records: np.ndarray, base: pd.Series = None) -> 'OverrideStore':
+        """Rebuild a store from its state and its records."""
+        store = cls(state['curve'], base, capacity=max(len(records), 16))
+        store._data[:len(records)] = records
+        store._size = len(records)
+        store._text = [tuple(t) for t in state['text']]
+        store._retraction_reasons = {int(version): reason for version, reason in state['retraction_reasons']}
+        store.version = state['version']
+        return store
+
+    def history(self) -> pd.DataFrame:
+        """Every override recorded, retracted ones included."""
+        return pd.DataFrame(list(self), columns=Override._fields).set_index('version')
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.curve!r}, overrides={len(self)}, version={self.version})'
@@ -0,0 +1,222 @@
+"""Profiling and tracing
+
+A profiler records, for every node, the number of calculations, the cumulative and last evaluation times, the time
+spent detecting whether the new series differs from the current one and the sources which triggered the node. Each
+propagated update is also traced, the trace is exported as a tree of the triggering nodes or as a Chrome trace which
+opens in chrome://tracing or Perfetto. Nothing is recorded, and nearly nothing is paid, while no profiler is active.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, Profiler
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> with Profiler() as profiler:
+    ...     b.series = pd.Series([1.0])
+    ...     c.series = pd.Series([2.0])
+    >>> profiler.report().loc['/a', 'calculations']
+    2
+    >>> profiler.stats(a).triggers
+    Counter({'/a/b': 1, '/a/c': 1})
+    >>> profiler.trace_tree()['children'][0]['name']
+    '/a'
+
+The module contains the following classes/functions:
+
+- `NodeStats`
+- `Profiler`
+- `get_profiler() -> Optional[Profiler]`
+"""
+
+import os
+import json
+import threading
+from collections import Counter
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import pandas as pd
+from anytree.node import NodeMixin
+
+# Profiler recording the propagations, None when profiling is off
+_active = None
+
+
+def get_profiler() -> Optional['Profiler']:
+    """Return the active profiler, if any."""
+    return _active
+
+
+def _path(node: Type[NodeMixin]) -> str:
+    return node.separator.join([''] + [str(n.name) for n in node.path])
+
+
+def timed(function: Callable, *args: Any) -> Tuple[Any, float]:
+    """Call the function and return its result with the duration of the call, used by the executors."""
+    start = perf_counter()
+    value = function(*args)
+    return value, perf_counter() - start
+
+
+class NodeStats:
+    """Measurements of a node."""
+    __slots__ = ('calculations', 'total_time', 'last_time', 'compare_time', 'comparisons', 'triggers')
+
+    def __init__(self):
+        self.calculations = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+        self.compare_time = 0.0
+        self.comparisons = 0
+
+        # Number of times the node was triggered per source, the path of a child or of a symbolic node in `book`
+        self.triggers = Counter()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(calculations={self.calculations}, total_time={self.total_time:.6f})'
+
+
+class Profiler:
+    """Record the calculations and the propagation traces while it is active."""
+    def __init__(self, trace: bool = True, max_updates: int = 1000):
+        # Record a trace of every update, only the statistics are kept otherwise
+        self.trace = trace
+
+        # Number of traced updates kept, the oldest are dropped first
+        self.max_updates = max_updates
+
+        self.updates: List[dict] = []
+        self._stats: Dict[int, Tuple[Type[NodeMixin], NodeStats]] = {}
+        self._update = None
+        self._count = 0
+        self._origin = perf_counter()
+        self._previous = None
+
+    def start(self) -> 'Profiler':
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def stop(self) -> None:
+        global _active
+        _active = self._previous
+
+    def __enter__(self) -> 'Profiler':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> Any:
+        self.stop()
+
+    def reset(self) -> None:
+        self.updates, self._stats, self._update, self._count = [], {}, None, 0
+
+    def stats(self, node: Type[NodeMixin]) -> NodeStats:
+        entry = self._stats.get(id(node))
+        if entry is None:
+            entry = self._stats[id(node)] = (node, NodeStats())
+        return entry[1]
+
+    def begin_update(self, batch: Any) -> None:
+        if self.trace:
+            self._update = {
+                'id': self._count, 'start': perf_counter(),
+                'duration': 0.0, 'thread': threading.get_ident(),
+                'changed': [_path(n) for n in batch.changed.values()], 'events': [],
+            }
+
+    def end_update(self, batch: Any) -> None:
+        update, self._update = self._update, None
+        if update is not None:
+            self._count += 1
+            update['duration'] = perf_counter() - update['start']
+            self.updates.append(update)
+            if len(self.updates) > self.max_updates:
+                del self.updates[0]
+
+    def calculation(self, node: Type[NodeMixin], start: float, duration: float) -> None:
+        """Record an evaluation of the formula of the node which started at the perf_counter() time."""
+        stats = self.stats(node)
+        stats.calculations += 1
+        stats.total_time += duration
+        stats.last_time = duration
+        if self._update is not None:
+            self._update['events'].append({
+                'name': _path(node), 'start': start, 'duration': duration, 'thread': threading.get_ident(),
+            })
+
+    def comparison(self, node: Type[NodeMixin], duration: float) -> None:
+        stats = self.stats(node)
+        stats.comparisons += 1
+        stats.compare_time += duration
+
+    def triggered(self, parent: Type[NodeMixin], edge: Type[NodeMixin]) -> None:
+        """Record that the edge, a child or a symbolic node of a changed node, triggers the parent."""
+        source = _path(edge)
+        self.stats(parent).triggers[source] += 1
+        if self._update is not None:
+            symlink = hasattr(edge, 'target')
+            self._update.setdefault('triggers', {}).setdefault(_path(parent), []).append(
+                {'source': _path(edge.target) if symlink else source, 'via': source if symlink else None}
+            )
+
+    def report(self) -> pd.DataFrame:
+        """Statistics per node path, the slowest first."""
+        rows = {
+            _path(node): {
+                'calculations': s.calculations, 'total_time': s.total_time, 'last_time': s.last_time,
+                'mean_time': s.total_time / s.calculations if s.calculations else 0.0,
+                'compare_time': s.compare_time, 'triggers': sum(s.triggers.values()),
+            }
+            for node, s in self._stats.values() if s.calculations or s.comparisons or s.triggers
+        }
+        columns = ['calculations', 'total_time', 'last_time', 'mean_time', 'compare_time', 'triggers']
+        return pd.DataFrame.from_dict(rows, orient='index', columns=columns).sort_values('total_time', ascending=False)
+
+    def trace_tree(self, update: int = -1) -> dict:
+        """Trace of an update as a tree, every calculated node lists the sources which triggered it."""
+        data = self.updates[update]
+        triggers = data.get('triggers', {})
+        events = {e['name']: e for e in data['events']}
+        changed = set(data['changed'])
+
+        def branch(name: str, via: str = None, seen: frozenset = frozenset()) -> dict:
+            event = events.get(name)
+            item = {'name': name, 'duration': event['duration'] if event else 0.0}
+            if via is not None:
+                item['via'] = via
+            if name in changed and event is None:
+                item['changed'] = True
+            sources = [t for t in triggers.get(name, []) if t['source'] not in seen]
+            if sources:
+                item['children'] = [branch(t['source'], t['via'], seen | {name}) for t in sources]
+            return item
+
+        sources = {t['source'] for items in triggers.values() for t in items}
+        tops = [name for name in events if name not in sources]
+        tops += [name for name in data['changed'] if name not in events and name not in sources]
+        return {'name': f"update {data['id']}", 'duration': data['duration'], 'children': [branch(n) for n in tops]}
+
+    def to_chrome_trace(self, path: str = None) -> dict:
+        """Export the traced updates in the Chrome trace event format, written to the path if one is given."""
+        pid, events = os.getpid(), []
+        for update in self.updates:
+            events.append({
+                'name': f"update {update['id']}", 'cat': 'update', 'ph': 'X', 'pid': pid, 'tid': update['thread'],
+                'ts': (update['start'] - self._origin) * 1e6, 'dur': update['duration'] * 1e6,
+                'args': {'changed': update['changed']},
+            })
+            triggers = update.get('triggers', {})
+            for event in update['events']:
+                events.append({
+                    'name': event['name'], 'cat': 'calculate', 'ph': 'X', 'pid': pid, 'tid': event['thread'],
+                    'ts': (event['start'] - self._origin) * 1e6, 'dur': event['duration'] * 1e6,
+                    'args': {'triggered_by': [t['source'] for t in triggers.get(event['name'], [])]},
+                })
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(trace, file)
+        return trace
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(nodes={len(self._stats)}, updates={len(self.updates)})'
@@ -0,0 +1,115 @@
+"""Registry of the functions that formulas are allowed to call.
+
+Examples:
+    >>> from tree import get_registry
+    >>> registry = get_registry()
+    >>> registry.names
+    ['priority', 'MAX', 'MIN', 'CLIP', 'WHERE', 'ABS', 'ROLLING_MEAN', 'SHIFT', 'CUMSUM']
+    >>> get_registry() is registry
+    True
+    >>> custom = get_registry({'DOUBLE': lambda x: x * 2})
+    >>> custom.names
+    ['DOUBLE']
+
+Registries built from a file are shared process-wide and keyed by the resolved path and the file modification time,
+so each functions file is loaded at most once however many nodes refer to it.
+
+The module contains the following classes/functions:
+
+- `FunctionRegistry`
+- `get_registry(source: Union[str, ModuleType, Mapping[str, Callable], FunctionRegistry] = None) -> FunctionRegistry`
+"""
+
+import os
+from types import ModuleType
+from importlib.util import spec_from_file_location, module_from_spec
+from typing import Any, Callable, Dict, Mapping, Tuple, Union
+
+from tree import functions
+
+_cache: Dict[Tuple[str, int], 'FunctionRegistry'] = {}
+_module_cache: Dict[str, 'FunctionRegistry'] = {}
+
+
+class FunctionRegistry:
+    """Named callables exposed to formulas, together with the namespace used to evaluate them."""
+    def __init__(self, functions: Mapping[str, Callable], source: Union[str, ModuleType, Mapping] = None):
+        for name, func in functions.items():
+            if not callable(func):
+                raise TypeError(f'Expected a callable for {name!r}!')
+
+        self.source = source
+        self.functions = dict(functions)
+        self.names = list(self.functions)
+        self.namespace = {'__builtins__': {}, **self.functions}
+
+        # Whether each compiled formula is element-wise with these functions
+        self._elementwise: Dict[Any, bool] = {}
+
+    def is_elementwise(self, compiled: Any) -> bool:
+        """Check if the compiled formula is element-wise with these functions, once per formula."""
+        result = self._elementwise.get(compiled)
+        if result is None:
+            result = self._elementwise[compiled] = compiled.is_elementwise(self.functions)
+        return result
+
+    @classmethod
+    def from_module(cls, module: ModuleType) -> 'FunctionRegistry':
+        names = getattr(module, '__all__', None)
+        if names is None:
+            names = [k for k, v in vars(module).items() if callable(v) and not k.startswith('_')]
+        return cls({name: getattr(module, name) for name in names}, source=module)
+
+    @classmethod
+    def from_path(cls, path: str) -> 'FunctionRegistry':
+        name = f'tree._registered_functions_{abs(hash(path))}'
+        spec = spec_from_file_location(name, path)
+        if spec is None:
+            raise ImportError(f'Unable to load functions from {path!r}')
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        registry = cls.from_module(module)
+        registry.source = path
+        return registry
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.functions
+
+    def __len__(self) -> int:
+        return len(self.functions)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.names!r})'
+
+
+def get_registry(source: Union[str, ModuleType, Mapping[str, Callable], FunctionRegistry] = None) -> FunctionRegistry:
+    """Return the shared registry for a functions file or module, or build one from a dict of callables."""
+    if source is None:
+        source = functions
+
+    if isinstance(source, FunctionRegistry):
+        return source
+
+    if isinstance(source, ModuleType):
+        registry = _module_cache.get(source.__name__)
+        if registry is None or registry.source is not source:
+            registry = _module_cache[source.__name__] = FunctionRegistry.from_module(source)
+        return registry
+
+    if isinstance(source, Mapping):
+        return FunctionRegistry(source, source=source)
+
+    if not isinstance(source, (str, os.PathLike)):
+        raise TypeError('Expected a path, a module or a dict of callables!')
+
+    path = os.path.realpath(source)
+    if path == os.path.realpath(functions.__file__):
+        return get_registry(functions)
+
+    key = (path, os.stat(path).st_mtime_ns)
+    registry = _cache.get(key)
+    if registry is None:
+        for stale in [k for k in _cache if k[0] == path]:
+            del _cache[stale]
+        registry = _cache[key] = FunctionRegistry.from_path(path)
+    return registry
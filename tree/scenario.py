@@ -0,0 +1,159 @@
+"""Scenario evaluation
+
+A scenario set evaluates the formulas of the ancestors of some leaves under many values of these leaves at once. Every
+shocked leaf takes a matrix of scenarios × time, the formulas run once over 2-D arrays of time × scenarios where the
+unshocked inputs are read from the live tree as single columns broadcast across the scenarios. The live tree is left
+untouched: no series is assigned, no version changes and nothing is propagated.
+
+The nodes are recalculated from their formulas whatever their trigger settings, locked and deferred nodes included.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, ScenarioSet
+    >>> a = Node('a', formula='b * c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> b.series = pd.Series([1.0, 2.0])
+    >>> c.series = pd.Series([10.0, 10.0])
+    >>> scenarios = ScenarioSet(a, {'b': [[1.0], [2.0], [3.0]]}, how='add').run()
+    >>> scenarios[a].to_numpy().tolist()
+    [[20.0, 30.0], [30.0, 40.0], [40.0, 50.0]]
+    >>> a.series.tolist()
+    [10.0, 20.0]
+
+The module contains the following classes:
+
+- `ScenarioSet`
+"""
+
+from typing import Any, Dict, List, Literal, Mapping, Type, Union
+
+import numpy as np
+import pandas as pd
+from anytree.node import NodeMixin
+
+from tree.engine import topological_order
+from tree.ingest import Ingestor
+
+_COMBINE = {'replace': lambda base, shock: shock, 'add': np.add, 'multiply': np.multiply}
+
+
+class ScenarioSet:
+    """Evaluate the ancestors of shocked leaves for every scenario at once, without changing the live tree."""
+    def __init__(
+        self,
+        root: Type[NodeMixin],
+        shocks: Mapping[Union[str, Type[NodeMixin]], Any],
+        how: Literal['replace', 'add', 'multiply'] = 'replace',
+        index: pd.Index = None,
+    ):
+        if how not in _COMBINE:
+            raise ValueError("Expected 'replace', 'add' or 'multiply'!")
+
+        self.root = root
+
+        # Combine the scenario matrices with the live series of the leaves
+        # 1. 'replace' - the matrix holds the values of the leaf
+        # 2. 'add' - the matrix holds shifts added to the live series
+        # 3. 'multiply' - the matrix holds factors applied to the live series
+        self.how = how
+
+        lookup = Ingestor.build_index(root)
+        self.shocks = {self._resolve(lookup, key): value for key, value in shocks.items()}
+        if not self.shocks:
+            raise ValueError('Expected at least one shocked node!')
+
+        first = next(iter(self.shocks))
+        self.index = index if index is not None else first.series.index
+        self.scenarios = self._scenarios()
+        self._values: Dict[int, np.ndarray] = {}
+        self._nodes: Dict[int, Type[NodeMixin]] = {}
+
+    @staticmethod
+    def _resolve(lookup: dict, key: Union[str, Type[NodeMixin]]) -> Type[NodeMixin]:
+        if isinstance(key, NodeMixin):
+            return getattr(key, 'target', key)
+        try:
+            return lookup[key]
+        except KeyError:
+            raise KeyError(f'No node found for {key!r}, the name is either missing or ambiguous')
+
+    def _scenarios(self) -> pd.Index:
+        for value in self.shocks.values():
+            if isinstance(value, pd.DataFrame):
+                return value.index.rename('scenario')
+        sizes = {len(np.atleast_1d(np.asarray(value, dtype='float64'))) for value in self.shocks.values()}
+        if len(sizes) != 1:
+            raise ValueError('Expected the same number of scenarios for every node!')
+        return pd.RangeIndex(sizes.pop(), name='scenario')
+
+    def _live(self, node: Type[NodeMixin]) -> np.ndarray:
+        """Live series of the node aligned on the index, as a single column."""
+        series = node.series
+        if not series.index.equals(self.index):
+            series = series.reindex(self.index)
+        return series.to_numpy(dtype='float64', na_value=np.nan)[:, None]
+
+    def _matrix(self, node: Type[NodeMixin], value: Any) -> np.ndarray:
+        """Values of a shocked node as time × scenarios."""
+        if isinstance(value, pd.DataFrame):
+            if not value.index.equals(self.scenarios):
+                raise ValueError(f"The scenarios of '{node.name}' differ from the others!")
+            matrix = value.reindex(columns=self.index).to_numpy(dtype='float64').T
+        else:
+            matrix = np.asarray(value, dtype='float64')
+            if matrix.ndim < 2:
+                matrix = matrix.reshape(-1, 1)
+            if matrix.shape[0] != len(self.scenarios):
+                raise ValueError(f"Expected {len(self.scenarios)} scenarios for '{node.name}'!")
+            matrix = matrix.T
+        base = self._live(node) if self.how != 'replace' else None
+        return np.broadcast_to(_COMBINE[self.how](base, matrix), (len(self.index), len(self.scenarios)))
+
+    def run(self) -> 'ScenarioSet':
+        """Evaluate the ancestors of the shocked nodes in topological order."""
+        shape = (len(self.index), len(self.scenarios))
+        values = {id(node): self._matrix(node, value) for node, value in self.shocks.items()}
+        nodes = {id(node): node for node in self.shocks}
+        for node in topological_order(list(self.shocks)):
+            if id(node) in values or hasattr(node, 'target') or not node.formula:
+                continue
+            evaluator = node._evaluator or node.bind_formula(node.formula)
+            namespace = {}
+            for name, child in evaluator.bindings:
+                target = getattr(child, 'target', child)
+                namespace[name] = values[id(target)] if id(target) in values else self._live(target)
+            # The plain formula, the optimized code of the evaluator reads shared values computed on the live series
+            result = eval(evaluator.compiled.code, evaluator.registry.namespace, namespace)
+            if isinstance(result, (pd.Series, pd.DataFrame)):
+                result = result.to_numpy(dtype='float64')
+            result = np.asarray(result, dtype='float64')
+            values[id(node)] = np.broadcast_to(result[:, None] if result.ndim == 1 else result, shape)
+            nodes[id(node)] = node
+        self._values, self._nodes = values, nodes
+        return self
+
+    @property
+    def nodes(self) -> List[Type[NodeMixin]]:
+        """Nodes evaluated under the scenarios, the shocked ones included."""
+        return list(self._nodes.values())
+
+    def __contains__(self, node: Type[NodeMixin]) -> bool:
+        return id(getattr(node, 'target', node)) in self._values
+
+    def values(self, node: Type[NodeMixin]) -> np.ndarray:
+        """Values of the node as a time × scenarios array, the live series is broadcast if the node isn't affected."""
+        node = getattr(node, 'target', node)
+        value = self._values.get(id(node))
+        if value is None:
+            value = np.broadcast_to(self._live(node), (len(self.index), len(self.scenarios)))
+        return value
+
+    def __getitem__(self, node: Union[str, Type[NodeMixin]]) -> pd.DataFrame:
+        """Values of the node as a DataFrame indexed by scenario, with one column per row of the index."""
+        if not isinstance(node, NodeMixin):
+            node = self._resolve(Ingestor.build_index(self.root), node)
+        return pd.DataFrame(self.values(node).T, index=self.scenarios, columns=self.index)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(scenarios={len(self.scenarios)}, nodes={len(self._values)}, how={self.how!r})'
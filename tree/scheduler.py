@@ -0,0 +1,128 @@
+"""Parallel scheduler
+
+Nodes of the same level of the dependency graph don't depend on each other, their formulas are evaluated concurrently
+on an executor and the results are stored in the topological order, so the outcome is the same as a serial run.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node, Scheduler
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a, formula='x * 2')
+    >>> c = Node('c', parent=a, formula='y * 2')
+    >>> x = Node('x', parent=b)
+    >>> y = Node('y', parent=c)
+    >>> with Scheduler('thread', max_workers=2) as scheduler, a.batch(scheduler=scheduler):
+    ...     x.series = pd.Series([1.0])
+    ...     y.series = pd.Series([2.0])
+    >>> a.series
+    0    6.0
+    dtype: float64
+
+The thread pool suits the NumPy/pandas kernels which release the GIL, the process pool suits heavy custom functions.
+With the process pool the formula is evaluated from its text, the registry of the node must come from a module, a file
+or a dict of picklable functions.
+
+The module contains the following classes/functions:
+
+- `Scheduler`
+- `evaluate_formula(formula: str, source: Any, namespace: dict) -> Any`
+"""
+
+from importlib import import_module
+from time import perf_counter
+from types import ModuleType
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, List, Literal, Type, Union
+
+from anytree.node import NodeMixin
+
+from tree import profiling
+from tree.utils import compile_formula
+from tree.registry import get_registry
+
+
+def evaluate_formula(formula: str, source: Any, namespace: dict) -> Any:
+    """Evaluate a formula from its text, used by the workers of a process pool."""
+    if isinstance(source, str) and source.startswith('module:'):
+        source = import_module(source[len('module:'):])
+    return eval(compile_formula(formula).code, get_registry(source).namespace, namespace)
+
+
+class Scheduler:
+    """Evaluate the nodes of a level concurrently, falling back to a serial run for small levels."""
+    def __init__(
+        self,
+        executor: Union[Literal['serial', 'thread', 'process'], Executor] = 'thread',
+        max_workers: int = None,
+        min_parallel: int = 2,
+    ):
+        if executor not in ('serial', 'thread', 'process') and not isinstance(executor, Executor):
+            raise TypeError("Expected 'serial', 'thread', 'process' or an Executor!")
+
+        self.kind = executor if isinstance(executor, str) else 'process' \
+            if isinstance(executor, ProcessPoolExecutor) else 'thread'
+        self.max_workers = max_workers
+
+        # Levels with fewer nodes than this are evaluated in the calling thread
+        self.min_parallel = min_parallel
+
+        self._executor = executor if isinstance(executor, Executor) else None
+        self._owned = self._executor is None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def calculate(self, nodes: List[Type[NodeMixin]]) -> None:
+        """Calculate independent nodes and store the results in the given order."""
+        if self.kind == 'serial' or len(nodes) < self.min_parallel:
+            for node in nodes:
+                node.calculate()
+            return
+
+        plans = [(node, node.prepare()) for node in nodes]
+        plans = [(node, plan) for node, plan in plans if plan is not None]
+        if len(plans) < self.min_parallel:
+            for node, (versions, start) in plans:
+                node.commit(versions, start, node.evaluate(start))
+            return
+
+        profiler = profiling._active
+        begin = perf_counter()
+        futures = [self._submit(node, start, profiler is not None) for node, (_, start) in plans]
+        for (node, (versions, start)), future in zip(plans, futures):
+            value = future.result()
+            if profiler is not None:
+                value, duration = value
+                profiler.calculation(node, begin, duration)
+            node.commit(versions, start, value)
+
+    def _submit(self, node: Type[NodeMixin], start: Any, timed: bool = False):
+        evaluator = node._evaluator
+        if self.kind != 'process':
+            args = (evaluator, start)
+        else:
+            source = evaluator.registry.source
+            if isinstance(source, ModuleType):
+                source = f'module:{source.__name__}'
+            args = (evaluate_formula, node.formula, source, evaluator.namespace(start))
+        return self.executor.submit(profiling.timed, *args) if timed else self.executor.submit(*args)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._owned and self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self) -> 'Scheduler':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> Any:
+        self.shutdown()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.kind!r}, max_workers={self.max_workers})'
@@ -0,0 +1,286 @@
+"""Shared computed graph
+
+A publisher owns the tree and writes the computed series of every node into memory-mapped files, one generation per
+published version, and then atomically replaces a JSON manifest mapping the node paths to their values. Readers in other
+processes attach to the directory, their series are read-only NumPy views on the mapped files and the page cache holds
+a single copy of the values whatever the number of readers. A reader detects a new version by checking the manifest,
+the writer is never locked and the generation a reader is attached to stays valid until it refreshes.
+
+The children of a node are written next to each other, so the dataframe of a node whose children share an index and a
+dtype is a view on the mapped values too. Object series can't be shared without copies and are rejected.
+
+Examples:
+    >>> import tempfile
+    >>> import pandas as pd
+    >>> from tree import Node, Publisher, Reader
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> b.series = pd.Series([1.0, 2.0])
+    >>> c.series = pd.Series([3.0, 4.0])
+    >>> path = tempfile.mkdtemp()
+    >>> publisher = Publisher(a, path)
+    >>> publisher.publish()
+    1
+    >>> reader = Reader(path)
+    >>> reader.series('/a').tolist()
+    [4.0, 6.0]
+    >>> b.series = pd.Series([2.0, 2.0])
+    >>> publisher.publish(), reader.refresh(), reader.version
+    (2, True, 2)
+    >>> reader.dataframe('/a').to_numpy().tolist()
+    [[2.0, 3.0], [2.0, 4.0]]
+
+On Windows the generations mapped by a reader can't be removed, set `keep` high enough for the readers to refresh.
+
+The module contains the following classes:
+
+- `Publisher`
+- `Reader`
+"""
+
+import os
+import json
+import shutil
+from time import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Type
+
+import numpy as np
+import pandas as pd
+from anytree import LevelOrderIter
+from anytree.node import NodeMixin
+
+from tree.engine import connected_roots, subscribe, unsubscribe
+from tree.changes import current_epoch, changes_since
+from tree.snapshot import _Indexes, _load_index
+
+FORMAT_VERSION = 2
+MANIFEST = 'manifest.json'
+
+
+def _path(node: Type[NodeMixin]) -> str:
+    return node.separator.join([''] + [str(n.name) for n in node.path])
+
+
+def _read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+class Publisher:
+    """Write the computed series of a tree, and of the trees connected to it, into shared memory-mapped files."""
+    def __init__(self, root: Type[NodeMixin], path: str, keep: int = 2):
+        self.root = root
+        self.path = path
+
+        # Number of generations kept on disk, the older ones are removed once a new version is published
+        self.keep = max(keep, 1)
+
+        os.makedirs(path, exist_ok=True)
+        manifest = _read_manifest(path)
+        self.version = manifest['version'] if manifest is not None else 0
+        self._generations = deque(sorted(
+            (name for name in os.listdir(path) if name.startswith('v') and name[1:].isdigit()),
+            key=lambda name: int(name[1:]),
+        ))
+        self._epoch = None
+        self._publishing = False
+
+    def publish(self, force: bool = False) -> int:
+        """Write a new generation if any node changed since the last one, and return the published version."""
+        # Reading the series while publishing can propagate the recalculation of lazy nodes
+        if self._publishing:
+            return self.version
+        self._publishing = True
+        try:
+            return self._publish(force)
+        finally:
+            self._publishing = False
+
+    def _publish(self, force: bool) -> int:
+        roots = connected_roots(self.root)
+        if not force and self._epoch is not None and not any(len(changes_since(r, self._epoch, False)) for r in roots):
+            return self.version
+
+        version = self.version + 1
+        generation = f'v{version}'
+        directory = os.path.join(self.path, generation)
+        os.makedirs(directory, exist_ok=True)
+
+        indexes = _Indexes(directory)
+        entries: Dict[str, dict] = {}
+        layout: Dict[str, List[np.ndarray]] = {}
+        sizes: Dict[str, int] = {}
+        for node in self._nodes(roots):
+            if hasattr(node, 'target'):
+                entries[_path(node)] = {'target': _path(node.target)}
+                continue
+            series = node.series
+            values = series.to_numpy()
+            if values.dtype == object:
+                shutil.rmtree(directory)
+                raise TypeError(f"The series of '{_path(node)}' has the object dtype and can't be shared!")
+            dtype = values.dtype.str
+            entries[_path(node)] = {
+                'dtype': dtype, 'offset': sizes.get(dtype, 0), 'length': len(values),
+                'index': indexes.add(series.index),
+                'name': series.name if series.name is None or isinstance(series.name, (str, int, float)) else None,
+                'children': [_path(c) for c in node.children], 'names': [str(c.name) for c in node.children],
+            }
+            layout.setdefault(dtype, []).append(values)
+            sizes[dtype] = sizes.get(dtype, 0) + len(values)
+
+        # Reading the series of lazy trees may have recalculated some of them
+        epoch = current_epoch()
+        files = {}
+        for i, (dtype, arrays) in enumerate(layout.items()):
+            files[dtype] = f'values_{i}.npy'
+            block = np.lib.format.open_memmap(os.path.join(directory, files[dtype]), 'w+', dtype, (sizes[dtype], ))
+            offset = 0
+            for values in arrays:
+                block[offset:offset + len(values)] = values
+                offset += len(values)
+            block.flush()
+            del block
+
+        manifest = {
+            'format': FORMAT_VERSION, 'version': version, 'generation': generation, 'published_at': time(),
+            'nodes': entries, 'indexes': indexes.entries, 'values': files,
+        }
+        temporary = os.path.join(self.path, f'.{MANIFEST}.{os.getpid()}')
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary, os.path.join(self.path, MANIFEST))
+
+        self.version, self._epoch = version, epoch
+        self._generations.append(generation)
+        while len(self._generations) > self.keep:
+            shutil.rmtree(os.path.join(self.path, self._generations.popleft()), ignore_errors=True)
+        return version
+
+    @staticmethod
+    def _nodes(roots: List[Type[NodeMixin]]) -> List[Type[NodeMixin]]:
+        """Nodes in level order, the children of a node being written next to each other."""
+        return [n for root in roots for n in LevelOrderIter(root)]
+
+    def start(self) -> 'Publisher':
+        """Publish after every propagation changing the trees."""
+        subscribe('flushed', self._on_flushed)
+        self.publish()
+        return self
+
+    def stop(self) -> None:
+        unsubscribe('flushed', self._on_flushed)
+
+    def __enter__(self) -> 'Publisher':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> Any:
+        self.stop()
+
+    def _on_flushed(self, batch: Any) -> None:
+        self.publish()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path!r}, version={self.version})'
+
+
+class Reader:
+    """Read-only views on the series published into a directory."""
+    def __init__(self, path: str):
+        self.path = path
+        self.version = 0
+        self._manifest = None
+        self._stat = None
+        self._indexes: List[pd.Index] = []
+        self._blocks: Dict[str, np.ndarray] = {}
+        if not self.refresh():
+            raise FileNotFoundError(f'Nothing has been published into {path!r}')
+
+    def refresh(self) -> bool:
+        """Attach to the latest generation, return True if a new version was found."""
+        missing = None
+        while True:
+            try:
+                stat = os.stat(os.path.join(self.path, MANIFEST))
+            except FileNotFoundError:
+                return False
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if key == self._stat:
+                return False
+
+            manifest = _read_manifest(self.path)
+            if manifest is None or manifest['version'] == self.version:
+                self._stat = key
+                return False
+            if manifest['format'] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported format: {manifest['format']}")
+
+            directory = os.path.join(self.path, manifest['generation'])
+            try:
+                indexes = [_load_index(directory, entry, 'r') for entry in manifest['indexes']]
+                blocks = {
+                    dtype: np.load(os.path.join(directory, name), mmap_mode='r')
+                    for dtype, name in manifest['values'].items()
+                }
+            except FileNotFoundError:
+                # The generation has been removed by newer versions in the meantime
+                if missing == manifest['version']:
+                    raise
+                missing = manifest['version']
+                continue
+
+            self._manifest, self._stat, self._indexes, self._blocks = manifest, key, indexes, blocks
+            self.version = manifest['version']
+            return True
+
+    @property
+    def paths(self) -> List[str]:
+        return list(self._manifest['nodes'])
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._manifest['nodes']
+
+    def _entry(self, path: str) -> dict:
+        try:
+            entry = self._manifest['nodes'][path]
+        except KeyError:
+            raise KeyError(f'No node published at {path!r}')
+        return self._manifest['nodes'][entry['target']] if 'target' in entry else entry
+
+    def values(self, path: str) -> np.ndarray:
+        """Read-only view on the values of the node."""
+        entry = self._entry(path)
+        return self._blocks[entry['dtype']][entry['offset']:entry['offset'] + entry['length']]
+
+    def series(self, path: str) -> pd.Series:
+        entry = self._entry(path)
+        return pd.Series(self.values(path), index=self._indexes[entry['index']], name=entry['name'], copy=False)
+
+    def dataframe(self, path: str) -> pd.DataFrame:
+        """Series of the children of the node as columns, a view on the mapped values when they are contiguous."""
+        entry = self._entry(path)
+        children = entry['children']
+        if not children:
+            return self.series(path).to_frame()
+
+        names = entry['names']
+        entries = [self._manifest['nodes'][child] for child in children]
+        first = entries[0]
+        length = first.get('length')
+        if all(
+            'target' not in e and e['dtype'] == first['dtype'] and e['index'] == first['index']
+            and e['offset'] == first['offset'] + i * length for i, e in enumerate(entries)
+        ):
+            block = self._blocks[first['dtype']][first['offset']:first['offset'] + len(entries) * length]
+            return pd.DataFrame(
+                block.reshape(len(entries), length).T, index=self._indexes[first['index']], columns=names, copy=False,
+            )
+        return pd.concat([self.series(child) for child in children], axis=1, keys=names)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path!r}, version={self.version})'
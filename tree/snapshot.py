@@ -0,0 +1,271 @@
+"""Snapshot and restore
+
+A snapshot is a directory holding a JSON manifest with the topology, the symbolic nodes, the attributes and the
+formulas, plus one `.npy` file per value dtype and per distinct index. Restoring memory-maps the arrays copy-on-write,
+the series are views on the files built on first read and the version bookkeeping is restored, so a warm tree doesn't
+recalculate anything until its inputs change.
+
+Examples:
+    >>> import tempfile
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b * 2')
+    >>> b = Node('b', parent=a)
+    >>> b.series = pd.Series([1.0, 2.0])
+    >>> path = tempfile.mkdtemp()
+    >>> a.save(path)
+    >>> root = Node.load(path)
+    >>> root.series
+    0    2.0
+    1    4.0
+    dtype: float64
+
+Trees connected through symbolic nodes are saved together, `Node.load` returns the root of the tree that was saved.
+The manual overrides of the nodes are saved with their history and the base series they are applied to.
+
+The module contains the following functions:
+
+- `save(node: Node, path: str) -> None`
+- `load(path: str, mmap: bool = True, functions: Any = None) -> Node`
+"""
+
+import gc
+import os
+import json
+from importlib import import_module
+from functools import partial
+from types import ModuleType
+from typing import Any, Dict, List, Type
+
+import numpy as np
+import pandas as pd
+from anytree import PreOrderIter
+from anytree.node import NodeMixin
+
+from tree.engine import connected_roots
+from tree.changes import next_epoch
+from tree.inference import node_type
+from tree.overrides import OverrideStore
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+_ATTRIBUTES = (
+    'desc', 'curve', 'assert_series_equal', 'trigger_type', 'is_trigger_event', 'is_deferred', 'is_dirty', 'is_locked', 'version',
+)
+
+
+class _Indexes:
+    """Distinct indexes of the snapshot, shared by the series using the same one."""
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: List[dict] = []
+        self._indexes: List[pd.Index] = []
+        self._ids: Dict[int, int] = {}
+
+    def add(self, index: pd.Index) -> int:
+        key = self._ids.get(id(index))
+        if key is not None:
+            return key
+        for key, other in enumerate(self._indexes):
+            if len(other) == len(index) and type(other) is type(index) and other.equals(index):
+                break
+        else:
+            key = len(self._indexes)
+            self._indexes.append(index)
+            self.entries.append(self._write(key, index))
+        self._ids[id(index)] = key
+        return key
+
+    def _write(self, key: int, index: pd.Index) -> dict:
+        entry = {'name': index.name}
+        if isinstance(index, pd.RangeIndex):
+            entry.update(kind='range', start=index.start, stop=index.stop, step=index.step)
+            return entry
+        if isinstance(index, pd.MultiIndex):
+            raise TypeError('MultiIndex is not supported by snapshots!')
+
+        if isinstance(index, pd.DatetimeIndex):
+            entry.update(kind='datetime', tz=str(index.tz) if index.tz else None, freq=index.freqstr)
+            values = index.asi8
+        else:
+            values = index.to_numpy()
+            entry.update(kind='array')
+        entry['file'] = f'index_{key}.npy'
+        np.save(os.path.join(self.path, entry['file']), values, allow_pickle=values.dtype == object)
+        return entry
+
+
+def save(node: Type[NodeMixin], path: str) -> None:
+    """Save the tree of the node, and the trees connected to it, into the directory."""
+    os.makedirs(path, exist_ok=True)
+    indexes = _Indexes(path)
+    blocks: Dict[str, List[np.ndarray]] = {}
+    sizes: Dict[str, int] = {}
+    entries, ids = [], {}
+
+    def add(series: pd.Series) -> dict:
+        values = series.to_numpy()
+        dtype = values.dtype.str if values.dtype != object else 'object'
+        blocks.setdefault(dtype, []).append(values)
+        sizes[dtype] = sizes.get(dtype, 0) + len(values)
+        return {
+            'dtype': dtype,
+            'offset': sizes[dtype] - len(values),
+            'length': len(values),
+            'index': indexes.add(series.index),
+            'name': series.name if series.name is None or isinstance(series.name, (str, int, float)) else None,
+        }
+
+    roots = connected_roots(node)
+    for root in roots:
+        for n in PreOrderIter(root):
+            ids[id(n)] = len(ids)
+
+    for root in roots:
+        for n in PreOrderIter(root):
+            entry = {'parent': None if n.parent is None else ids[id(n.parent)]}
+            if hasattr(n, 'target'):
+                entry.update(kind='symlink', target=ids[id(n.target)])
+                entries.append(entry)
+                continue
+
+            entry.update(kind='node', name=n.name, formula=n.formula, read_only=n.read_only, retention=n.retention)
+            entry['evaluation'] = n._evaluation
+            entry.update({k: getattr(n, k) for k in _ATTRIBUTES})
+            entry.update(
+                full_version=n._full_version,
+                input_versions=None if n._input_versions is None else list(n._input_versions),
+                calculated_version=n._calculated_version,
+                columnar=n._store is not None,
+            )
+            source = n.registry.source
+            entry['functions'] = f'module:{source.__name__}' if isinstance(source, ModuleType) else \
+                source if isinstance(source, str) else None
+
+            entry['series'] = add(n.series)
+            store = n._overrides
+            if store is not None:
+                name = f'overrides_{len(entries)}.npy'
+                np.save(os.path.join(path, name), store.records)
+                entry['overrides'] = {**store.state(), 'file': name, 'base': add(store.base)}
+            entries.append(entry)
+
+    files = {}
+    for i, (dtype, arrays) in enumerate(blocks.items()):
+        files[dtype] = f'values_{i}.npy'
+        values = np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+        np.save(os.path.join(path, files[dtype]), values, allow_pickle=dtype == 'object')
+
+    manifest = {'format': FORMAT_VERSION, 'nodes': entries, 'indexes': indexes.entries, 'values': files}
+    with open(os.path.join(path, MANIFEST), 'w') as file:
+        json.dump(manifest, file)
+
+
+def _load_index(path: str, entry: dict, mmap_mode: str) -> pd.Index:
+    if entry['kind'] == 'range':
+        return pd.RangeIndex(entry['start'], entry['stop'], entry['step'], name=entry['name'])
+
+    file = os.path.join(path, entry['file'])
+    try:
+        values = np.load(file, mmap_mode=mmap_mode)
+    except ValueError:
+        values = np.load(file, allow_pickle=True)
+
+    if entry['kind'] == 'datetime':
+        index = pd.DatetimeIndex(np.asarray(values).view('M8[ns]'), name=entry['name'], freq=entry['freq'])
+        return index.tz_localize('UTC').tz_convert(entry['tz']) if entry['tz'] else index
+    return pd.Index(values, name=entry['name'], copy=False)
+
+
+def load(path: str, mmap: bool = True, functions: Any = None) -> Type[NodeMixin]:
+    """Restore the trees saved in the directory and return the root of the saved tree."""
+    # The cyclic garbage collector would walk the trees many times while thousands of nodes are created at once
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load(path, mmap, functions)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _load(path: str, mmap: bool, functions: Any) -> Type[NodeMixin]:
+    from tree.node import Node, SymlinkNode
+
+    with open(os.path.join(path, MANIFEST)) as file:
+        manifest = json.load(file)
+    if manifest['format'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format: {manifest['format']}")
+
+    mmap_mode = 'c' if mmap else None
+    indexes = [_load_index(path, e, mmap_mode) for e in manifest['indexes']]
+    blocks = {}
+    for dtype, name in manifest['values'].items():
+        allow_pickle = dtype == 'object'
+        blocks[dtype] = np.load(os.path.join(path, name), mmap_mode=None if allow_pickle else mmap_mode,
+                                allow_pickle=allow_pickle)
+
+    entries = manifest['nodes']
+    nodes: List[Any] = [None] * len(entries)
+    for i, entry in enumerate(entries):
+        if entry['kind'] != 'node':
+            continue
+        s = entry['series']
+        values = blocks[s['dtype']][s['offset']:s['offset'] + s['length']]
+        source = functions if functions is not None else entry['functions']
+        if isinstance(source, str) and source.startswith('module:'):
+            source = import_module(source[len('module:'):])
+        nodes[i] = Node(
+            entry['name'], curve=entry.get('curve'), desc=entry['desc'], formula=entry['formula'], functions=source,
+            assert_series_equal=entry['assert_series_equal'], trigger_type=entry['trigger_type'],
+            is_deferred=entry['is_deferred'],
+            retention=entry.get('retention', 'keep'), evaluation=entry.get('evaluation', 'eager'),
+        )
+        nodes[i]._loader = partial(pd.Series, values, index=indexes[s['index']], name=s['name'], copy=False)
+        if 'overrides' in entry:
+            state, b = entry['overrides'], entry['overrides']['base']
+            base = pd.Series(
+                blocks[b['dtype']][b['offset']:b['offset'] + b['length']], index=indexes[b['index']], name=b['name'],
+                copy=False,
+            )
+            nodes[i]._overrides = OverrideStore.restore(state, np.load(os.path.join(path, state['file'])), base)
+
+    children: Dict[int, List[Any]] = {}
+    for i, entry in enumerate(entries):
+        if entry['kind'] == 'symlink':
+            nodes[i] = SymlinkNode(nodes[entry['target']])
+        if entry['parent'] is not None:
+            children.setdefault(entry['parent'], []).append(nodes[i])
+    for parent, items in children.items():
+        nodes[parent].children = items
+
+    for node, entry in zip(nodes, entries):
+        if entry['kind'] == 'node' and entry['parent'] is None and entry['columnar']:
+            node.use_columnar()
+
+    epoch = next_epoch()
+    for node, entry in zip(nodes, entries):
+        if entry['kind'] != 'node':
+            continue
+        node.modified_epoch = node._full_epoch = epoch
+        node.read_only = entry['read_only']
+        node.version, node._full_version = entry['version'], entry['full_version']
+        node.__dict__.update(
+            is_dirty=entry['is_dirty'], is_locked=entry['is_locked'], is_trigger_event=entry['is_trigger_event'],
+        )
+        node._input_versions = None if entry['input_versions'] is None else tuple(entry['input_versions'])
+        node._calculated_version = entry['calculated_version']
+
+    # The trigger flags are restored above without the descriptors, the parents count their blocking children once
+    for node, entry in zip(nodes, entries):
+        if entry['kind'] == 'node' and node.children:
+            node._blocking = sum(c._blocks_trigger for c in node.children if node.references(c.name))
+
+    # Reject the formulas which don't match the restored children before anything is propagated, the inferred
+    # outputs are kept on the evaluators
+    memo = {}
+    for node, entry in zip(nodes, entries):
+        if entry['kind'] == 'node' and node.formula and node.children:
+            node_type(node, memo)
+    return nodes[0]
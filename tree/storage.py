@@ -0,0 +1,169 @@
+"""Columnar storage
+
+A column store keeps the values of every node of a tree in one 2-D float array sharing a single index. The series of
+a node is a zero-copy view on its column and formulas are evaluated on the raw arrays, the alignment happens once when
+a series is assigned instead of at every arithmetic operation.
+
+Examples:
+    >>> import pandas as pd
+    >>> from tree import Node
+    >>> a = Node('a', formula='b + c')
+    >>> b = Node('b', parent=a)
+    >>> c = Node('c', parent=a)
+    >>> store = a.use_columnar(pd.RangeIndex(3))
+    >>> b.series = pd.Series([1.0, 2.0, 3.0])
+    >>> c.series = pd.Series([1.0], index=[2])
+    >>> a.series
+    0    NaN
+    1    NaN
+    2    4.0
+    Name: a, dtype: float64
+    >>> a.series.values.base is store.values.base
+    True
+
+The module contains the following classes:
+
+- `ColumnStore`
+"""
+
+from typing import Any, Dict, Iterable, List, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from anytree.node import NodeMixin
+
+
+class ColumnStore:
+    """One 2-D float array plus one shared index holding the series of many nodes."""
+    def __init__(self, index: pd.Index, capacity: int = 16):
+        self.index = index
+        self._values = np.full((capacity, max(len(index), 1)), np.nan)
+        self._slots: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+        self._views: Dict[int, pd.Series] = {}
+
+    @property
+    def values(self) -> np.ndarray:
+        """All the columns, one row per slot, as a view on the block."""
+        return self._values[:self._size, :len(self.index)]
+
+    def __contains__(self, node: Type[NodeMixin]) -> bool:
+        return id(getattr(node, 'target', node)) in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def nbytes(self) -> int:
+        return self._values.nbytes
+
+    def add(self, node: Type[NodeMixin], series: pd.Series = None) -> int:
+        """Allocate a column for the node, initialised from the series if any."""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._size == self._values.shape[0]:
+                self._resize(self._size * 2, self._values.shape[1])
+            slot = self._size
+            self._size += 1
+        self._slots[id(node)] = slot
+        self._values[slot, :len(self.index)] = np.nan if series is None or series.empty else self.align(series)
+        return slot
+
+    def remove(self, node: Type[NodeMixin]) -> pd.Series:
+        """Release the column of the node and return a copy of its series."""
+        series = self.series(node).copy()
+        slot = self._slots.pop(id(node))
+        self._views.pop(slot, None)
+        self._free.append(slot)
+        return series
+
+    def column(self, node: Type[NodeMixin], start: Any = None) -> np.ndarray:
+        """Raw values of the node from the start label onwards, aligned on the shared index."""
+        slot = self._slots.get(id(getattr(node, 'target', node)))
+        pos = 0 if start is None else self.index.searchsorted(start)
+        if slot is None:
+            return self.align(node.series, pos)
+        return self._values[slot, pos:len(self.index)]
+
+    def series(self, node: Type[NodeMixin]) -> pd.Series:
+        """Zero-copy series on the column of the node."""
+        slot = self._slots[id(getattr(node, 'target', node))]
+        view = self._views.get(slot)
+        if view is None:
+            view = self._views[slot] = pd.Series(
+                self._values[slot, :len(self.index)], index=self.index, name=node.name, copy=False
+            )
+        return view
+
+    def frame(self, nodes: Iterable[Type[NodeMixin]]) -> pd.DataFrame:
+        """DataFrame on the columns of the nodes, a view when the columns are contiguous."""
+        nodes = list(nodes)
+        slots = [self._slots[id(getattr(n, 'target', n))] for n in nodes]
+        if slots and slots == list(range(slots[0], slots[0] + len(slots))):
+            values = self._values[slots[0]:slots[-1] + 1, :len(self.index)]
+        else:
+            values = self._values[slots, :len(self.index)]
+        return pd.DataFrame(values.T, index=self.index, columns=[n.name for n in nodes], copy=False)
+
+    def align(self, series: Any, pos: int = 0) -> np.ndarray:
+        """Align a series on the shared index from the position onwards, labels outside of the index are dropped."""
+        index = self.index[pos:] if pos else self.index
+        if not isinstance(series, pd.Series):
+            values = np.asarray(series, dtype='float64')
+            return values if values.shape == (len(index), ) else np.broadcast_to(values, (len(index), ))
+        if not series.index.equals(index):
+            series = series.reindex(index)
+        return series.to_numpy(dtype='float64', na_value=np.nan)
+
+    def align_tail(self, tail: pd.Series) -> Tuple[Any, np.ndarray]:
+        """Extend the shared index with the labels past its end and return the start of the tail with its values."""
+        if not tail.index.is_monotonic_increasing:
+            raise ValueError('Expected a monotonic increasing index!')
+        if len(self.index) and tail.index[-1] > self.index[-1]:
+            self.extend(tail.index[tail.index > self.index[-1]])
+        elif not len(self.index):
+            self.extend(tail.index)
+
+        start = tail.index[0]
+        pos = self.index.searchsorted(start)
+        indexer = self.index[pos:].get_indexer(tail.index)
+        if (indexer < 0).any():
+            raise ValueError('Expected the labels of the tail to be in the shared index!')
+        values = np.full(len(self.index) - pos, np.nan)
+        values[indexer] = tail.to_numpy(dtype='float64', na_value=np.nan)
+        return start, values
+
+    def write(self, node: Type[NodeMixin], values: Any, start: Any = None) -> None:
+        """Write the values into the column of the node, from the start label onwards if any."""
+        pos = 0 if start is None else self.index.searchsorted(start)
+        slot = self._slots[id(getattr(node, 'target', node))]
+        if isinstance(values, pd.Series):
+            values = self.align(values, pos)
+        self._values[slot, pos:len(self.index)] = values
+
+    def equal(self, node: Type[NodeMixin], values: Any, start: Any = None) -> bool:
+        """Check if the column of the node already holds the values."""
+        if isinstance(values, pd.Series) or np.ndim(values) == 0:
+            values = self.align(values, 0 if start is None else self.index.searchsorted(start))
+        return bool(np.array_equal(self.column(node, start), values, equal_nan=True))
+
+    def extend(self, labels: pd.Index) -> None:
+        """Append labels to the shared index, the new rows of every column are NaN."""
+        n = len(self.index)
+        self.index = self.index.append(labels)
+        if len(self.index) > self._values.shape[1]:
+            self._resize(self._values.shape[0], max(len(self.index), 2 * self._values.shape[1]))
+        self._values[:, n:len(self.index)] = np.nan
+        self._views.clear()
+
+    def _resize(self, n_columns: int, n_rows: int) -> None:
+        values = np.full((n_columns, n_rows), np.nan)
+        rows, columns = min(n_rows, self._values.shape[1]), min(n_columns, self._values.shape[0])
+        values[:columns, :rows] = self._values[:columns, :rows]
+        self._values = values
+        self._views.clear()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(columns={len(self)}, rows={len(self.index)})'
@@ -8,15 +8,35 @@ Examples:
     Traceback (most recent call last):
      ...
     tree.exceptions.FormulaError: Please use registered keywords.
+    >>> from tree import compile_formula
+    >>> compile_formula('b + c') is compile_formula('b + c')
+    True
+    >>> sorted(compile_formula('MAX(b, 0) + c').names)
+    ['MAX', 'b', 'c']
+    >>> import pandas as pd
+    >>> from tree import series_equal
+    >>> series_equal(pd.Series([1.0, None]), pd.Series([1.0, None]))
+    True
 
 The module contains the following classes/functions:
 
 - `FormulaTransformer`
+- `CompiledFormula`
+- `compile_formula(formula: str) -> CompiledFormula`
+- `series_equal(left: pd.Series, right: pd.Series) -> bool`
 """
 
 
-from typing import List, Any
-from ast import Name, NodeTransformer
+from functools import lru_cache
+from types import CodeType
+
+import numpy as np
+import pandas as pd
+from typing import List, Any, FrozenSet, Mapping, Callable
+from ast import (
+    Name, NodeTransformer, Expression, parse, walk, expr_context, operator, unaryop, cmpop, boolop,
+    BinOp, UnaryOp, Compare, BoolOp, Constant, Call,
+)
 from tree.exceptions import FormulaError
 
 
@@ -30,3 +50,73 @@ class FormulaTransformer(NodeTransformer):
             raise FormulaError(f'Unregistered keyword: {node.id}')
 
         return node
+
+
+_ELEMENTWISE_NODES = (
+    Name, Constant, BinOp, UnaryOp, Compare, BoolOp, expr_context, operator, unaryop, cmpop, boolop,
+)
+
+
+class CompiledFormula:
+    """Parsed and compiled formula, shared by every node using the same formula text."""
+    __slots__ = ('formula', 'tree', 'code', 'names')
+
+    def __init__(self, formula: str, tree: Expression, code: CodeType, names: FrozenSet[str]):
+        self.formula = formula
+        self.tree = tree
+        self.code = code
+        self.names = names
+
+    def validate(self, registered_kwargs: List[str]) -> None:
+        """Raise FormulaError if the formula uses a keyword outside of the registered ones."""
+        # The names are collected at compile time, the tree is only walked to report the unregistered one
+        if not self.names.issubset(registered_kwargs):
+            FormulaTransformer(registered_kwargs).visit(self.tree)
+
+    def is_elementwise(self, functions: Mapping[str, Callable]) -> bool:
+        """Check if every row of the result only depends on the same row of the inputs."""
+        for node in walk(self.tree.body):
+            if isinstance(node, Call):
+                func = functions.get(node.func.id) if isinstance(node.func, Name) else None
+                if not getattr(func, 'elementwise', False) or node.keywords:
+                    return False
+            elif not isinstance(node, _ELEMENTWISE_NODES):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.formula!r})'
+
+
+@lru_cache(maxsize=None)
+def compile_formula(formula: str) -> CompiledFormula:
+    """Parse and compile a formula expression once, identical formula texts share the same result."""
+    try:
+        tree = parse(formula, mode='eval')
+    except SyntaxError:
+        raise SyntaxError(f'Invalid formula: "{formula}"')
+
+    code = compile(tree, f'<formula: {formula}>', 'eval')
+    names = frozenset(n.id for n in walk(tree) if isinstance(n, Name))
+    return CompiledFormula(formula, tree, code, names)
+
+
+def series_equal(left: pd.Series, right: pd.Series) -> bool:
+    """Cheap equivalent of pd.testing.assert_series_equal, from the identity down to a vectorized comparison."""
+    if left is right:
+        return True
+    if left is None or right is None:
+        return False
+    if left.shape != right.shape or left.dtype != right.dtype or left.name != right.name:
+        return False
+    if not (left.index is right.index or left.index.equals(right.index)):
+        return False
+
+    lv, rv = left.to_numpy(), right.to_numpy()
+    if lv is rv:
+        return True
+    if lv.dtype.kind in 'fc':
+        return bool(np.array_equal(lv, rv, equal_nan=True))
+    if lv.dtype.kind in 'biu':
+        return bool(np.array_equal(lv, rv))
+    return left.equals(right)